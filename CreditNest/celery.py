@@ -1,8 +1,22 @@
 import os
 from celery import Celery
+from celery.schedules import crontab
+from django.conf import settings
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'CreditNest.settings')
 
 app = Celery('CreditNest')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+
+app.conf.beat_schedule = {}
+if settings.PORTFOLIO_SNAPSHOT_ENABLED:
+    app.conf.beat_schedule['refresh-portfolio-snapshot'] = {
+        'task': 'credit.tasks.refresh_portfolio_snapshot',
+        'schedule': settings.PORTFOLIO_SNAPSHOT_INTERVAL,
+    }
+if settings.DIRTY_RECOMPUTE_ENABLED:
+    app.conf.beat_schedule['recompute-dirty-customers'] = {
+        'task': 'credit.tasks.recompute_dirty_customers',
+        'schedule': crontab(hour=settings.DIRTY_RECOMPUTE_HOUR, minute=settings.DIRTY_RECOMPUTE_MINUTE),
+    }
@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+from importlib.util import find_spec
+import os
 from pathlib import Path
+import django
 import environ
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -49,6 +53,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover every other middleware
+    'credit.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -91,9 +97,38 @@ DATABASES = {
         'PASSWORD': env.str('DB_PASSWORD'),
         'PORT': env.str('DB_PORT'),
         'ATOMIC_REQUESTS': True,
+        # Persistent connections are reused across requests for this many seconds (0 closes them after every
+        # request); health checks ping a reused connection before handing it out
+        'CONN_MAX_AGE': env.int('DB_CONN_MAX_AGE', default=60),
+        'CONN_HEALTH_CHECKS': env.bool('DB_CONN_HEALTH_CHECKS', default=True),
     }
 }
 
+# Optional server-side connection pool (PostgreSQL with psycopg 3 and psycopg_pool, from psycopg[binary,pool]). ASGI
+# processes should use it: each ASGI request runs in its own context, so persistent connections cannot be reused there.
+DB_POOL = env.bool('DB_POOL', default=False)
+DB_POOL_MIN_SIZE = env.int('DB_POOL_MIN_SIZE', default=2)
+DB_POOL_MAX_SIZE = env.int('DB_POOL_MAX_SIZE', default=10)
+# Seconds a request waits for a free pooled connection before failing
+DB_POOL_TIMEOUT = env.float('DB_POOL_TIMEOUT', default=10.0)
+
+if DB_POOL and DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    # Falling back to per-request connections would quietly open one connection per ASGI request
+    if django.VERSION < (5, 1):
+        raise ImproperlyConfigured("DB_POOL needs Django 5.1 or later for its connection pool; Django "
+                                   f"{django.get_version()} is installed. Upgrade Django or unset DB_POOL.")
+    if not find_spec('psycopg_pool'):
+        raise ImproperlyConfigured("DB_POOL is set but psycopg_pool is not installed; install psycopg[binary,pool] "
+                                   "or unset DB_POOL.")
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': DB_POOL_TIMEOUT,
+        },
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -133,9 +168,137 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# W040 is raised for the INCLUDE columns of Loan's credit_loan_cust_end_idx on backends without covering indexes
+# (e.g. SQLite for local benchmarks); safe to silence, as they still build the (customer_id, end_date) index
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
+# Request instrumentation behind /metrics. A sampled share of requests runs under cProfile, and the profiles of
+# those slower than INSTRUMENTATION_PROFILE_MIN_SECONDS are dumped to INSTRUMENTATION_PROFILE_DIR. Server-Timing
+# response headers expose each request's own timings.
+INSTRUMENTATION_ENABLED = env.bool('INSTRUMENTATION_ENABLED', default=True)
+INSTRUMENTATION_PROFILE_SAMPLE_RATE = env.float('INSTRUMENTATION_PROFILE_SAMPLE_RATE', default=0.0)
+INSTRUMENTATION_PROFILE_MIN_SECONDS = env.float('INSTRUMENTATION_PROFILE_MIN_SECONDS', default=0.5)
+INSTRUMENTATION_PROFILE_DIR = env.str('INSTRUMENTATION_PROFILE_DIR', default=str(BASE_DIR / 'profiles'))
+INSTRUMENTATION_SERVER_TIMING = env.bool('INSTRUMENTATION_SERVER_TIMING', default=DEBUG)
+
+# Loan origination: retries of a savepoint that hit a deadlock, serialization failure or lock timeout, the base of
+# their jittered exponential backoff in seconds, and whether loans beyond the customer's available limit are refused
+LOAN_ORIGINATION_RETRIES = env.int('LOAN_ORIGINATION_RETRIES', default=3)
+LOAN_ORIGINATION_BACKOFF = env.float('LOAN_ORIGINATION_BACKOFF', default=0.01)
+LOAN_ENFORCE_APPROVED_LIMIT = env.bool('LOAN_ENFORCE_APPROVED_LIMIT', default=False)
+
+# Upper bound on customers accepted by a single /register/bulk/ request
+REGISTER_BULK_MAX_SIZE = env.int('REGISTER_BULK_MAX_SIZE', default=10000)
+# Ids each process reserves at a time from a table's sequence for single inserts with explicit ids
+ID_BLOCK_SIZE = env.int('ID_BLOCK_SIZE', default=50)
+
+# Upper bound on applications accepted by a single /check-eligibility/batch/ request
+ELIGIBILITY_BATCH_MAX_SIZE = env.int('ELIGIBILITY_BATCH_MAX_SIZE', default=50000)
+
+# Loans per view-loans page when paging with ?cursor= or ?limit=, the largest ?limit= accepted, and rows fetched
+# from the database and written per block by /loans/export/
+VIEW_LOANS_PAGE_SIZE = env.int('VIEW_LOANS_PAGE_SIZE', default=100)
+VIEW_LOANS_PAGE_MAX_SIZE = env.int('VIEW_LOANS_PAGE_MAX_SIZE', default=1000)
+LOAN_EXPORT_CHUNK_SIZE = env.int('LOAN_EXPORT_CHUNK_SIZE', default=2000)
+
+# Upper bound on events accepted by a single /payments/bulk/ request, and events loaded per transaction from a
+# payments file
+PAYMENTS_BULK_MAX_SIZE = env.int('PAYMENTS_BULK_MAX_SIZE', default=50000)
+PAYMENTS_CHUNK_SIZE = env.int('PAYMENTS_CHUNK_SIZE', default=50000)
+
+# Customers locked and recomputed per transaction when recomputing every customer after an ingest
+DEBT_RECOMPUTE_CHUNK_SIZE = env.int('DEBT_RECOMPUTE_CHUNK_SIZE', default=5000)
+
+# Loans whose amortization schedules are built and written per batch
+SCHEDULE_CHUNK_SIZE = env.int('SCHEDULE_CHUNK_SIZE', default=1000)
+
+# Rows read, deduplicated and loaded per transaction by the streaming ingestion pipeline
+INGEST_CHUNK_SIZE = env.int('INGEST_CHUNK_SIZE', default=50000)
+# Row-range shards each input file is split into; shards of one file load in parallel across Celery workers
+INGEST_SHARDS = env.int('INGEST_SHARDS', default=4)
+# Where Excel inputs are converted to CSV before sharding; must be shared by every Celery worker
+INGEST_CONVERTED_DIR = env.str('INGEST_CONVERTED_DIR', default=str(BASE_DIR / 'ingest'))
+
+# Database connections one ASGI process's async views may hold open at the same time
+ASYNC_DB_MAX_CONNECTIONS = env.int('ASYNC_DB_MAX_CONNECTIONS', default=10)
+
+REDIS_URL = env.str('REDIS_URL', default="redis://localhost:6379")
+
 if env.str('CURRENT_ENV') == 'LOCAL':
     CELERY_BROKER_URL = "redis://localhost:6379"
     CELERY_RESULT_BACKEND = CELERY_BROKER_URL
+    REDIS_URL = CELERY_BROKER_URL
 elif env.str('CURRENT_ENV') == 'DOCKER':
     CELERY_BROKER_URL = "redis://redis:6379"
     CELERY_RESULT_BACKEND = CELERY_BROKER_URL
+    REDIS_URL = CELERY_BROKER_URL
+
+# Customer summary cache: 'redis' shares summaries between processes, 'locmem' keeps them in an in-process LRU.
+# With the fallback switch on, an unreachable Redis degrades to the in-process LRU instead of to the database.
+CUSTOMER_SUMMARY_CACHE = env.str('CUSTOMER_SUMMARY_CACHE', default='redis')
+CUSTOMER_SUMMARY_CACHE_FALLBACK = env.bool('CUSTOMER_SUMMARY_CACHE_FALLBACK', default=True)
+CUSTOMER_SUMMARY_CACHE_TTL = env.int('CUSTOMER_SUMMARY_CACHE_TTL', default=300)
+CUSTOMER_SUMMARY_LOCAL_MAX_ENTRIES = env.int('CUSTOMER_SUMMARY_LOCAL_MAX_ENTRIES', default=10000)
+# Seconds to keep using the fallback before trying Redis again
+CUSTOMER_SUMMARY_REDIS_RETRY_INTERVAL = env.int('CUSTOMER_SUMMARY_REDIS_RETRY_INTERVAL', default=30)
+
+# Portfolio summary: rows streamed per column chunk, and an optional snapshot refreshed by Celery beat so
+# requests read a precomputed summary instead of scanning the book
+PORTFOLIO_CHUNK_SIZE = env.int('PORTFOLIO_CHUNK_SIZE', default=20000)
+PORTFOLIO_SNAPSHOT_ENABLED = env.bool('PORTFOLIO_SNAPSHOT_ENABLED', default=False)
+PORTFOLIO_SNAPSHOT_INTERVAL = env.int('PORTFOLIO_SNAPSHOT_INTERVAL', default=300)
+# Snapshots expire if beat stops refreshing them, so requests fall back to computing live
+PORTFOLIO_SNAPSHOT_TTL = env.int('PORTFOLIO_SNAPSHOT_TTL', default=PORTFOLIO_SNAPSHOT_INTERVAL * 3)
+
+# Nightly recompute of customers marked dirty by new loans, EMI updates or loans reaching their end date, at
+# DIRTY_RECOMPUTE_HOUR:DIRTY_RECOMPUTE_MINUTE UTC, split into customer_id % DIRTY_RECOMPUTE_SHARDS shards across
+# Celery workers and committed DIRTY_RECOMPUTE_CHUNK_SIZE customers at a time
+DIRTY_RECOMPUTE_ENABLED = env.bool('DIRTY_RECOMPUTE_ENABLED', default=True)
+DIRTY_RECOMPUTE_HOUR = env.int('DIRTY_RECOMPUTE_HOUR', default=2)
+DIRTY_RECOMPUTE_MINUTE = env.int('DIRTY_RECOMPUTE_MINUTE', default=0)
+DIRTY_RECOMPUTE_SHARDS = env.int('DIRTY_RECOMPUTE_SHARDS', default=4)
+DIRTY_RECOMPUTE_CHUNK_SIZE = env.int('DIRTY_RECOMPUTE_CHUNK_SIZE', default=2000)
+
+# Parquet snapshots of customers and loans for offline jobs: where they are written, how many customer_id
+# hash buckets each table is split into, rows streamed per batch, and how many past snapshots are kept
+SNAPSHOT_DIR = env.str('SNAPSHOT_DIR', default=str(BASE_DIR / 'snapshots'))
+SNAPSHOT_BUCKETS = env.int('SNAPSHOT_BUCKETS', default=8)
+SNAPSHOT_CHUNK_SIZE = env.int('SNAPSHOT_CHUNK_SIZE', default=50000)
+SNAPSHOT_KEEP = env.int('SNAPSHOT_KEEP', default=3)
+
+# Eligibility rules (score bands, rate floors and the EMI cap) as JSON or YAML. An active EligibilityRuleSet row
+# overrides the file. Each process checks both for changes at most every ELIGIBILITY_RULES_CHECK_INTERVAL seconds.
+ELIGIBILITY_RULES_FILE = env.str('ELIGIBILITY_RULES_FILE', default=str(BASE_DIR / 'credit/eligibility_rules.json'))
+ELIGIBILITY_RULES_CHECK_INTERVAL = env.float('ELIGIBILITY_RULES_CHECK_INTERVAL', default=5.0)
+
+# Policy simulation: worker processes for large policy grids in the simulate_policies command (the endpoint runs in
+# the web process), the smallest grid worth spreading across them, and the most policies one /policy/simulate/
+# request may compare
+POLICY_SIMULATION_WORKERS = env.int('POLICY_SIMULATION_WORKERS', default=os.cpu_count() or 1)
+POLICY_SIMULATION_PARALLEL_MIN_POLICIES = env.int('POLICY_SIMULATION_PARALLEL_MIN_POLICIES', default=8)
+POLICY_SIMULATION_MAX_POLICIES = env.int('POLICY_SIMULATION_MAX_POLICIES', default=200)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'snapshots': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'creditnest',
+        'OPTIONS': {
+            'socket_connect_timeout': 0.25,
+            'socket_timeout': 0.25,
+        },
+    },
+    'customer_summary': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'TIMEOUT': CUSTOMER_SUMMARY_CACHE_TTL,
+        'KEY_PREFIX': 'creditnest',
+        'OPTIONS': {
+            'socket_connect_timeout': 0.25,
+            'socket_timeout': 0.25,
+        },
+    },
+}
@@ -17,14 +17,30 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 from credit.views import *
+from credit.async_views import AsyncCheckEligibilityView, AsyncViewLoanView, AsyncViewLoansView
 
 urlpatterns = [
     path('', Home.as_view()),
     path('admin/', admin.site.urls),
     path('fill-data/', FillDataView.as_view()),
+    path('ingest-progress/<int:run_id>/', IngestProgressView.as_view(), name='ingest-progress'),
     path('register/', RegisterView.as_view(), name='register'),
+    path('register/bulk/', RegisterBulkView.as_view(), name='register-bulk'),
     path('check-eligibility/', CheckEligibilityView.as_view()),
+    path('check-eligibility/batch/', CheckEligibilityBatchView.as_view(), name='check-eligibility-batch'),
     path('create-loan/', CreateLoanView.as_view(), name='create-loan'),
+    path('payments/bulk/', PaymentsBulkView.as_view(), name='payments-bulk'),
     path('view-loan/<int:loan_id>/', ViewLoanView.as_view(), name='view-loan'),
-    path('view-loans/<int:customer_id>', ViewLoansView.as_view(), name='view-loans')
+    path('view-loans/<int:customer_id>', ViewLoansView.as_view(), name='view-loans'),
+    path('loans/export/', LoanExportView.as_view(), name='loans-export'),
+    path('loan-schedule/<int:loan_id>/', LoanScheduleView.as_view(), name='loan-schedule'),
+    path('portfolio/summary/', PortfolioSummaryView.as_view(), name='portfolio-summary'),
+    path('policy/simulate/', PolicySimulationView.as_view(), name='policy-simulate'),
+    path('cache-stats/', CacheStatsView.as_view(), name='cache-stats'),
+    path('pool-stats/', PoolStatsView.as_view(), name='pool-stats'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    # Async read endpoints for ASGI deployments
+    path('async/check-eligibility/', AsyncCheckEligibilityView.as_view(), name='async-check-eligibility'),
+    path('async/view-loan/<int:loan_id>/', AsyncViewLoanView.as_view(), name='async-view-loan'),
+    path('async/view-loans/<int:customer_id>', AsyncViewLoansView.as_view(), name='async-view-loans'),
 ]
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CreditConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "credit"
+
+    def ready(self):
+        # Registers the connection counters behind the pool stats and the per-request query recorder
+        from . import db, instrumentation  # noqa: F401
@@ -0,0 +1,116 @@
+import asyncio
+import contextlib
+import json
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connections, transaction
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .cache import customer_summaries
+from .listings import aloan_page
+from .models import Customer, Loan
+from .rendering import SINGLE_LOAN_DETAIL, FastJSONResponse
+from .rules import eligibility_rules
+from .serializers import CheckEligibilityRequestSerializer, LoanPageSerializer
+from .views import eligibility_response
+
+# Async counterparts of the read endpoints, meant to be served by an ASGI server (see CreditNest/asgi.py).
+# The async ORM still runs each query on a worker thread with its own connection, so database work is
+# gated by a per-event-loop semaphore that caps the connections one process holds open at a time.
+
+_db_slots = weakref.WeakKeyDictionary()
+
+
+def db_slots():
+    loop = asyncio.get_running_loop()
+    if loop not in _db_slots:
+        _db_slots[loop] = asyncio.Semaphore(settings.ASYNC_DB_MAX_CONNECTIONS)
+    return _db_slots[loop]
+
+
+@contextlib.asynccontextmanager
+async def database_slot():
+    async with db_slots():
+        try:
+            yield
+        finally:
+            # Hand the connection back (to the pool, when configured) before releasing the slot, so open
+            # connections never exceed the bound. Each ASGI request has its own connection context, so a
+            # persistent connection left open here could never be reused.
+            await sync_to_async(connections.close_all)()
+
+
+class AsyncAPIView(View):
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # ATOMIC_REQUESTS cannot wrap async views; these endpoints only read. Like DRF's APIView they
+        # are API endpoints without session auth, so CSRF does not apply.
+        return csrf_exempt(transaction.non_atomic_requests(super().as_view(**initkwargs)))
+
+    def parse_json(self, request):
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError as e:
+            raise ValueError(f'JSON parse error - {e}')
+
+
+class AsyncCheckEligibilityView(AsyncAPIView):
+    async def post(self, request):
+        try:
+            data = self.parse_json(request)
+        except ValueError as e:
+            return JsonResponse({'detail': str(e)}, status=400)
+        serializer = CheckEligibilityRequestSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+
+        customer_id = serializer.validated_data['customer_id']
+        try:
+            async with database_slot():
+                summary = await customer_summaries.aget(customer_id)
+                rules = await eligibility_rules.aget()
+        except ObjectDoesNotExist:
+            return JsonResponse({'error': 'Customer not found.'}, status=404)
+        return FastJSONResponse(eligibility_response(Customer(**summary['customer']), serializer.validated_data,
+                                                     rules=rules))
+
+
+class AsyncViewLoanView(AsyncAPIView):
+    async def get(self, request, loan_id):
+        async with database_slot():
+            loan = await SINGLE_LOAN_DETAIL.values(Loan.objects.filter(loan_id=loan_id)).afirst()
+        if loan is None:
+            return JsonResponse({'error': 'Loan not found.'}, status=404)
+        return FastJSONResponse(SINGLE_LOAN_DETAIL.row(loan))
+
+
+class AsyncViewLoansView(AsyncAPIView):
+    async def get(self, request, customer_id):
+        if 'cursor' in request.GET or 'limit' in request.GET:
+            return await self.get_page(request, customer_id)
+        try:
+            async with database_slot():
+                summary = await customer_summaries.aget(customer_id)
+        except ObjectDoesNotExist:
+            return JsonResponse({'error': 'Customer not found.'}, status=404)
+        return FastJSONResponse(summary['loans'])
+
+    async def get_page(self, request, customer_id):
+        serializer = LoanPageSerializer(data=request.GET)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+        async with database_slot():
+            loans, next_cursor = await aloan_page(customer_id, serializer.validated_data['cursor'],
+                                                  serializer.validated_data.get('limit'))
+            exists = bool(loans) or await Customer.objects.filter(customer_id=customer_id).aexists()
+        if not exists:
+            return JsonResponse({'error': 'Customer not found.'}, status=404)
+        response = FastJSONResponse(loans)
+        if next_cursor is not None:
+            response['X-Next-Cursor'] = str(next_cursor)
+        return response
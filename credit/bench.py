@@ -0,0 +1,222 @@
+import contextlib
+import datetime
+import os
+import random
+import tempfile
+
+import django
+from dateutil.relativedelta import relativedelta
+from django.db import connection, connections
+
+from credit import finance
+from credit.models import Customer, Loan
+from credit.tasks import recompute_all_customers, refresh_loan_schedules
+
+FIRST_NAMES = ['Aaron', 'Abbey', 'Beth', 'Carlos', 'Dana', 'Elias', 'Fiona', 'Gopal', 'Hana', 'Ivan', 'Jaya', 'Kofi']
+LAST_NAMES = ['Walker', 'Shah', 'Mendez', 'Okafor', 'Ito', 'Novak', 'Singh', 'Berg', 'Costa', 'Reyes']
+
+
+def generate_customers(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    customers = []
+    for _ in range(count):
+        monthly_salary = rng.randrange(20000, 250000, 1000)
+        customers.append(Customer(
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=rng.choice(LAST_NAMES),
+            age=rng.randint(21, 65),
+            phone_number=str(rng.randint(7000000000, 9999999999)),
+            monthly_salary=monthly_salary,
+            approved_limit=round(36 * monthly_salary, -5),
+        ))
+    return customers
+
+
+def generate_loans(customers: list, loans_per_customer: int, seed: int = 0, today: datetime.date = None) -> list:
+    rng = random.Random(seed)
+    today = today or datetime.date.today()
+    loans = []
+    for customer in customers:
+        for _ in range(loans_per_customer):
+            loan_amount = rng.randrange(50000, 1000000, 5000)
+            tenure = rng.choice([6, 12, 24, 36, 60, 84, 120])
+            interest_rate = round(rng.uniform(6, 20), 2)
+            start_date = today - datetime.timedelta(days=rng.randint(0, 365 * 8))
+            end_date = start_date + relativedelta(months=+tenure)
+            elapsed = min(tenure, (today.year - start_date.year) * 12 + today.month - start_date.month)
+            loans.append(Loan(
+                customer=customer,
+                loan_amount=loan_amount,
+                tenure=tenure,
+                interest_rate=interest_rate,
+                monthly_repayment=round(finance.pmt(finance.monthly_rate(interest_rate), tenure, loan_amount), 2),
+                emis_paid_on_time=rng.randint(0, max(elapsed, 0)),
+                start_date=start_date,
+                end_date=end_date,
+            ))
+    return loans
+
+
+def seed_dataset(customers: int, loans_per_customer: int, seed: int = 0, batch_size: int = 2000) -> list:
+    """Insert a deterministic synthetic book and return the created customers."""
+    created = Customer.objects.bulk_create(generate_customers(customers, seed=seed), batch_size=batch_size)
+    Loan.objects.bulk_create(generate_loans(created, loans_per_customer, seed=seed), batch_size=batch_size)
+    recompute_all_customers()
+    refresh_loan_schedules()
+    return created
+
+
+def legacy_check_eligibility(credit_score, interest_rate, monthly_salary, active_emi_total):
+    # The if/elif chain check_eligibility used before the rules were data-driven
+    if active_emi_total > monthly_salary * 0.5:
+        return False, interest_rate
+    if credit_score > 50:
+        return True, interest_rate
+    if credit_score > 30:
+        return True, max(interest_rate, 12)
+    if credit_score > 10:
+        return True, max(interest_rate, 16)
+    return False, interest_rate
+
+
+# Relative frequency of each endpoint in generated request logs, roughly matching read-heavy production traffic
+REQUEST_MIX = [
+    ('view-loans', 30),
+    ('check-eligibility', 30),
+    ('view-loan', 12),
+    ('loan-schedule', 3),
+    ('create-loan', 8),
+    ('register', 5),
+    ('check-eligibility-batch', 3),
+    ('ingest-progress', 3),
+    ('cache-stats', 3),
+    ('home', 3),
+    # Only sync handlers serve the replay, so these measure the async views' own overhead rather than ASGI gains
+    ('async-check-eligibility', 2),
+    ('async-view-loans', 2),
+    ('async-view-loan', 1),
+    ('pool-stats', 1),
+    ('portfolio-summary', 1),
+    ('policy-simulate', 1),
+    ('register-bulk', 1),
+    ('metrics', 1),
+    ('payments-bulk', 2),
+    ('loans-export', 1),
+]
+
+
+# Endpoints that have async counterparts under /async/
+READ_REQUEST_MIX = [
+    ('view-loans', 40),
+    ('check-eligibility', 40),
+    ('view-loan', 20),
+]
+
+
+def generate_request_log(customer_ids: list, loan_ids: list, count: int, seed: int = 0, ingest_run_id: int = 1,
+                         batch_size: int = 100, mix: list = None) -> list:
+    """Deterministic request log entries ({"method", "path", "body"}) drawn from the endpoints of `mix`.
+
+    REQUEST_MIX, the default, covers every API endpoint except /fill-data/, which queues a full Celery ingest, and
+    the admin.
+    """
+    rng = random.Random(seed)
+    names, weights = zip(*(mix or REQUEST_MIX))
+
+    def application():
+        return {
+            'customer_id': rng.choice(customer_ids),
+            'loan_amount': rng.randrange(10000, 500000, 1000),
+            'interest_rate': round(rng.uniform(6, 20), 2),
+            'tenure': rng.choice([6, 12, 24, 36]),
+        }
+
+    def payment():
+        return {
+            'loan_id': rng.choice(loan_ids),
+            'paid_on': (datetime.date.today() - datetime.timedelta(days=rng.randint(0, 60))).isoformat(),
+            'amount': rng.randrange(1000, 50000, 100),
+            'on_time': rng.random() < 0.9,
+            'reference': f'loadtest-{rng.getrandbits(64):016x}',
+        }
+
+    def registration():
+        return {
+            'first_name': rng.choice(FIRST_NAMES),
+            'last_name': rng.choice(LAST_NAMES),
+            'age': rng.randint(21, 65),
+            'monthly_income': rng.randrange(20000, 250000, 1000),
+            'phone_number': str(rng.randint(7000000000, 9999999999)),
+        }
+
+    log = []
+    for name in rng.choices(names, weights=weights, k=count):
+        if name == 'view-loans':
+            entry = {'method': 'GET', 'path': f'/view-loans/{rng.choice(customer_ids)}'}
+        elif name == 'view-loan':
+            entry = {'method': 'GET', 'path': f'/view-loan/{rng.choice(loan_ids)}/'}
+        elif name == 'loan-schedule':
+            entry = {'method': 'GET', 'path': f'/loan-schedule/{rng.choice(loan_ids)}/'}
+        elif name == 'check-eligibility':
+            entry = {'method': 'POST', 'path': '/check-eligibility/', 'body': application()}
+        elif name == 'create-loan':
+            entry = {'method': 'POST', 'path': '/create-loan/', 'body': application()}
+        elif name == 'check-eligibility-batch':
+            entry = {'method': 'POST', 'path': '/check-eligibility/batch/',
+                     'body': {'applications': [application() for _ in range(batch_size)]}}
+        elif name == 'register':
+            entry = {'method': 'POST', 'path': '/register/', 'body': registration()}
+        elif name == 'async-check-eligibility':
+            entry = {'method': 'POST', 'path': '/async/check-eligibility/', 'body': application()}
+        elif name == 'async-view-loans':
+            entry = {'method': 'GET', 'path': f'/async/view-loans/{rng.choice(customer_ids)}'}
+        elif name == 'async-view-loan':
+            entry = {'method': 'GET', 'path': f'/async/view-loan/{rng.choice(loan_ids)}/'}
+        elif name == 'ingest-progress':
+            entry = {'method': 'GET', 'path': f'/ingest-progress/{ingest_run_id}/'}
+        elif name == 'cache-stats':
+            entry = {'method': 'GET', 'path': '/cache-stats/'}
+        elif name == 'pool-stats':
+            entry = {'method': 'GET', 'path': '/pool-stats/'}
+        elif name == 'portfolio-summary':
+            entry = {'method': 'GET', 'path': '/portfolio/summary/'}
+        elif name == 'policy-simulate':
+            # The live rules against a grid of EMI caps over the whole book
+            entry = {'method': 'POST', 'path': '/policy/simulate/',
+                     'body': {'grid': {'emi_to_income_cap': [0.4, 0.5, 0.6]}}}
+        elif name == 'register-bulk':
+            entry = {'method': 'POST', 'path': '/register/bulk/',
+                     'body': {'customers': [registration() for _ in range(batch_size)]}}
+        elif name == 'metrics':
+            entry = {'method': 'GET', 'path': '/metrics'}
+        elif name == 'payments-bulk':
+            entry = {'method': 'POST', 'path': '/payments/bulk/',
+                     'body': {'payments': [payment() for _ in range(batch_size)]}}
+        elif name == 'loans-export':
+            # One customer's loans, so each export stays comparable in size to a view-loans page
+            entry = {'method': 'GET', 'path': f'/loans/export/?output=ndjson&customer_id={rng.choice(customer_ids)}'}
+        else:
+            entry = {'method': 'GET', 'path': '/'}
+        log.append(entry)
+    return log
+
+
+@contextlib.contextmanager
+def throwaway_database(keepdb: bool = False):
+    """Run the block against a fresh test database that several threads or connections can share."""
+    if connection.vendor == 'sqlite':
+        # Worker threads need a shared on-disk database rather than per-connection in-memory ones
+        test_settings = connection.settings_dict['TEST']
+        test_settings['NAME'] = test_settings['NAME'] or os.path.join(tempfile.gettempdir(),
+                                                                      'creditnest_loadtest.sqlite3')
+        connection.settings_dict['OPTIONS']['timeout'] = 30
+        if django.VERSION >= (5, 1):
+            # Concurrent writers queue on the database lock instead of failing on lock upgrades. The option is new in
+            # Django 5.1; before it, overlapping writes can still fail with "database is locked".
+            connection.settings_dict['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+    old_name = connection.creation.create_test_db(verbosity=0, serialize=False, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
@@ -0,0 +1,183 @@
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from redis.exceptions import RedisError
+
+from credit.models import Customer, Loan
+from credit.rendering import LOAN_DETAIL
+
+# Bump whenever the shape of a cached summary changes so old entries are never read back
+SUMMARY_SCHEMA_VERSION = 1
+SUMMARY_CUSTOMER_FIELDS = ('customer_id', 'monthly_salary', 'approved_limit', 'current_debt', 'credit_score',
+                           'active_emi_total')
+
+
+class LRUCache:
+    """Small thread-safe in-process cache with per-entry expiry and least-recently-used eviction."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] is not None and entry[0] < now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[1]
+        return found
+
+    def set(self, key, value, timeout=None):
+        expires_at = time.monotonic() + timeout if timeout is not None else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def active_loans(customer_id):
+    return Loan.objects.filter(customer_id=customer_id, end_date__gte=datetime.date.today()).order_by('loan_id')
+
+
+def load_customer_summary(customer_id):
+    customer = Customer.objects.values(*SUMMARY_CUSTOMER_FIELDS).get(customer_id=customer_id)
+    return {'customer': customer, 'loans': LOAN_DETAIL.rows(active_loans(customer_id))}
+
+
+async def aload_customer_summary(customer_id):
+    customer = await Customer.objects.values(*SUMMARY_CUSTOMER_FIELDS).aget(customer_id=customer_id)
+    return {'customer': customer, 'loans': await LOAN_DETAIL.arows(active_loans(customer_id))}
+
+
+class CustomerSummaryCache:
+    """Read-through cache of per-customer summaries (cached scoring columns and active loans).
+
+    Entries carry the cache generation and the day they were built: bumping the generation invalidates every
+    summary at once (after an ingest), and active-loan lists never outlive the day they were computed for.
+    """
+
+    generation_key = f'customer-summary:v{SUMMARY_SCHEMA_VERSION}:generation'
+
+    def __init__(self, alias='customer_summary'):
+        self.alias = alias
+        self.local = LRUCache(settings.CUSTOMER_SUMMARY_LOCAL_MAX_ENTRIES)
+        self._redis_retry_at = 0
+        self._stats_lock = threading.Lock()
+        self._stats = dict.fromkeys(('hits', 'misses', 'errors', 'fallbacks'), 0)
+
+    def key(self, customer_id):
+        return f'customer-summary:v{SUMMARY_SCHEMA_VERSION}:{customer_id}'
+
+    def get(self, customer_id):
+        key = self.key(customer_id)
+        today = datetime.date.today().isoformat()
+        cached = self._call('get_many', [self.generation_key, key])
+        generation = cached.get(self.generation_key, 0)
+        summary = cached.get(key)
+        if self._is_fresh(summary, generation, today):
+            return summary
+
+        summary = {'generation': generation, 'as_of': today, **load_customer_summary(customer_id)}
+        self._call('set', key, summary, settings.CUSTOMER_SUMMARY_CACHE_TTL)
+        return summary
+
+    async def aget(self, customer_id):
+        """Async counterpart of get() for ASGI views; misses are loaded through the async ORM."""
+        key = self.key(customer_id)
+        today = datetime.date.today().isoformat()
+        cached = await self._acall('get_many', [self.generation_key, key])
+        generation = cached.get(self.generation_key, 0)
+        summary = cached.get(key)
+        if self._is_fresh(summary, generation, today):
+            return summary
+
+        summary = {'generation': generation, 'as_of': today, **await aload_customer_summary(customer_id)}
+        await self._acall('set', key, summary, settings.CUSTOMER_SUMMARY_CACHE_TTL)
+        return summary
+
+    def _is_fresh(self, summary, generation, today):
+        if summary is not None and summary['generation'] == generation and summary['as_of'] == today:
+            self._count('hits')
+            return True
+        self._count('misses')
+        return False
+
+    def invalidate(self, customer_id):
+        # Always clear the local copy as well, in case this process served from it while Redis was down
+        self.local.delete(self.key(customer_id))
+        self._call('delete', self.key(customer_id))
+
+    def invalidate_many(self, customer_ids):
+        keys = [self.key(customer_id) for customer_id in customer_ids]
+        if keys:
+            self.local.delete_many(keys)
+            self._call('delete_many', keys)
+
+    def invalidate_all(self):
+        self.local.clear()
+        self._call('set', self.generation_key, time.time_ns(), None)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        stats['backend'] = 'local' if self._using_local() else settings.CUSTOMER_SUMMARY_CACHE
+        return stats
+
+    def _using_local(self):
+        return settings.CUSTOMER_SUMMARY_CACHE == 'locmem' or time.monotonic() < self._redis_retry_at
+
+    def _call(self, method, *args):
+        if self._using_local():
+            return getattr(self.local, method)(*args)
+        try:
+            return getattr(caches[self.alias], method)(*args)
+        except (RedisError, OSError):
+            self._count('errors')
+            if not settings.CUSTOMER_SUMMARY_CACHE_FALLBACK:
+                # Without the fallback every request goes to the database until Redis is back
+                return {} if method == 'get_many' else None
+            self._count('fallbacks')
+            self._redis_retry_at = time.monotonic() + settings.CUSTOMER_SUMMARY_REDIS_RETRY_INTERVAL
+            return getattr(self.local, method)(*args)
+
+    async def _acall(self, method, *args):
+        if self._using_local():
+            # The in-process LRU never blocks, so it is used straight from the event loop
+            return getattr(self.local, method)(*args)
+        return await sync_to_async(self._call, thread_sensitive=False)(method, *args)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+
+customer_summaries = CustomerSummaryCache()
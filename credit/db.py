@@ -0,0 +1,102 @@
+import os
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+_django_connections_opened = 0
+_django_stats_lock = threading.Lock()
+
+
+@receiver(connection_created, dispatch_uid='credit.db.count_connection')
+def count_connection(sender, connection, **kwargs):
+    global _django_connections_opened
+    with _django_stats_lock:
+        _django_connections_opened += 1
+
+
+def django_pool_stats(alias='default'):
+    db = settings.DATABASES[alias]
+    with _django_stats_lock:
+        # With a pool this counts checkouts; the pool reports the server connections it actually opened
+        stats = {'connections_opened': _django_connections_opened}
+    pool = getattr(connections[alias], 'pool', None)
+    if pool is None:
+        stats['mode'] = 'persistent' if db['CONN_MAX_AGE'] else 'per-request'
+        stats['conn_max_age'] = db['CONN_MAX_AGE']
+        return stats
+    pool_stats = pool.get_stats()
+    in_use = pool_stats.get('pool_size', 0) - pool_stats.get('pool_available', 0)
+    stats.update({
+        'mode': 'pool',
+        'size': pool_stats.get('pool_size', 0),
+        'max_size': pool_stats.get('pool_max', 0),
+        'in_use': in_use,
+        'server_connections': pool_stats.get('connections_num', 0),
+        'requests_waiting': pool_stats.get('requests_waiting', 0),
+        'requests_queued': pool_stats.get('requests_queued', 0),
+        'wait_ms': pool_stats.get('requests_wait_ms', 0),
+        'timeouts': pool_stats.get('requests_errors', 0),
+        'saturation': in_use / pool_stats['pool_max'] if pool_stats.get('pool_max') else 0.0,
+    })
+    return stats
+
+
+def pool_stats():
+    """Connection pool usage of the serving process, for sizing pools under load."""
+    return {
+        'django': django_pool_stats(),
+    }
+
+
+def reserve_ids(model, count):
+    """Reserve `count` new primary keys from the model's id sequence, in one statement.
+
+    PostgreSQL sequences are never rolled back, so reserved ids stay unique even if they are not used. On SQLite
+    the reservation moves the AUTOINCREMENT counter inside the caller's transaction.
+    """
+    table_name = model._meta.db_table
+    pk = model._meta.pk.column
+    connection = connections['default']
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+                           [table_name, pk, count])
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute("INSERT INTO sqlite_sequence (name, seq) SELECT %s, 0 "
+                       "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)", [table_name, table_name])
+        cursor.execute(f"UPDATE sqlite_sequence SET seq = MAX(seq, (SELECT COALESCE(MAX({pk}), 0) FROM {table_name}))"
+                       f" + %s WHERE name = %s RETURNING seq", [count, table_name])
+        last = cursor.fetchone()[0]
+        return list(range(last - count + 1, last + 1))
+
+
+class IdAllocator:
+    """Collision-free primary keys for explicit-id inserts, reserved from the model's database sequence.
+
+    Single ids are handed out from a per-process block, so most inserts need no extra round trip. Blocks are only
+    cached on PostgreSQL, where a reservation survives the transaction that made it.
+    """
+
+    def __init__(self, model, block_size=None):
+        self.model = model
+        self.block_size = block_size
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def allocate(self, count):
+        return reserve_ids(self.model, count) if count else []
+
+    def next(self):
+        if connections['default'].vendor != 'postgresql':
+            return reserve_ids(self.model, 1)[0]
+        # Keyed by process id, so forked workers never hand out ids from a block their parent reserved
+        pid = os.getpid()
+        with self._lock:
+            block = self._blocks.get(pid)
+            if not block:
+                block = self._blocks[pid] = reserve_ids(self.model, self.block_size or settings.ID_BLOCK_SIZE)
+                block.reverse()
+            return block.pop()
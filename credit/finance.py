@@ -0,0 +1,87 @@
+import math
+
+import numpy as np
+
+# Closed-form level-payment loan math, from the borrower's side: payments and balances owed are positive for a
+# positive principal. rate is the periodic rate as a fraction; monthly_rate() converts the annual percentages stored
+# on loans. Plain numbers take a math-module path, since NumPy's per-call dispatch costs more than the arithmetic
+# itself; arrays (or any mix with arrays) broadcast through NumPy. Growth is computed as exp(n * log1p(rate)) so
+# rates close to zero keep full precision, and a zero rate is the exact straight-line limit. Degenerate terms (no
+# periods to repay over, or a rate of -100% or less) give nan on both paths rather than raising on one of them.
+
+SCALAR_TYPES = (int, float, np.integer, np.floating)
+
+
+def _scalars(*values):
+    return all(isinstance(value, SCALAR_TYPES) for value in values)
+
+
+def monthly_rate(annual_percentage):
+    return annual_percentage / 12 / 100
+
+
+def pmt(rate, nper, principal):
+    """Payment per period that repays principal over nper periods at rate."""
+    if _scalars(rate, nper, principal):
+        rate, nper, principal = float(rate), float(nper), float(principal)
+        if nper <= 0 or rate <= -1:
+            return math.nan
+        if rate == 0:
+            return principal / nper
+        return principal * rate / -math.expm1(-nper * math.log1p(rate))
+    rate, nper, principal = (np.asarray(value, dtype=np.float64) for value in (rate, nper, principal))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        payment = np.where(rate == 0, principal / nper, principal * rate / -np.expm1(-nper * np.log1p(rate)))
+    return np.where((nper > 0) & (rate > -1), payment, np.nan)
+
+
+def fv(rate, nper, payment, principal):
+    """Balance still owed on principal after nper payments of payment at rate (negative once overpaid).
+
+    The same figure as -numpy_financial.fv(rate, nper, -payment, principal).
+    """
+    if _scalars(rate, nper, payment, principal):
+        rate, nper, payment, principal = float(rate), float(nper), float(payment), float(principal)
+        if rate <= -1:
+            return math.nan
+        if rate == 0:
+            return principal - payment * nper
+        growth = math.expm1(nper * math.log1p(rate))
+        return principal + principal * growth - payment * (growth / rate)
+    rate, nper, payment, principal = (np.asarray(value, dtype=np.float64) for value in (rate, nper, payment,
+                                                                                          principal))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.expm1(nper * np.log1p(rate))
+        annuity = np.where(rate == 0, nper, growth / rate)
+        balance = principal + principal * growth - payment * annuity
+    return np.where(rate > -1, balance, np.nan)
+
+
+def remaining_balance(interest_rate, tenure, emis_paid_on_time, monthly_repayment, loan_amount):
+    """Remaining balance of a loan from its columns (interest_rate is an annual percentage).
+
+    The figure behind Customer.current_debt: the balance after the emis_paid_on_time payments made so far (at most
+    tenure of them), never below zero.
+    """
+    if _scalars(tenure, emis_paid_on_time):
+        paid = min(max(emis_paid_on_time, 0), tenure)
+    else:
+        paid = np.clip(emis_paid_on_time, 0, tenure)
+    balance = fv(monthly_rate(interest_rate), paid, monthly_repayment, loan_amount)
+    return max(balance, 0.0) if _scalars(balance) else np.maximum(balance, 0.0)
+
+
+def schedule(rate, nper, payment, principal) -> np.ndarray:
+    """(nper + 1, 3) amortization table of principal, interest and balance per month; row 0 is the opening balance.
+
+    rate, payment and principal may be arrays of equal length, giving one table per loan stacked on the first
+    axis (all of nper rows).
+    """
+    rate, payment, principal = (np.asarray(value, dtype=np.float64)[..., None] for value in (rate, payment,
+                                                                                              principal))
+    balances = fv(rate, np.arange(int(nper) + 1), payment, principal)
+    interest = np.zeros_like(balances)
+    interest[..., 1:] = balances[..., :-1] * rate
+    principal_paid = np.zeros_like(balances)
+    principal_paid[..., 1:] = payment - interest[..., 1:]
+    return np.stack((principal_paid, interest, balances), axis=-1)
@@ -0,0 +1,344 @@
+import hashlib
+import io
+import os.path
+import time
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import F
+from django.utils import timezone
+import openpyxl
+import pandas as pd
+import pyarrow.parquet as pq
+
+from credit.models import IngestionFile
+from credit.utils import iter_chunks
+
+COLUMN_RENAMES = {
+    "monthly_payment": "monthly_repayment",
+    "date_of_approval": "start_date",
+}
+
+
+def normalize_columns(columns):
+    columns = [str(col).strip().lower().replace(' ', '_') for col in columns]
+    return [COLUMN_RENAMES.get(col, col) for col in columns]
+
+
+def iter_excel_chunks(file_path, chunk_size):
+    # Read-only mode streams rows from the sheet XML instead of building the whole workbook in memory
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = normalize_columns(next(rows))
+        for chunk in iter_chunks(rows, chunk_size):
+            yield pd.DataFrame.from_records(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def iter_csv_chunks(file_path, chunk_size, start=0, stop=None):
+    if stop is not None and stop <= start:
+        return
+    # Blank lines are kept as rows so row positions match csv_row_count; iter_file_chunks drops them afterwards
+    reader = pd.read_csv(file_path, chunksize=chunk_size, skiprows=range(1, start + 1), skip_blank_lines=False,
+                         nrows=None if stop is None else stop - start)
+    for chunk in reader:
+        chunk.columns = normalize_columns(chunk.columns)
+        yield chunk
+
+
+def iter_parquet_chunks(file_path, chunk_size, start=0, stop=None):
+    parquet = pq.ParquetFile(file_path)
+    stop = parquet.metadata.num_rows if stop is None else stop
+    # Only the row groups overlapping [start, stop) are read
+    row_groups, position, first = [], None, 0
+    for index in range(parquet.num_row_groups):
+        rows = parquet.metadata.row_group(index).num_rows
+        if first < stop and first + rows > start:
+            row_groups.append(index)
+            position = first if position is None else position
+        first += rows
+    if not row_groups:
+        return
+    for batch in parquet.iter_batches(batch_size=chunk_size, row_groups=row_groups):
+        low, high = max(start - position, 0), min(stop - position, batch.num_rows)
+        position += batch.num_rows
+        if low < high:
+            chunk = batch.slice(low, high - low).to_pandas()
+            chunk.columns = normalize_columns(chunk.columns)
+            yield chunk
+
+
+def csv_row_count(file_path, block_size=1 << 20):
+    """Data rows of a CSV file, counted as lines after the header, so records must not span lines."""
+    lines, last = 0, b'\n'
+    with open(file_path, 'rb') as file:
+        while block := file.read(block_size):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def parquet_row_count(file_path):
+    return pq.ParquetFile(file_path).metadata.num_rows
+
+
+CHUNK_READERS = {
+    '.xlsx': iter_excel_chunks,
+    '.xlsm': iter_excel_chunks,
+    '.csv': iter_csv_chunks,
+    '.parquet': iter_parquet_chunks,
+}
+# Formats that can be split into row ranges without reading the rows before them. Excel sheets are streamed
+# from the start of the sheet XML, so they load as a single shard unless shardable_copy converts them first.
+ROW_COUNTERS = {
+    '.csv': csv_row_count,
+    '.parquet': parquet_row_count,
+}
+
+
+def file_extension(file_path):
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension not in CHUNK_READERS:
+        raise ValueError(f"Unsupported input format: {extension}")
+    return extension
+
+
+def shard_count_for(file_path, shard_count):
+    """The number of shards a file can actually be split into: shard_count, or 1 for formats read serially."""
+    return shard_count if file_extension(file_path) in ROW_COUNTERS else 1
+
+
+def shardable_copy(file_path, directory=None, chunk_size=None):
+    """A copy of file_path that can be split into shards: CSV and Parquet files as they are, Excel workbooks
+    converted once to CSV.
+
+    Conversions are named after the workbook's content hash, so loading the same workbook again reuses its CSV,
+    whose identical content in turn lets IngestionFile skip or resume the load.
+    """
+    if file_extension(file_path) in ROW_COUNTERS:
+        return str(file_path)
+    directory = directory or settings.INGEST_CONVERTED_DIR
+    converted = os.path.join(directory, f"{file_content_hash(file_path)}.csv")
+    if os.path.exists(converted):
+        return converted
+
+    os.makedirs(directory, exist_ok=True)
+    # Written under a temporary name, so an interrupted conversion is never mistaken for a finished one
+    partial = f"{converted}.{os.getpid()}.partial"
+    try:
+        with open(partial, 'w', newline='') as file:
+            for index, chunk in enumerate(iter_excel_chunks(file_path, chunk_size or settings.INGEST_CHUNK_SIZE)):
+                chunk.to_csv(file, index=False, header=index == 0)
+        os.replace(partial, converted)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return converted
+
+
+def row_range(total, shard_index, shard_count) -> tuple:
+    return total * shard_index // shard_count, total * (shard_index + 1) // shard_count
+
+
+def iter_file_chunks(file_path, chunk_size, shard_index=0, shard_count=1):
+    """Yield the rows of a file, or of one of shard_count contiguous row ranges of it, as DataFrame chunks."""
+    extension = file_extension(file_path)
+    if shard_count > 1:
+        if extension not in ROW_COUNTERS:
+            raise ValueError(f"{extension} files cannot be split into shards")
+        start, stop = row_range(ROW_COUNTERS[extension](file_path), shard_index, shard_count)
+        chunks = CHUNK_READERS[extension](file_path, chunk_size, start, stop)
+    else:
+        chunks = CHUNK_READERS[extension](file_path, chunk_size)
+    for chunk in chunks:
+        # Sheets often carry trailing blank rows
+        chunk = chunk.dropna(how='all')
+        if len(chunk):
+            yield chunk
+
+
+def prepare_chunk(chunk, model):
+    """Restrict a chunk to the model's columns, coerce types and fill defaults for columns the file lacks."""
+    prepared = pd.DataFrame(index=chunk.index)
+    for field in model._meta.concrete_fields:
+        if field.column in chunk.columns:
+            values = chunk[field.column]
+            if isinstance(field, models.DateField):
+                values = pd.to_datetime(values).dt.date
+            elif isinstance(field, models.CharField):
+                # Numeric text such as phone numbers comes back from sheets as floats when a column has blanks
+                if pd.api.types.is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+                    values = values.astype('Int64')
+                values = values.astype('string')
+            elif isinstance(field, (models.IntegerField, models.AutoField, models.ForeignKey)):
+                # Blank cells turn integer columns into floats, which COPY rejects for integer columns
+                values = values.astype('Int64')
+            prepared[field.column] = values
+        elif field.has_default():
+            prepared[field.column] = field.get_default()
+    return prepared
+
+
+class CopyLoader:
+    """Loads chunks through COPY FROM STDIN into a session temp table and merges them into the target table."""
+
+    def __init__(self, model):
+        self.table = model._meta.db_table
+        self.key = model._meta.pk.column
+        self.staging = f"{self.table}_staging"
+        self.monotonic = {model._meta.get_field(name).column for name in getattr(model, 'MONOTONIC_FIELDS', ())}
+
+    def load(self, chunk, update_columns):
+        columns = ', '.join(chunk.columns)
+        buffer = io.StringIO()
+        chunk.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+
+        with connection.cursor() as cursor:
+            # Rows are dropped on every commit, so the table is reusable chunk after chunk
+            cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {self.staging} "
+                           f"(LIKE {self.table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+            copy_sql = f"COPY {self.staging} ({columns}) FROM STDIN WITH (FORMAT csv)"
+            if hasattr(cursor, 'copy_expert'):
+                cursor.copy_expert(copy_sql, buffer)
+            else:
+                with cursor.copy(copy_sql) as copy:
+                    copy.write(buffer.getvalue())
+            # Only new keys and rows whose file columns actually changed are written
+            values = {column: f"GREATEST({self.table}.{column}, EXCLUDED.{column})" if column in self.monotonic
+                      else f"EXCLUDED.{column}" for column in update_columns}
+            assignments = ', '.join(f"{column} = {value}" for column, value in values.items())
+            current = ', '.join(f"{self.table}.{column}" for column in update_columns)
+            incoming = ', '.join(values.values())
+            # Rows are locked in key order, so shards writing the same keys cannot deadlock
+            cursor.execute(f"INSERT INTO {self.table} ({columns}) SELECT {columns} FROM {self.staging} "
+                           f"ORDER BY {self.key} ON CONFLICT ({self.key}) DO UPDATE SET {assignments} "
+                           f"WHERE ({current}) IS DISTINCT FROM ({incoming})")
+            return cursor.rowcount
+
+
+class BulkInsertLoader:
+    """Portable fallback for databases without COPY."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def load(self, chunk, update_columns):
+        attnames = {field.column: field.attname for field in self.model._meta.concrete_fields}
+        chunk = chunk.rename(columns=attnames).astype(object)
+        records = chunk.where(chunk.notna(), None).to_dict('records')
+        monotonic = [name for name in getattr(self.model, 'MONOTONIC_FIELDS', ())
+                     if self.model._meta.get_field(name).column in update_columns]
+        if monotonic:
+            # Existing rows keep the greater of their stored and incoming values
+            key = self.model._meta.pk.attname
+            stored = {row[0]: row[1:] for row in self.model.objects.filter(
+                pk__in=[record[key] for record in records]).values_list(key, *monotonic)}
+            for record in records:
+                for name, value in zip(monotonic, stored.get(record[key], ())):
+                    if value is not None and (record[name] is None or value > record[name]):
+                        record[name] = value
+        objs = [self.model(**record) for record in records]
+        self.model.objects.bulk_create(objs, batch_size=2000, update_conflicts=True,
+                                       unique_fields=[self.model._meta.pk.name],
+                                       update_fields=[attnames[column] for column in update_columns])
+        # Without a changed-rows filter every row in the chunk is written
+        return len(objs)
+
+
+def get_loader(model):
+    return CopyLoader(model) if connection.vendor == 'postgresql' else BulkInsertLoader(model)
+
+
+def file_content_hash(file_path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        while block := file.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def ingest_file(file_path, model, chunk_size=None, force=False, shard_index=0, shard_count=1):
+    """Stream a customer or loan file into the model's table and return load statistics.
+
+    Loads are tracked per file content hash in IngestionFile: a file that already loaded completely is skipped,
+    and an interrupted load resumes after its last committed chunk. Rows are deduplicated on the primary key
+    within and across chunks (the first occurrence wins) and upserted, writing only new or changed rows.
+
+    With shard_count > 1 only the shard_index-th of shard_count contiguous row ranges is read and loaded, so
+    shards of the same CSV or Parquet file run in parallel without parsing each other's rows. Duplicate keys are
+    only caught within a shard; across shards the last one to commit wins.
+    """
+    table_name = model._meta.db_table
+    content_hash = file_content_hash(file_path)
+    tracking, created = IngestionFile.objects.get_or_create(
+        table_name=table_name, content_hash=content_hash, shard_index=shard_index, shard_count=shard_count,
+        defaults={'file_path': str(file_path), 'chunk_size': chunk_size or settings.INGEST_CHUNK_SIZE},
+    )
+    if tracking.status == IngestionFile.STATUS_COMPLETED and not force:
+        return {'skipped': True, 'resumed_from_chunk': 0, 'rows_read': tracking.rows_read, 'rows_written': 0,
+                'duplicates': 0, 'chunks': tracking.chunks_committed, 'seconds': 0.0, 'rows_per_second': 0.0}
+    if force:
+        tracking.chunks_committed = tracking.rows_read = tracking.rows_written = 0
+    tracking.file_path = str(file_path)
+    tracking.status = IngestionFile.STATUS_RUNNING
+    tracking.save()
+
+    # Chunk boundaries must match the interrupted run, so a resumed load keeps its original chunk size
+    resume_from = tracking.chunks_committed
+    key = model._meta.pk.column
+    loader = get_loader(model)
+    seen_keys = set()
+    stats = {'skipped': False, 'resumed_from_chunk': resume_from, 'rows_read': 0, 'rows_written': 0,
+             'duplicates': 0, 'chunks': 0}
+    started = time.perf_counter()
+
+    try:
+        for index, chunk in enumerate(iter_file_chunks(file_path, tracking.chunk_size, shard_index, shard_count)):
+            rows = len(chunk)
+            source_columns = set(chunk.columns)
+            chunk = prepare_chunk(chunk, model).drop_duplicates(subset=key)
+            chunk = chunk[~chunk[key].isin(seen_keys)]
+            seen_keys.update(chunk[key].tolist())
+            stats['chunks'] += 1
+            if index < resume_from:
+                continue
+            stats['rows_read'] += rows
+            stats['duplicates'] += rows - len(chunk)
+
+            # Columns the file does not carry (e.g. cached scores) keep their current values on update
+            update_columns = [column for column in chunk.columns if column in source_columns and column != key]
+            with transaction.atomic():
+                written = loader.load(chunk, update_columns)
+                # The checkpoint commits together with the chunk it describes
+                IngestionFile.objects.filter(pk=tracking.pk).update(
+                    chunks_committed=index + 1, rows_read=F('rows_read') + rows,
+                    rows_written=F('rows_written') + written, updated_at=timezone.now())
+            stats['rows_written'] += written
+    except Exception as e:
+        IngestionFile.objects.filter(pk=tracking.pk).update(status=IngestionFile.STATUS_FAILED, error=str(e),
+                                                            updated_at=timezone.now())
+        raise
+
+    IngestionFile.objects.filter(pk=tracking.pk).update(status=IngestionFile.STATUS_COMPLETED, error='',
+                                                        completed_at=timezone.now(), updated_at=timezone.now())
+    stats['seconds'] = time.perf_counter() - started
+    stats['rows_per_second'] = stats['rows_read'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+
+def reset_sequence(model):
+    if connection.vendor != 'postgresql':
+        return
+    table_name = model._meta.db_table
+    pk = model._meta.pk.column
+    # Never moves the sequence backwards: ids reserved in blocks by IdAllocator may not be inserted yet
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table_name}', '{pk}'), "
+                       f"GREATEST(COALESCE(MAX({pk}), 0) + 1, "
+                       f"COALESCE(pg_sequence_last_value(pg_get_serial_sequence('{table_name}', '{pk}')), 0))) "
+                       f"FROM {table_name}")
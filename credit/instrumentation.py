@@ -0,0 +1,296 @@
+import contextlib
+import contextvars
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Per-process request instrumentation: wall time, query count and query time per view, named spans around the
+# expensive parts of a request, Prometheus text export and sampled cProfile dumps of slow requests.
+# Metrics live in the serving process, like cache-stats/ and pool-stats/; Prometheus scrapes each process.
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def _label_value(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        lines += [f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}' for labels, value in values]
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> per-bucket counts (the last one is +Inf), then sum and count
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count)
+                            in self._values.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                bucket_labels = _labels(self.labelnames, labels, 'le="%s"' % _number(bound))
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+def render_family(name, documentation, kind, samples):
+    """Prometheus text for a family of (labels dict, value) samples read at scrape time."""
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        lines.append(f'{name}{_labels(labels.keys(), labels.values())} {_number(value)}')
+    return lines
+
+
+requests_total = Counter('credit_http_requests_total', 'Requests served, by view, method and status.',
+                         ('view', 'method', 'status'))
+request_seconds = Histogram('credit_http_request_duration_seconds', 'Wall time of requests, by view.', ('view',))
+request_queries = Histogram('credit_http_request_db_queries', 'Database queries per request, by view.', ('view',),
+                            buckets=QUERY_BUCKETS)
+request_db_seconds = Histogram('credit_http_request_db_duration_seconds', 'Time spent in database queries per '
+                               'request, by view.', ('view',))
+span_seconds = Histogram('credit_span_duration_seconds', 'Wall time of instrumented code spans, by span.', ('span',))
+profiles_dumped = Counter('credit_profiles_dumped_total', 'Sampled slow requests whose cProfile stats were dumped.',
+                          ('view',))
+METRICS = (requests_total, request_seconds, request_queries, request_db_seconds, span_seconds, profiles_dumped)
+
+
+class RequestProfile:
+    __slots__ = ('queries', 'db_seconds', 'spans', 'active')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.spans = {}
+        self.active = set()
+
+
+# Context variables follow a request into sync_to_async threads, so async views are profiled as well
+_current_profile = contextvars.ContextVar('credit_request_profile', default=None)
+
+
+@contextlib.contextmanager
+def span(name):
+    """Time a block, or every call of a decorated function, as a named span.
+
+    Spans are recorded process-wide and in the current request's profile. A span nested in another span of the
+    same name is not counted twice.
+    """
+    profile = _current_profile.get()
+    if not settings.INSTRUMENTATION_ENABLED or (profile is not None and name in profile.active):
+        yield
+        return
+    if profile is not None:
+        profile.active.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        span_seconds.observe(seconds, name)
+        if profile is not None:
+            profile.active.discard(name)
+            profile.spans[name] = profile.spans.get(name, 0.0) + seconds
+
+
+def record_query(execute, sql, params, many, context):
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.queries += 1
+        profile.db_seconds += time.perf_counter() - start
+
+
+@receiver(connection_created, dispatch_uid='credit.instrumentation.record_queries')
+def install_query_recorder(sender, connection, **kwargs):
+    # Wrappers outlive reconnects of the same connection object, so the recorder is installed only once
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.route if match is not None else 'unmatched'
+
+
+class InstrumentationMiddleware:
+    """Records wall time, query count and query time of each request per view, and samples slow-request profiles.
+
+    With INSTRUMENTATION_SERVER_TIMING on, the same figures are returned in a Server-Timing header.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.INSTRUMENTATION_ENABLED:
+            return self.get_response(request)
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        profiler = self.sampled_profiler()
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        finally:
+            _current_profile.reset(token)
+        self.record(request, response, profile, time.perf_counter() - start, profiler)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.INSTRUMENTATION_ENABLED:
+            return await self.get_response(request)
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        # cProfile only sees its own thread, which an event loop shares between requests, so async requests are
+        # never profiled
+        self.record(request, response, profile, time.perf_counter() - start, None)
+        return response
+
+    def sampled_profiler(self):
+        rate = settings.INSTRUMENTATION_PROFILE_SAMPLE_RATE
+        if rate <= 0 or random.random() >= rate:
+            return None
+        return cProfile.Profile()
+
+    def record(self, request, response, profile, seconds, profiler):
+        view = view_label(request)
+        requests_total.inc(view, request.method, str(response.status_code))
+        request_seconds.observe(seconds, view)
+        request_queries.observe(profile.queries, view)
+        request_db_seconds.observe(profile.db_seconds, view)
+        if settings.INSTRUMENTATION_SERVER_TIMING:
+            timings = [f'total;dur={seconds * 1000:.2f}',
+                       f'db;dur={profile.db_seconds * 1000:.2f};desc="{profile.queries} queries"']
+            timings += [f'{name};dur={value * 1000:.2f}' for name, value in profile.spans.items()]
+            response['Server-Timing'] = ', '.join(timings)
+        if profiler is not None and seconds >= settings.INSTRUMENTATION_PROFILE_MIN_SECONDS:
+            self.dump_profile(profiler, view, seconds)
+
+    def dump_profile(self, profiler, view, seconds):
+        directory = settings.INSTRUMENTATION_PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', view).strip('-') or 'root'
+        name = f'{time.strftime("%Y%m%dT%H%M%S")}-{slug}-{seconds * 1000:.0f}ms-{os.getpid()}.prof'
+        profiler.dump_stats(os.path.join(directory, name))
+        profiles_dumped.inc(view)
+
+
+def cache_families(stats):
+    return [
+        *render_family('credit_customer_summary_cache_requests_total', 'Customer summary cache lookups, by result.',
+                       'counter', [({'result': 'hit'}, stats['hits']), ({'result': 'miss'}, stats['misses'])]),
+        *render_family('credit_customer_summary_cache_errors_total', 'Customer summary cache backend errors.',
+                       'counter', [({}, stats['errors'])]),
+        *render_family('credit_customer_summary_cache_fallbacks_total', 'Switches to the in-process cache while '
+                       'Redis was unreachable.', 'counter', [({}, stats['fallbacks'])]),
+        *render_family('credit_customer_summary_cache_hit_ratio', 'Customer summary cache hit ratio.', 'gauge',
+                       [({'backend': stats['backend']}, stats['hit_ratio'])]),
+    ]
+
+
+def pool_families(stats):
+    django = stats['django']
+    lines = render_family('credit_db_connections_opened_total', 'Database connections opened by Django (pool '
+                          'checkouts when pooled).', 'counter', [({}, django['connections_opened'])])
+    if django['mode'] == 'pool':
+        for key in ('size', 'max_size', 'in_use', 'requests_waiting', 'saturation'):
+            lines += render_family(f'credit_db_pool_{key}', f'psycopg pool {key.replace("_", " ")}.', 'gauge',
+                                   [({}, django[key])])
+        lines += render_family('credit_db_pool_timeouts_total', 'psycopg pool checkouts that timed out.', 'counter',
+                               [({}, django['timeouts'])])
+    return lines
+
+
+def render_metrics(cache_stats=None, pool_stats=None):
+    lines = [line for metric in METRICS for line in metric.render()]
+    if cache_stats is not None:
+        lines += cache_families(cache_stats)
+    if pool_stats is not None:
+        lines += pool_families(pool_stats)
+    return '\n'.join(lines) + '\n'
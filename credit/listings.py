@@ -0,0 +1,81 @@
+import csv
+import datetime
+import io
+
+from django.conf import settings
+from django.db import transaction
+
+from credit.cache import active_loans
+from credit.models import Loan
+from credit.rendering import LOAN_DETAIL, dumps_lines
+from credit.utils import iter_chunks
+
+# Loan listings that never hold more than a page or a chunk of rows: keyset pages of a customer's active loans for
+# view-loans/, and CSV or NDJSON exports of the loan table streamed from a server-side cursor.
+
+EXPORT_COLUMNS = ('loan_id', 'customer_id', 'loan_amount', 'tenure', 'interest_rate', 'monthly_repayment',
+                  'emis_paid_on_time', 'start_date', 'end_date')
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def _page(customer_id, after, limit):
+    # One row past the page tells whether another page follows
+    return active_loans(customer_id).filter(loan_id__gt=after)[:limit + 1]
+
+
+def _next_cursor(rows, limit):
+    return rows[limit - 1]['loan_id'] if len(rows) > limit else None
+
+
+def loan_page(customer_id, after=0, limit=None) -> tuple:
+    """Active loans of a customer with loan_id above after, and the cursor of the next page (None on the last)."""
+    limit = limit or settings.VIEW_LOANS_PAGE_SIZE
+    rows = LOAN_DETAIL.rows(_page(customer_id, after, limit))
+    return rows[:limit], _next_cursor(rows, limit)
+
+
+async def aloan_page(customer_id, after=0, limit=None) -> tuple:
+    limit = limit or settings.VIEW_LOANS_PAGE_SIZE
+    rows = await LOAN_DETAIL.arows(_page(customer_id, after, limit))
+    return rows[:limit], _next_cursor(rows, limit)
+
+
+def export_queryset(customer_id=None, active=False):
+    loans = Loan.objects.order_by('loan_id')
+    if customer_id is not None:
+        loans = loans.filter(customer_id=customer_id)
+    if active:
+        loans = loans.filter(end_date__gte=datetime.date.today())
+    return loans
+
+
+def _csv_block(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def _ndjson_block(rows):
+    return dumps_lines([dict(zip(EXPORT_COLUMNS, row), start_date=row[7].isoformat(), end_date=row[8].isoformat())
+                        for row in rows])
+
+
+def iter_export(loans, output='csv', chunk_size=None):
+    """Yield a CSV or NDJSON export of the loans in blocks of chunk_size rows.
+
+    Rows come from a server-side cursor on PostgreSQL. The generator holds its own transaction while it runs:
+    outside one, Django declares the cursor WITH HOLD, which makes PostgreSQL materialize the whole result first.
+    """
+    chunk_size = chunk_size or settings.LOAN_EXPORT_CHUNK_SIZE
+    if output == 'csv':
+        yield _csv_block([], header=True)
+    with transaction.atomic():
+        rows = loans.values_list(*EXPORT_COLUMNS).iterator(chunk_size=chunk_size)
+        for block in iter_chunks(rows, chunk_size):
+            yield _csv_block(block) if output == 'csv' else _ndjson_block(block)
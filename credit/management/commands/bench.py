@@ -0,0 +1,857 @@
+import asyncio
+import contextlib
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import statistics
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import numpy_financial as npf
+import pandas as pd
+from asgiref.sync import ThreadSensitiveContext
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, close_old_connections, connection, connections, transaction
+from django.db.models import F, Sum
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.renderers import JSONRenderer
+
+from credit import finance, rendering, utils
+from credit.bench import (FIRST_NAMES, LAST_NAMES, READ_REQUEST_MIX, generate_loans, generate_request_log,
+                          legacy_check_eligibility, seed_dataset, throwaway_database)
+from credit.cache import customer_summaries
+from credit.listings import EXPORT_COLUMNS, export_queryset, iter_export
+from credit.models import Customer, DirtyCustomer, EmiPayment, Loan
+from credit.payments import ensure_partitions, load_payments_file
+from credit.policy import DEFAULT_SCENARIO, current_policy, evaluate_policy, expand_grid, load_customers, \
+    simulate_policies
+from credit.portfolio import compute_portfolio_summary
+from credit.rendering import LOAN_DETAIL, SINGLE_LOAN_DETAIL
+from credit.rules import DEFAULT_RULES, CompiledRules, EligibilityRules
+from credit.serializers import CheckEligibilityResponseSerializer, LoanDetailSerializer, SingleLoanDetailSerializer
+from credit.snapshots import SnapshotReader, export_snapshot
+from credit.tasks import (finish_recompute_run, process_dirty_shard, recompute_all_customers, recompute_report,
+                          start_recompute_run)
+from credit.views import eligibility_response
+
+# Each benchmark times an optimized path against the one it replaced on a deterministic synthetic book, seeded
+# inside a transaction that is rolled back afterwards. Agreement of both paths is checked by credit/tests.py; the
+# checks left here cover comparisons the tests do not run at benchmark scale.
+
+BENCHMARKS = {}
+
+
+def benchmark(name, help, *arguments):
+    """Register a benchmark under name, with (flag, argparse options) pairs besides --seed."""
+    def register(function):
+        BENCHMARKS[name] = (help, arguments, function)
+        return function
+    return register
+
+
+def check(condition, message):
+    if not condition:
+        raise CommandError(message)
+
+
+@contextlib.contextmanager
+def seeded(customers, loans_per_customer, seed):
+    """Seed a synthetic book for the block and roll it back afterwards."""
+    with transaction.atomic():
+        yield seed_dataset(customers, loans_per_customer, seed=seed)
+        transaction.set_rollback(True)
+
+
+def timed(function, repeat=1):
+    """Result of function and its best wall time over repeat runs, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def traced(function):
+    """Result, wall time and peak traced Python memory in MiB; tracing would skew the timed run, so it runs twice."""
+    _, seconds = timed(function)
+    tracemalloc.start()
+    try:
+        result = function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak / (1 << 20)
+
+
+def write_table(out, columns, rows):
+    """Rows under a header of (title, format spec) columns, each title as wide as its column."""
+    widths = [re.match(r'[<>^]?\d*', spec).group() for _, spec in columns]
+    out.write(' '.join(f'{title:{width}}' for (title, _), width in zip(columns, widths)))
+    for row in rows:
+        out.write(' '.join(format(value, spec) for value, (_, spec) in zip(row, columns)))
+
+
+def percentile(values, fraction):
+    return sorted(values)[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def digest(chunks):
+    hashed = hashlib.sha256()
+    for chunk in chunks:
+        hashed.update(chunk)
+    return hashed.hexdigest()
+
+
+def registration(rng):
+    return {
+        'first_name': rng.choice(FIRST_NAMES),
+        'last_name': rng.choice(LAST_NAMES),
+        'age': rng.randint(21, 65),
+        'monthly_income': rng.randrange(20000, 250000, 1000),
+        'phone_number': str(rng.randint(7000000000, 9999999999)),
+    }
+
+
+def application(rng, customers):
+    return {
+        'customer_id': rng.choice(customers).customer_id,
+        'loan_amount': rng.randrange(10000, 500000, 1000),
+        'interest_rate': round(rng.uniform(6, 20), 2),
+        'tenure': rng.choice([6, 12, 24, 36]),
+    }
+
+
+def new_loans(customer_ids, count=1):
+    # Fresh active loans, as create-loan/ would book them
+    today = datetime.date.today()
+    return [Loan(customer_id=customer_id, loan_amount=100000, tenure=24, interest_rate=12, monthly_repayment=4707.35,
+                 emis_paid_on_time=0, start_date=today, end_date=today + datetime.timedelta(days=730))
+            for customer_id in customer_ids for _ in range(count)]
+
+
+# The paths each benchmark compares against, as they were before they were replaced
+
+def legacy_score_and_emi(loans):
+    current_year = datetime.datetime.now().year
+    number_of_past_loans = loans.count()
+    loan_activity_current_year = 0
+    loan_approved_volume = 0
+    total_emis_paid_on_time = 0
+    total_emis_tenure = 0
+    for loan in loans:
+        total_emis_paid_on_time += loan.emis_paid_on_time
+        total_emis_tenure += loan.tenure
+        if loan.start_date.year == current_year:
+            loan_activity_current_year += 1
+        loan_approved_volume = 1.8
+    ratio = (total_emis_paid_on_time / total_emis_tenure) if total_emis_tenure else 0
+    credit_score = min(ratio * 25 + number_of_past_loans * 25 + loan_activity_current_year * 25 +
+                       loan_approved_volume * 25, 100)
+    total_emi = sum(loan.monthly_repayment for loan in loans if loan.end_date > datetime.date.today())
+    return credit_score, total_emi
+
+
+def legacy_register(data, rng):
+    # A random id in 10000-99999, retried until it does not collide
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            insert_customer(rng.randint(10000, 99999), data)
+            return attempts
+        except IntegrityError:
+            continue
+
+
+def insert_customer(customer_id, data):
+    with transaction.atomic():
+        Customer.objects.create(customer_id=customer_id, first_name=data['first_name'], last_name=data['last_name'],
+                                phone_number=data['phone_number'], age=data['age'],
+                                monthly_salary=data['monthly_income'],
+                                approved_limit=int(utils.approved_limits(data['monthly_income'])))
+
+
+def save_payments(payments):
+    # One insert, one loan read and one loan save per event
+    for payment in payments.itertuples(index=False):
+        EmiPayment.objects.create(loan_id=payment.loan_id, paid_on=payment.paid_on, amount=payment.amount,
+                                  on_time=payment.on_time, reference=payment.reference)
+        loan = Loan.objects.get(loan_id=payment.loan_id)
+        if payment.on_time and loan.emis_paid_on_time < loan.tenure:
+            loan.emis_paid_on_time += 1
+            loan.save(update_fields=['emis_paid_on_time'])
+            DirtyCustomer.mark([loan.customer_id], DirtyCustomer.REASON_PAYMENT)
+
+
+def materialized_export(loans):
+    # Every row read into a list and the file rendered in one go
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(list(loans.values_list(*EXPORT_COLUMNS)))
+    return buffer.getvalue().encode()
+
+
+def serialize_loans(loans):
+    return JSONRenderer().render(LoanDetailSerializer(loans, many=True).data)
+
+
+def serialize_loan_details(loan_ids):
+    rendered = []
+    for loan_id in loan_ids:
+        loan = Loan.objects.filter(loan_id=loan_id).first()
+        loan.customer_info = Customer.objects.get(customer_id=loan.customer_id)
+        rendered.append(JSONRenderer().render(SingleLoanDetailSerializer(instance=loan).data))
+    return rendered
+
+
+def serialize_eligibility(responses):
+    # check-eligibility validated its own response before rendering it
+    rendered = []
+    for response in responses:
+        serializer = CheckEligibilityResponseSerializer(data=response)
+        serializer.is_valid(raise_exception=True)
+        rendered.append(JSONRenderer().render(serializer.data))
+    return rendered
+
+
+@benchmark('scoring', 'Credit scoring query count and latency against loan-history size.',
+           ('--sizes', {'type': int, 'nargs': '+', 'default': [1, 10, 100, 1000, 5000]}),
+           ('--repeat', {'type': int, 'default': 20}))
+def bench_scoring(out, options):
+    def measure(function):
+        with CaptureQueriesContext(connection) as context:
+            result = function()
+        timings = [timed(function)[1] * 1000 for _ in range(options['repeat'])]
+        p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+        return result, len(context.captured_queries), statistics.median(timings), p95
+
+    def aggregate_score_and_emi(customer_id):
+        stats = utils.get_loan_stats(customer_id)
+        return utils.credit_score_from_stats(stats), stats['active_emi_total']
+
+    rows = []
+    with seeded(1, 0, options['seed']) as (customer,):
+        loaded = 0
+        for size in sorted(options['sizes']):
+            Loan.objects.bulk_create(generate_loans([customer], size - loaded, seed=options['seed'] + size),
+                                     batch_size=2000)
+            loaded = size
+            legacy = measure(lambda: legacy_score_and_emi(Loan.objects.filter(customer_id=customer.customer_id)))
+            aggregate = measure(lambda: aggregate_score_and_emi(customer.customer_id))
+            check(abs(legacy[0][0] - aggregate[0][0]) <= 1e-9 and abs(legacy[0][1] - aggregate[0][1]) <= 1e-6,
+                  f'Score mismatch at {size} loans: {legacy[0]} != {aggregate[0]}')
+            rows += [(size, name, *result[1:]) for name, result in (('legacy', legacy), ('aggregate', aggregate))]
+    write_table(out, [('loans', '>7'), ('impl', '>10'), ('queries', '>8'), ('median ms', '>10.3f'),
+                      ('p95 ms', '>8.3f')], rows)
+
+
+@benchmark('eligibility', '/check-eligibility/ called in a loop against one /check-eligibility/batch/ request.',
+           ('--customers', {'type': int, 'default': 500}),
+           ('--loans-per-customer', {'type': int, 'default': 10}),
+           ('--applications', {'type': int, 'default': 2000}))
+def bench_eligibility(out, options):
+    client = Client(SERVER_NAME='localhost')
+    rng = random.Random(options['seed'])
+    with seeded(options['customers'], options['loans_per_customer'], options['seed']) as customers:
+        applications = [application(rng, customers) for _ in range(options['applications'])]
+        _, single_seconds = timed(lambda: [client.post('/check-eligibility/', data, content_type='application/json')
+                                           for data in applications])
+        _, batch_seconds = timed(lambda: b''.join(client.post(
+            '/check-eligibility/batch/', {'applications': applications},
+            content_type='application/json').streaming_content))
+
+    count = len(applications)
+    out.write(f'single endpoint loop: {count / single_seconds:10.0f} applications/s')
+    out.write(f'batch endpoint:       {count / batch_seconds:10.0f} applications/s')
+    out.write(f'speedup:              {single_seconds / batch_seconds:10.1f}x')
+
+
+class ThreadSampler:
+    """Tracks the peak number of live threads while a benchmark pass runs."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def sync_server(threads, transfer):
+    pool = ThreadPoolExecutor(max_workers=threads)
+    local = threading.local()
+
+    def handle(entry):
+        # A WSGI worker thread stays busy for as long as the client takes to send and receive
+        time.sleep(transfer)
+        if not hasattr(local, 'client'):
+            local.client = Client(SERVER_NAME='localhost', raise_request_exception=False)
+        if entry['method'] == 'GET':
+            response = local.client.get(entry['path'])
+        else:
+            response = local.client.post(entry['path'], json.dumps(entry['body']), content_type='application/json')
+        # The test client skips the per-request connection cleanup the WSGI handler performs
+        close_old_connections()
+        return response
+
+    async def send(entry):
+        return await asyncio.get_running_loop().run_in_executor(pool, handle, entry)
+    return send
+
+
+def async_server(transfer):
+    client = AsyncClient(raise_request_exception=False)
+
+    async def send(entry):
+        # The ASGI server buffers slow clients on the event loop without tying up a thread
+        await asyncio.sleep(transfer)
+        path = '/async' + entry['path']
+        # ASGIHandler gives every request its own thread-sensitive context; the test client does not
+        async with ThreadSensitiveContext():
+            if entry['method'] == 'GET':
+                return await client.get(path)
+            return await client.post(path, json.dumps(entry['body']), content_type='application/json')
+    return send
+
+
+def replay(log, clients, send):
+    results = [None] * len(log)
+
+    async def client(indexes):
+        for index in indexes:
+            start = time.perf_counter()
+            response = await send(log[index])
+            results[index] = (time.perf_counter() - start, response.status_code, response.json())
+
+    async def main():
+        await asyncio.gather(*(client(range(offset, len(log), clients)) for offset in range(clients)))
+
+    with ThreadSampler() as sampler:
+        _, wall_seconds = timed(lambda: asyncio.run(main()))
+    latencies = np.array([result[0] for result in results]) * 1000
+    return {
+        'throughput_rps': len(results) / wall_seconds,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'errors': sum(1 for result in results if result[1] >= 500),
+        'peak_threads': sampler.peak,
+        'bodies': [result[2] for result in results],
+    }
+
+
+@benchmark('async', 'The sync read endpoints on a fixed pool of server threads (WSGI) against their /async/ '
+                    'counterparts on a single event loop (ASGI), for many concurrent slow clients.',
+           ('--customers', {'type': int, 'default': 500}),
+           ('--loans-per-customer', {'type': int, 'default': 8}),
+           ('--requests', {'type': int, 'default': 2000}),
+           ('--clients', {'type': int, 'default': 200, 'help': 'Concurrent clients.'}),
+           ('--server-threads', {'type': int, 'default': 10,
+                                 'help': 'Worker threads of the sync server, e.g. gunicorn --threads.'}),
+           ('--transfer-ms', {'type': float, 'default': 20.0,
+                              'help': 'Time a slow client takes to send its request and read the response.'}))
+def bench_async(out, options):
+    # Requests run on several threads, which need a committed book on a database they can share
+    with throwaway_database():
+        customers = seed_dataset(options['customers'], options['loans_per_customer'], seed=options['seed'])
+        log = generate_request_log([customer.customer_id for customer in customers],
+                                   list(Loan.objects.values_list('loan_id', flat=True)), options['requests'],
+                                   seed=options['seed'], mix=READ_REQUEST_MIX)
+        connections.close_all()
+
+        clients = max(options['clients'], 1)
+        transfer = options['transfer_ms'] / 1000
+        customer_summaries.invalidate_all()
+        sync_report = replay(log, clients, sync_server(max(options['server_threads'], 1), transfer))
+        customer_summaries.invalidate_all()
+        # AsyncClient always sends Host: testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            async_report = replay(log, clients, async_server(transfer))
+
+    for index, (sync_body, async_body) in enumerate(zip(sync_report.pop('bodies'), async_report.pop('bodies'))):
+        check(sync_body == async_body, f'Async response differs for {log[index]["path"]}: {sync_body} != {async_body}')
+
+    out.write(f"{len(log)} requests, {clients} concurrent clients, {options['transfer_ms']:g}ms transfer, "
+              f"{options['server_threads']} sync server threads, "
+              f"{settings.ASYNC_DB_MAX_CONNECTIONS} async DB connections")
+    write_table(out, [('mode', '<6'), ('req/s', '>8.0f'), ('p50 ms', '>8.2f'), ('p95 ms', '>8.2f'), ('5xx', '>5'),
+                      ('peak threads', '>13')],
+                [(mode, report['throughput_rps'], report['p50_ms'], report['p95_ms'], report['errors'],
+                  report['peak_threads']) for mode, report in (('sync', sync_report), ('async', async_report))])
+    out.write(f"async/sync throughput: {async_report['throughput_rps'] / sync_report['throughput_rps']:.2f}x")
+
+
+@benchmark('schedule', 'Remaining-balance lookups from materialized schedules against recomputing them from the '
+                       'loan terms.',
+           ('--customers', {'type': int, 'default': 1000}),
+           ('--loans-per-customer', {'type': int, 'default': 10}),
+           ('--repeat', {'type': int, 'default': 5, 'help': 'Lookups per loan, at different months.'}))
+def bench_schedule(out, options):
+    with seeded(options['customers'], options['loans_per_customer'], options['seed']):
+        loans = list(Loan.objects.select_related('schedule'))
+
+    def recompute():
+        balances = []
+        for loan, paid in lookups:
+            loan.emis_paid_on_time = paid
+            balances.append(utils.calculate_remaining_loan_balance(loan))
+        return balances
+
+    # Lookups at different points of each loan's life, never past its tenure
+    lookups = [(loan, paid) for loan in loans for paid in range(min(options['repeat'], loan.tenure + 1))]
+    expected, recompute_seconds = timed(recompute)
+    actual, lookup_seconds = timed(lambda: [loan.schedule.remaining_balance(paid) for loan, paid in lookups])
+    check(np.allclose(actual, expected, rtol=1e-6, atol=1e-6), 'Schedule balances differ from recomputed ones')
+
+    count = len(lookups)
+    stored = sum(len(loan.schedule.payments) for loan in loans)
+    out.write(f'recompute:        {count / recompute_seconds:12.0f} lookups/s')
+    out.write(f'schedule lookup:  {count / lookup_seconds:12.0f} lookups/s')
+    out.write(f'speedup:          {recompute_seconds / lookup_seconds:12.1f}x')
+    out.write(f'storage:          {stored / len(loans):12.0f} bytes/loan')
+
+
+@benchmark('portfolio', 'Time and peak Python memory of the portfolio summary for several chunk sizes.',
+           ('--customers', {'type': int, 'default': 5000}),
+           ('--loans-per-customer', {'type': int, 'default': 10}),
+           ('--chunk-sizes', {'type': int, 'nargs': '+', 'default': [1000, 10000, 100000]}))
+def bench_portfolio(out, options):
+    rows = []
+    with seeded(options['customers'], options['loans_per_customer'], options['seed']):
+        expected = Customer.objects.aggregate(total=Sum('current_debt'))['total'] or 0.0
+        for chunk_size in options['chunk_sizes']:
+            summary, seconds, peak = traced(lambda: compute_portfolio_summary(chunk_size=chunk_size))
+            check(abs(summary['total_outstanding'] - expected) <= 1e-6 * max(expected, 1),
+                  f"Outstanding {summary['total_outstanding']} differs from the sum of customer debts {expected} "
+                  f"at chunk size {chunk_size}")
+            rows.append((chunk_size, seconds, peak))
+
+    out.write(f"{summary['customers']} customers, {summary['active_loans']} active loans, "
+              f"{summary['total_outstanding']:.0f} outstanding")
+    write_table(out, [('chunk size', '>10'), ('seconds', '>8.3f'), ('peak MiB', '>9.1f')], rows)
+
+
+@benchmark('register', 'Single registration latency as the customer table grows, random ids against '
+                       'sequence-allocated ids, and /register/bulk/ throughput.',
+           ('--customers', {'type': int, 'default': 80000, 'help': 'Table size reached by the last step.'}),
+           ('--steps', {'type': int, 'default': 4}),
+           ('--samples', {'type': int, 'default': 200, 'help': 'Single registrations timed per step.'}),
+           ('--bulk-size', {'type': int, 'default': 5000}))
+def bench_register(out, options):
+    rng = random.Random(options['seed'])
+    client = Client()
+    rows = []
+    bulk_seconds = 0.0
+    bulk_records = 0
+    # A fresh database, so ids start at 1 and the random-id range fills up as the table grows, as in production
+    with throwaway_database(), override_settings(ALLOWED_HOSTS=['testserver']), transaction.atomic():
+        step_size = options['customers'] // options['steps']
+        for step in range(options['steps'] + 1):
+            remaining = step_size if step else 0
+            while remaining:
+                size = min(remaining, options['bulk_size'])
+                body = {'customers': [registration(rng) for _ in range(size)]}
+                response, seconds = timed(lambda: client.post('/register/bulk/', body,
+                                                              content_type='application/json'))
+                check(response.status_code == 200, f'Bulk registration failed: {response.status_code}')
+                bulk_seconds += seconds
+                bulk_records += size
+                remaining -= size
+            table_size = Customer.objects.count()
+
+            allocated = [timed(lambda: insert_customer(utils.customer_ids.next(), registration(rng)))[1]
+                         for _ in range(options['samples'])]
+            # Rolled back, so random ids never sit in the range the sequence hands out later
+            with transaction.atomic():
+                legacy = [timed(lambda: legacy_register(registration(rng), rng)) for _ in range(options['samples'])]
+                transaction.set_rollback(True)
+            legacy_seconds = [seconds for _, seconds in legacy]
+            collisions = sum(attempts for attempts, _ in legacy) / options['samples'] - 1
+            rows.append((table_size, statistics.mean(allocated) * 1000, percentile(allocated, 0.99) * 1000,
+                         statistics.mean(legacy_seconds) * 1000, percentile(legacy_seconds, 0.99) * 1000, collisions))
+
+    write_table(out, [('customers', '>9'), ('allocated mean ms', '>17.3f'), ('p99', '>7.3f'),
+                      ('random-id mean ms', '>17.3f'), ('p99', '>7.3f'), ('collisions/insert', '>18.2f')], rows)
+    if bulk_records:
+        out.write(f"/register/bulk/: {bulk_records / bulk_seconds:.0f} customers/s in requests of "
+                  f"{options['bulk_size']}")
+
+
+@benchmark('rendering', 'Serialization time per 1,000 loans (and eligibility responses) through DRF serializers '
+                        'against values_list() rows with the fast JSON encoder.',
+           ('--loans', {'type': int, 'default': 10000}),
+           ('--repeat', {'type': int, 'default': 5}))
+def bench_rendering(out, options):
+    count, repeat = options['loans'], options['repeat']
+    rows = []
+
+    def compare(name, count, before, after, stdlib):
+        results = [timed(function, repeat) for function in (before, after, stdlib)]
+        bodies = [[json.loads(body) for body in ([result] if isinstance(result, bytes) else result)]
+                  for result, _ in results]
+        check(bodies[0] == bodies[1] == bodies[2], f'{name} bodies differ between the serializer and the fast path')
+        rows.append((name, *(seconds * 1000 * 1000 / count for _, seconds in results)))
+
+    with seeded(max(1, count // 10), 10, options['seed']):
+        loans = Loan.objects.order_by('loan_id')[:count]
+        loan_ids = list(loans.values_list('loan_id', flat=True))[:1000]
+        customers = {customer.customer_id: customer for customer in Customer.objects.all()}
+        details = list(Loan.objects.filter(loan_id__in=loan_ids).order_by('loan_id'))
+
+        def fast_loan_details(dumps):
+            return [dumps(SINGLE_LOAN_DETAIL.row(SINGLE_LOAN_DETAIL.values(Loan.objects.filter(loan_id=loan_id))
+                                                 .first())) for loan_id in loan_ids]
+
+        compare('view-loans', count, lambda: serialize_loans(list(loans)),
+                lambda: rendering.dumps(LOAN_DETAIL.rows(loans)),
+                lambda: rendering.stdlib_dumps(LOAN_DETAIL.rows(loans)))
+        compare('view-loan', len(loan_ids), lambda: serialize_loan_details(loan_ids),
+                lambda: fast_loan_details(rendering.dumps), lambda: fast_loan_details(rendering.stdlib_dumps))
+
+    responses = [eligibility_response(customers[loan.customer_id],
+                                      {'customer_id': loan.customer_id, 'loan_amount': loan.loan_amount,
+                                       'interest_rate': loan.interest_rate, 'tenure': loan.tenure})
+                 for loan in details]
+    compare('check-eligibility', len(responses), lambda: serialize_eligibility(responses),
+            lambda: [rendering.dumps(response) for response in responses],
+            lambda: [rendering.stdlib_dumps(response) for response in responses])
+
+    encoder = 'orjson' if rendering.orjson is not None else 'json (orjson not installed)'
+    out.write(f'ms per 1,000 rows, best of {repeat}; fast encoder: {encoder}. Bodies are identical.')
+    write_table(out, [('endpoint', '<18'), ('serializer', '>10.2f'), ('values+fast', '>11.2f'),
+                      ('values+json', '>11.2f'), ('speedup', '>7.1f')],
+                [(*row, row[1] / row[2]) for row in rows])
+
+
+@benchmark('recompute', 'A dirty-set recompute against recomputing every customer.',
+           ('--customers', {'type': int, 'default': 20000}),
+           ('--loans-per-customer', {'type': int, 'default': 5}),
+           ('--dirty-fraction', {'type': float, 'default': 0.02,
+                                 'help': 'Share of customers given a new loan or an EMI update before the run.'}),
+           ('--shards', {'type': int, 'default': 4}))
+def bench_recompute(out, options):
+    columns = ('customer_id', 'current_debt', 'credit_score', 'active_emi_total')
+    rng = random.Random(options['seed'])
+
+    def run_recompute():
+        run = start_recompute_run(options['shards'])
+        for shard_index in range(run.shard_count):
+            process_dirty_shard(run, shard_index)
+        run.refresh_from_db()
+        return finish_recompute_run(run)
+
+    def customer_columns():
+        return np.array(list(Customer.objects.order_by('customer_id').values_list(*columns)), dtype=np.float64)
+
+    with seeded(options['customers'], options['loans_per_customer'], options['seed']) as customers:
+        # A first run establishes the baseline, so the timed run only looks at loans maturing since then
+        run_recompute()
+        # Drift behind the cached columns' back: new loans for some customers and EMI updates for others
+        dirty = rng.sample([customer.customer_id for customer in customers],
+                           max(1, int(len(customers) * options['dirty_fraction'])))
+        booked, paid = dirty[::2], dirty[1::2]
+        Loan.objects.bulk_create(new_loans(booked))
+        Loan.objects.filter(customer_id__in=paid, emis_paid_on_time__lt=F('tenure')).update(
+            emis_paid_on_time=F('emis_paid_on_time') + 1)
+        DirtyCustomer.mark(booked, DirtyCustomer.REASON_LOAN)
+        DirtyCustomer.mark(paid, DirtyCustomer.REASON_PAYMENT)
+
+        run, incremental_seconds = timed(run_recompute)
+        report = recompute_report(run)
+        incremental = customer_columns()
+        _, full_seconds = timed(recompute_all_customers)
+        full = customer_columns()
+
+    check(np.allclose(incremental, full, rtol=1e-9, atol=1e-6),
+          'The dirty-set recompute left customers that the full recompute changes')
+    out.write(report)
+    out.write(f'{len(customers)} customers, {len(dirty)} dirty; results identical to a full recompute')
+    out.write(f'dirty-set recompute: {incremental_seconds:8.3f}s')
+    out.write(f'full recompute:      {full_seconds:8.3f}s ({full_seconds / incremental_seconds:.1f}x)')
+
+
+@benchmark('payments', 'Payment events per second through the streaming loader and /payments/bulk/ against '
+                       'per-row saves.',
+           ('--customers', {'type': int, 'default': 5000}),
+           ('--loans-per-customer', {'type': int, 'default': 4}),
+           ('--events', {'type': int, 'default': 200000}),
+           ('--months', {'type': int, 'default': 3, 'help': 'Payment dates are spread over this many months.'}),
+           ('--duplicates', {'type': float, 'default': 0.01, 'help': 'Share of events sent twice.'}),
+           ('--bulk-size', {'type': int, 'default': 10000, 'help': 'Events per /payments/bulk/ request.'}),
+           ('--per-row-events', {'type': int, 'default': 2000}))
+def bench_payments(out, options):
+    rng = random.Random(options['seed'])
+    today = datetime.date.today()
+
+    def generate_payments(count, prefix):
+        return pd.DataFrame({
+            'loan_id': [rng.choice(loan_ids) for _ in range(count)],
+            'paid_on': [today - datetime.timedelta(days=rng.randrange(options['months'] * 30)) for _ in range(count)],
+            'amount': [round(rng.uniform(1000, 50000), 2) for _ in range(count)],
+            'on_time': [rng.random() < 0.9 for _ in range(count)],
+            'reference': [f'{prefix}-{index}' for index in range(count)],
+        })
+
+    with seeded(options['customers'], options['loans_per_customer'], options['seed']), \
+            override_settings(ALLOWED_HOSTS=['testserver']), tempfile.TemporaryDirectory() as directory:
+        loan_ids = list(Loan.objects.values_list('loan_id', flat=True))
+        payments = generate_payments(options['events'], 'file')
+        resent = payments.sample(frac=options['duplicates'], random_state=options['seed'])
+        file_path = os.path.join(directory, 'payments.csv')
+        pd.concat([payments, resent]).to_csv(file_path, index=False)
+        stats = load_payments_file(file_path)
+
+        api = generate_payments(options['bulk_size'], 'api')
+        body = {'payments': api.assign(paid_on=api['paid_on'].map(datetime.date.isoformat)).to_dict('records')}
+        response, api_seconds = timed(lambda: Client().post('/payments/bulk/', body, content_type='application/json'))
+        check(response.status_code == 200, f'payments/bulk/ returned {response.status_code}: {response.content[:200]}')
+
+        per_row = generate_payments(options['per_row_events'], 'row')
+        ensure_partitions(per_row['paid_on'])
+        _, per_row_seconds = timed(lambda: save_payments(per_row))
+
+        partitions = []
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT tableoid::regclass::text, count(*) FROM credit_emipayment GROUP BY 1 ORDER BY 1")
+                partitions = cursor.fetchall()
+
+    out.write(f"{len(loan_ids)} loans, {len(payments)} events over {options['months']} months plus {len(resent)} "
+              f"resent; {stats['recorded']} recorded, {stats['duplicates']} duplicates")
+    out.write(f"file loader:     {stats['events_per_second']:>9.0f} events/s ({stats['chunks']} chunks)")
+    out.write(f"payments/bulk/:  {len(api) / api_seconds:>9.0f} events/s ({len(api)} per request)")
+    out.write(f"per-row save():  {len(per_row) / per_row_seconds:>9.0f} events/s "
+              f"({stats['events_per_second'] * per_row_seconds / len(per_row):.0f}x slower than the loader)")
+    for name, rows in partitions:
+        out.write(f'  {name}: {rows} rows')
+
+
+@benchmark('export', 'Peak memory and time of streamed /loans/export/ against a materialized export for growing '
+                     'row counts, and of paging view-loans for a customer with many loans against one response.',
+           ('--customers', {'type': int, 'default': 20000}),
+           ('--loans-per-customer', {'type': int, 'default': 5}),
+           ('--sizes', {'type': int, 'nargs': '+', 'default': [10000, 50000, 100000]}),
+           ('--customer-loans', {'type': int, 'default': 20000,
+                                 'help': 'Active loans of the customer paged through view-loans.'}),
+           ('--limit', {'type': int, 'default': 500, 'help': 'view-loans page size.'}))
+def bench_export(out, options):
+    client = Client()
+
+    def single_response(customer_id):
+        # Built from the database each time rather than served from the summary cache
+        customer_summaries.invalidate(customer_id)
+        return len(client.get(f'/view-loans/{customer_id}').content)
+
+    def page_through(customer_id):
+        # Each page is measured and dropped, as a client writing pages out would do
+        size, cursor = 0, 0
+        while cursor is not None:
+            response = client.get(f"/view-loans/{customer_id}?limit={options['limit']}&cursor={cursor}")
+            size += len(response.content)
+            cursor = response.headers.get('X-Next-Cursor')
+        return size
+
+    rows = []
+    with seeded(options['customers'], options['loans_per_customer'], options['seed']), \
+            override_settings(ALLOWED_HOSTS=['testserver']):
+        loan_ids = list(Loan.objects.order_by('loan_id').values_list('loan_id', flat=True))
+        for size in options['sizes']:
+            check(size <= len(loan_ids), f'Only {len(loan_ids)} loans were seeded; lower --sizes')
+            loans = export_queryset().filter(loan_id__lte=loan_ids[size - 1])
+            streamed, streamed_seconds, streamed_mib = traced(lambda: digest(iter_export(loans)))
+            full, full_seconds, full_mib = traced(lambda: digest([materialized_export(loans)]))
+            check(streamed == full, f'Streamed export of {size} loans differs from the materialized one')
+            rows.append((size, streamed_seconds, streamed_mib, full_seconds, full_mib))
+
+        customer = Customer.objects.first()
+        Loan.objects.bulk_create(new_loans([customer.customer_id], options['customer_loans']), batch_size=5000)
+        _, single_seconds, single_mib = traced(lambda: single_response(customer.customer_id))
+        _, paged_seconds, paged_mib = traced(lambda: page_through(customer.customer_id))
+    customer_summaries.invalidate(customer.customer_id)
+
+    out.write('streamed /loans/export/ CSV against a materialized export; files are identical')
+    write_table(out, [('rows', '>8'), ('streamed s', '>10.3f'), ('peak MiB', '>9.1f'), ('materialized s', '>14.3f'),
+                      ('peak MiB', '>9.1f')], rows)
+    out.write(f"view-loans for a customer with {options['customer_loans']} added active loans")
+    out.write(f'single response:       {single_seconds:8.3f}s, peak {single_mib:6.1f} MiB')
+    out.write(f"pages of {options['limit']:<5}:        {paged_seconds:8.3f}s, peak {paged_mib:6.1f} MiB per page")
+
+
+@benchmark('finance', 'Per-call and per-array timings of credit.finance against numpy_financial.',
+           ('--cases', {'type': int, 'default': 100000, 'help': 'Random loans timed as arrays.'}),
+           ('--calls', {'type': int, 'default': 20000, 'help': 'Scalar calls timed per function.'}))
+def bench_finance(out, options):
+    rng = np.random.default_rng(options['seed'])
+    count, calls = options['cases'], options['calls']
+    # Monthly rates from 0 to 5%, a tenth of them exactly zero, and tenures up to 40 years
+    rates = rng.uniform(1e-6, 0.05, count)
+    rates[rng.random(count) < 0.1] = 0.0
+    nper = rng.integers(1, 481, count).astype(np.float64)
+    principal = rng.uniform(1, 1e7, count)
+    payments = finance.pmt(rates, nper, principal)
+    paid = np.floor(rng.random(count) * (nper + 1))
+    scalar = list(zip(*(values[:calls].tolist() for values in (rates, nper, principal, payments, paid))))
+    timings = [
+        ('pmt, scalar', lambda: [finance.pmt(r, n, p) for r, n, p, _, _ in scalar],
+         lambda: [npf.pmt(r, n, -p) for r, n, p, _, _ in scalar], len(scalar)),
+        ('fv, scalar', lambda: [finance.fv(r, k, m, p) for r, _, p, m, k in scalar],
+         lambda: [npf.fv(r, k, -m, p) for r, _, p, m, k in scalar], len(scalar)),
+        (f'pmt, {count} array', lambda: finance.pmt(rates, nper, principal),
+         lambda: npf.pmt(rates, nper, -principal), count),
+        (f'fv, {count} array', lambda: finance.fv(rates, paid, payments, principal),
+         lambda: npf.fv(rates, paid, -payments, principal), count),
+    ]
+    rows = []
+    # numpy_financial divides by zero rates before discarding the result
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name, ours, theirs, calls in timings:
+            ours_ns = min(timeit.repeat(ours, number=1, repeat=5)) * 1e9 / calls
+            theirs_ns = min(timeit.repeat(theirs, number=1, repeat=5)) * 1e9 / calls
+            rows.append((name, ours_ns, theirs_ns, theirs_ns / ours_ns))
+        npf_error = np.abs(npf.pmt(np.full(count, 1e-12), nper, -principal) / (principal / nper) - 1).max()
+    write_table(out, [('', '<20'), ('finance ns', '>11.1f'), ('npf ns', '>9.1f'), ('speedup', '>7.1f')], rows)
+    out.write(f'numpy_financial relative error at a 1e-12 rate: {npf_error:.1e}')
+
+
+@benchmark('rules', 'Compiled eligibility rules against the legacy if/elif chain, and a hot reload.',
+           ('--applications', {'type': int, 'default': 200000}))
+def bench_rules(out, options):
+    rng = np.random.default_rng(options['seed'])
+    count = options['applications']
+    scores = rng.integers(0, 101, count).astype(np.float64)
+    rates = rng.uniform(5, 20, count).round(2)
+    salaries = rng.uniform(10000, 200000, count).round()
+    emis = salaries * rng.uniform(0, 0.8, count)
+    applications = list(zip(scores.tolist(), rates.tolist(), salaries.tolist(), emis.tolist()))
+    rules = CompiledRules(DEFAULT_RULES)
+    _, legacy_seconds = timed(lambda: [legacy_check_eligibility(*application) for application in applications])
+    _, compiled_seconds = timed(lambda: [rules.evaluate(*application) for application in applications])
+    _, batch_seconds = timed(lambda: rules.evaluate_batch(scores, rates, salaries, emis))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'rules.json')
+        with open(path, 'w') as file:
+            json.dump(DEFAULT_RULES, file)
+        loader = EligibilityRules()
+        with override_settings(ELIGIBILITY_RULES_FILE=path, ELIGIBILITY_RULES_CHECK_INTERVAL=0):
+            loader.get()
+            with open(path, 'w') as file:
+                json.dump({**DEFAULT_RULES, 'emi_to_income_cap': 0.4}, file)
+            # A new mtime is what triggers the reload
+            os.utime(path, ns=(time.time_ns(), time.time_ns() + 1))
+            _, reload_seconds = timed(loader.get)
+            _, check_seconds = timed(lambda: [loader.get() for _ in range(1000)])
+        with override_settings(ELIGIBILITY_RULES_FILE=path, ELIGIBILITY_RULES_CHECK_INTERVAL=60):
+            _, cached_seconds = timed(lambda: [loader.get() for _ in range(100000)])
+
+    out.write(f'{count} applications')
+    out.write(f'legacy if/elif:   {count / legacy_seconds:12.0f} checks/s')
+    out.write(f'compiled chain:   {count / compiled_seconds:12.0f} checks/s')
+    out.write(f'compiled batch:   {count / batch_seconds:12.0f} checks/s')
+    out.write(f'hot reload:       {reload_seconds * 1000:12.2f} ms')
+    out.write(f'cached rules:     {cached_seconds * 1e6 / 100000:12.2f} us')
+    out.write(f'staleness check:  {check_seconds * 1e6 / 1000:12.1f} us (file stat and rule set query)')
+
+
+@benchmark('policy', 'A policy grid serially and across worker processes, with the current policy checked against '
+                     'check_eligibility.',
+           ('--customers', {'type': int, 'default': 50000}),
+           ('--policies', {'type': int, 'default': 64, 'help': 'Approximate size of the policy grid.'}),
+           ('--workers', {'type': int, 'nargs': '+', 'default': [2, 4]}))
+def bench_policy(out, options):
+    with seeded(options['customers'], 1, options['seed']):
+        customers, load_seconds = timed(load_customers)
+
+    scenario = DEFAULT_SCENARIO
+    policy = current_policy()
+    outcome = evaluate_policy(policy, customers, scenario)
+    approvals, corrected_interest_rates = utils.check_eligibility_batch(
+        customers['credit_score'], np.full(len(customers['credit_score']), scenario['interest_rate']),
+        customers['monthly_salary'], customers['active_emi_total'])
+    check(np.array_equal(outcome['approval'], approvals) and
+          np.array_equal(outcome['corrected_interest_rate'], corrected_interest_rates),
+          'The current policy disagrees with check_eligibility_batch')
+
+    caps = np.linspace(0.3, 0.7, max(1, int(np.sqrt(options['policies']))))
+    shifts = range(max(1, options['policies'] // len(caps)))
+    bands = [[{**band, 'min_score': band['min_score'] + shift} for band in policy['bands']] for shift in shifts]
+    policies = expand_grid(policy, {'emi_to_income_cap': caps.tolist(), 'bands': bands})
+
+    expected, serial_seconds = timed(lambda: simulate_policies(policies, scenario, customers=customers, workers=1))
+    rows = [(1, serial_seconds, len(policies) / serial_seconds)]
+    for workers in options['workers']:
+        results, seconds = timed(lambda: simulate_policies(policies, scenario, customers=customers, workers=workers))
+        check(results == expected, f'Results with {workers} workers differ from the serial run')
+        rows.append((workers, seconds, len(policies) / seconds))
+
+    out.write(f"{len(customers['credit_score'])} customers loaded in {load_seconds:.2f}s, {len(policies)} policies")
+    write_table(out, [('workers', '>7'), ('seconds', '>8.3f'), ('policies/s', '>11.1f')], rows)
+
+
+@benchmark('snapshot', 'Recomputing customer debts and scores from the database against a Parquet snapshot.',
+           ('--customers', {'type': int, 'default': 5000}),
+           ('--loans-per-customer', {'type': int, 'default': 10}),
+           ('--buckets', {'type': int, 'default': 8}))
+def bench_snapshot(out, options):
+    columns = ('current_debt', 'credit_score', 'active_emi_total')
+    with tempfile.TemporaryDirectory() as directory, \
+            seeded(options['customers'], options['loans_per_customer'], options['seed']):
+        manifest, export_seconds = timed(lambda: export_snapshot(directory=directory, buckets=options['buckets']))
+        _, database_seconds = timed(recompute_all_customers)
+        expected = {row[0]: row[1:] for row in Customer.objects.values_list('customer_id', *columns)}
+        reader = SnapshotReader(os.path.join(directory, manifest['snapshot_id']))
+        results, snapshot_seconds = timed(lambda: list(reader.iter_customer_stats()))
+
+    checked = 0
+    for customer_ids, values in results:
+        for index, customer_id in enumerate(customer_ids):
+            actual = tuple(float(values[name][index]) for name in columns)
+            check(np.allclose(actual, expected[int(customer_id)], rtol=1e-9, atol=1e-6),
+                  f'Customer {customer_id} differs: snapshot {actual} != database {expected[int(customer_id)]}')
+            checked += 1
+    check(checked == len(expected), f'Snapshot covers {checked} customers, database has {len(expected)}')
+
+    out.write(f"{checked} customers, {manifest['tables']['credit_loan']['rows']} loans, {options['buckets']} buckets")
+    out.write(f'export:              {export_seconds:8.3f}s')
+    out.write(f'database recompute:  {database_seconds:8.3f}s (queries and writes)')
+    out.write(f'snapshot recompute:  {snapshot_seconds:8.3f}s (no database reads)')
+
+
+class Command(BaseCommand):
+    help = 'Run a benchmark against its former implementation on a seeded book that is rolled back afterwards.'
+
+    def add_arguments(self, parser):
+        benchmarks = parser.add_subparsers(dest='benchmark', required=True, metavar='benchmark')
+        for name, (help, arguments, _) in BENCHMARKS.items():
+            subparser = benchmarks.add_parser(name, help=help, description=help)
+            subparser.add_argument('--seed', type=int, default=0)
+            for flag, kwargs in arguments:
+                subparser.add_argument(flag, **kwargs)
+
+    def handle(self, *args, **options):
+        _, _, function = BENCHMARKS[options['benchmark']]
+        function(self.stdout, options)
@@ -0,0 +1,75 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from credit.bench import seed_dataset
+from credit.models import Customer, Loan
+from credit.utils import loan_stats_aggregates
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN ANALYZE the hot loan queries against a seeded dataset and fail on sequential scans.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=2000)
+        parser.add_argument('--loans-per-customer', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan, not only failures.')
+
+    def handle(self, *args, **options):
+        failures = []
+        with transaction.atomic():
+            customers = seed_dataset(options['customers'], options['loans_per_customer'], seed=options['seed'])
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+            for name, queryset in self.hot_queries(customers).items():
+                plan = self.explain(queryset)
+                sequential = self.sequential_scans(plan)
+                status = 'SEQ SCAN' if sequential else 'ok'
+                self.stdout.write(f'{name:<24} {status}')
+                if sequential or options['verbose_plans']:
+                    self.stdout.write(plan)
+                if sequential:
+                    failures.append(name)
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError(f'Sequential scans in: {", ".join(failures)}')
+
+    def hot_queries(self, customers):
+        today = datetime.date.today()
+        customer_id = customers[len(customers) // 2].customer_id
+        loan_id = Loan.objects.filter(customer_id=customer_id).values_list('loan_id', flat=True).first()
+        # A batch touches a small slice of the book, as partner files do against the full customer base
+        batch_ids = [customer.customer_id for customer in customers[::100]]
+        return {
+            # ViewLoansView
+            'view_loans': Loan.objects.filter(customer_id=customer_id, end_date__gte=today),
+            # ViewLoanView
+            'view_loan': Loan.objects.filter(loan_id=loan_id),
+            # CheckEligibilityView / CreateLoanView
+            'customer_lookup': Customer.objects.filter(customer_id=customer_id),
+            # Score refresh on loan creation
+            'customer_loan_stats': Loan.objects.filter(customer_id=customer_id).values('customer_id')
+            .annotate(**loan_stats_aggregates()),
+            # Active loans of one customer, as read by the legacy per-customer debt loop
+            'customer_active_loans': Loan.objects.filter(customer_id=customer_id, end_date__gte=today)
+            .values_list('interest_rate', 'tenure', 'emis_paid_on_time', 'monthly_repayment', 'loan_amount'),
+            # /check-eligibility/batch/
+            'batch_customers': Customer.objects.filter(customer_id__in=batch_ids)
+            .values_list('customer_id', 'monthly_salary', 'credit_score', 'active_emi_total'),
+        }
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            return queryset.explain(analyze=True)
+        return queryset.explain()
+
+    def sequential_scans(self, plan):
+        if connection.vendor == 'postgresql':
+            return [line.strip() for line in plan.splitlines() if 'Seq Scan on' in line]
+        # SQLite reports full table scans as "SCAN <table>" and index lookups as "SEARCH ... USING INDEX"
+        return [line.strip() for line in plan.splitlines()
+                if 'SCAN ' in line and 'USING' not in line and 'credit_' in line]
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from credit.payments import load_payments_file
+from credit.tasks import ingest_payments
+
+
+class Command(BaseCommand):
+    help = 'Stream a CSV, Excel or Parquet file of EMI payment events (loan_id, paid_on, amount, optional on_time ' \
+           'and reference) into the payments table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file_path')
+        parser.add_argument('--chunk-size', type=int, help='Events loaded per transaction (defaults to '
+                                                           'PAYMENTS_CHUNK_SIZE).')
+        parser.add_argument('--async', action='store_true', dest='run_async', help='Queue the load on Celery.')
+
+    def handle(self, *args, **options):
+        if options['run_async']:
+            result = ingest_payments.delay(options['file_path'], options['chunk_size'])
+            self.stdout.write(f'Queued payments load as task {result.id}')
+            return
+
+        try:
+            stats = load_payments_file(options['file_path'], options['chunk_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"{stats['recorded']} of {stats['received']} events recorded in {stats['chunks']} chunks "
+                          f"({stats['events_per_second']:.0f} events/s): {stats['duplicates']} duplicates and "
+                          f"{stats['unknown_loans']} events for unknown loans skipped, {stats['loans_updated']} "
+                          f"loans updated, {stats['customers_marked']} customers queued for recompute.")
@@ -0,0 +1,190 @@
+import json
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve
+
+from credit.bench import generate_request_log, seed_dataset, throwaway_database
+from credit.db import django_pool_stats
+from credit.models import IngestRun, Loan
+
+
+class Command(BaseCommand):
+    help = ('Replay a request log against the API endpoints on a throwaway database and report latency '
+            'percentiles, throughput and DB queries per endpoint.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', help='JSONL request log to replay ({"method", "path", "body"} per line). '
+                                          'A synthetic log is generated when omitted.')
+        parser.add_argument('--write-log', help='Save the generated request log to this path.')
+        parser.add_argument('--requests', type=int, default=2000, help='Size of the generated log.')
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--loans-per-customer', type=int, default=8)
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--save-baseline', help='Write the report to this JSON file.')
+        parser.add_argument('--compare', help='Baseline JSON to compare against; exits non-zero on regressions.')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Allowed relative p95 latency / throughput degradation before flagging.')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the throwaway database afterwards.')
+
+    def handle(self, *args, **options):
+        with throwaway_database(keepdb=options['keepdb']):
+            report = self.run(options)
+
+        self.print_report(report)
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(f"Baseline saved to {options['save_baseline']}")
+        if options['compare']:
+            with open(options['compare']) as file:
+                regressions = self.compare(report, json.load(file), options['threshold'])
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(regression))
+            if regressions:
+                raise CommandError(f'{len(regressions)} regression(s) against {options["compare"]}')
+            self.stdout.write(self.style.SUCCESS('No regressions against baseline.'))
+
+    def run(self, options):
+        customers = seed_dataset(options['customers'], options['loans_per_customer'], seed=options['seed'])
+        run = IngestRun.objects.create(shard_count=1, status=IngestRun.STATUS_COMPLETED)
+
+        if options['log']:
+            with open(options['log']) as file:
+                log = [json.loads(line) for line in file if line.strip()]
+        else:
+            log = generate_request_log([customer.customer_id for customer in customers],
+                                       list(Loan.objects.values_list('loan_id', flat=True)),
+                                       options['requests'], seed=options['seed'], ingest_run_id=run.pk)
+        if options['write_log']:
+            with open(options['write_log'], 'w') as file:
+                file.writelines(json.dumps(entry) + '\n' for entry in log)
+        connections.close_all()
+
+        samples = []
+        samples_lock = threading.Lock()
+        concurrency = max(options['concurrency'], 1)
+
+        def worker(entries):
+            client = Client(SERVER_NAME='localhost', raise_request_exception=False)
+            results = []
+            for entry in entries:
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = self.send(client, entry)
+                    elapsed = time.perf_counter() - start
+                # The test client skips the per-request connection cleanup the WSGI handler performs
+                close_old_connections()
+                results.append((self.endpoint(entry['path']), elapsed, len(queries.captured_queries),
+                                response.status_code))
+            connection.close()
+            with samples_lock:
+                samples.extend(results)
+
+        threads = [threading.Thread(target=worker, args=(log[index::concurrency],)) for index in range(concurrency)]
+        opened_before = django_pool_stats()['connections_opened']
+        peak_in_use = 0
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            # Pool saturation is sampled while the replay runs, to size DB_POOL_MAX_SIZE against the load
+            peak_in_use = max(peak_in_use, django_pool_stats().get('in_use', 0))
+            time.sleep(0.01)
+        wall_seconds = time.perf_counter() - started
+
+        report = self.summarize(samples, wall_seconds, concurrency)
+        pool = django_pool_stats()
+        report['db_connections'] = {
+            'mode': pool['mode'],
+            # Pooled checkouts reuse server connections, so the pool's own count is what was really opened
+            'opened': pool['server_connections'] if pool['mode'] == 'pool' else
+            pool['connections_opened'] - opened_before,
+            'peak_in_use': peak_in_use,
+            'max_size': pool.get('max_size'),
+        }
+        return report
+
+    def send(self, client, entry):
+        method = entry.get('method', 'GET').upper()
+        if method == 'GET':
+            response = client.get(entry['path'])
+        else:
+            response = client.generic(method, entry['path'], json.dumps(entry.get('body', {})),
+                                      content_type='application/json')
+        if response.streaming:
+            # Streaming endpoints only finish their work once the body is consumed
+            b''.join(response.streaming_content)
+        return response
+
+    def endpoint(self, path):
+        try:
+            return '/' + resolve(path.split('?', 1)[0]).route
+        except Resolver404:
+            return path
+
+    def summarize(self, samples, wall_seconds, concurrency):
+        by_endpoint = defaultdict(list)
+        for endpoint, elapsed, queries, status in samples:
+            by_endpoint[endpoint].append((elapsed, queries, status))
+
+        endpoints = {}
+        for endpoint, rows in sorted(by_endpoint.items()):
+            latencies = np.array([row[0] for row in rows]) * 1000
+            endpoints[endpoint] = {
+                'requests': len(rows),
+                'errors': sum(1 for row in rows if row[2] >= 500),
+                'p50_ms': float(np.percentile(latencies, 50)),
+                'p95_ms': float(np.percentile(latencies, 95)),
+                'p99_ms': float(np.percentile(latencies, 99)),
+                # Requests per second of busy time spent on this endpoint, across all workers
+                'throughput_rps': float(len(rows) / latencies.sum() * 1000 * concurrency) if latencies.sum() else 0.0,
+                'queries_per_request': float(np.mean([row[1] for row in rows])),
+            }
+        return {
+            'concurrency': concurrency,
+            'requests': len(samples),
+            'wall_seconds': wall_seconds,
+            'throughput_rps': len(samples) / wall_seconds if wall_seconds else 0.0,
+            'endpoints': endpoints,
+        }
+
+    def print_report(self, report):
+        self.stdout.write(f"{'endpoint':<38} {'reqs':>6} {'5xx':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+                          f"{'req/s':>8} {'queries':>8}")
+        for endpoint, stats in report['endpoints'].items():
+            self.stdout.write(f"{endpoint:<38} {stats['requests']:>6} {stats['errors']:>4} {stats['p50_ms']:>8.2f} "
+                              f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['throughput_rps']:>8.0f} "
+                              f"{stats['queries_per_request']:>8.1f}")
+        connections_report = report['db_connections']
+        pool_usage = f", peak {connections_report['peak_in_use']}/{connections_report['max_size']} pooled in use" \
+            if connections_report['mode'] == 'pool' else ''
+        self.stdout.write(f"db connections ({connections_report['mode']}): {connections_report['opened']} opened"
+                          f"{pool_usage}")
+        self.stdout.write(f"total: {report['requests']} requests in {report['wall_seconds']:.2f}s at concurrency "
+                          f"{report['concurrency']} -> {report['throughput_rps']:.0f} req/s")
+
+    def compare(self, report, baseline, threshold):
+        regressions = []
+        if report['throughput_rps'] < baseline['throughput_rps'] * (1 - threshold):
+            regressions.append(f"total throughput {report['throughput_rps']:.0f} req/s < baseline "
+                               f"{baseline['throughput_rps']:.0f} req/s")
+        for endpoint, stats in report['endpoints'].items():
+            previous = baseline['endpoints'].get(endpoint)
+            if previous is None:
+                continue
+            if stats['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+                regressions.append(f"{endpoint}: p95 {stats['p95_ms']:.2f}ms > baseline {previous['p95_ms']:.2f}ms")
+            if stats['queries_per_request'] > previous['queries_per_request'] + 0.5:
+                regressions.append(f"{endpoint}: {stats['queries_per_request']:.1f} queries/request > baseline "
+                                   f"{previous['queries_per_request']:.1f}")
+            if stats['errors'] > previous['errors']:
+                regressions.append(f"{endpoint}: {stats['errors']} server errors > baseline {previous['errors']}")
+        return regressions
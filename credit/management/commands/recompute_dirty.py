@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from credit.tasks import (finish_recompute_run, process_dirty_shard, recompute_dirty_customers, recompute_report,
+                          start_recompute_run)
+
+
+class Command(BaseCommand):
+    help = 'Recompute debts, credit scores and EMI totals of customers marked dirty since the last run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, help='customer_id shards (defaults to DIRTY_RECOMPUTE_SHARDS).')
+        parser.add_argument('--chunk-size', type=int, help='Customers recomputed per transaction.')
+        parser.add_argument('--async', action='store_true', dest='run_async',
+                            help='Queue the run on Celery, one task per shard, as the nightly beat job does.')
+
+    def handle(self, *args, **options):
+        if options['run_async']:
+            result = recompute_dirty_customers.delay(options['shards'])
+            self.stdout.write(f'Queued recompute run as task {result.id}')
+            return
+
+        run = start_recompute_run(options['shards'])
+        for shard_index in range(run.shard_count):
+            process_dirty_shard(run, shard_index, chunk_size=options['chunk_size'])
+        run.refresh_from_db()
+        self.stdout.write(recompute_report(finish_recompute_run(run)))
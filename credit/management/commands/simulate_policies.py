@@ -0,0 +1,57 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from credit.policy import load_customers, simulate_policies
+from credit.serializers import PolicySimulationRequestSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare eligibility policies side by side over every customer.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--policies', help='JSON file shaped like a /policy/simulate/ request body. '
+                                               'Without it only the current policy is simulated.')
+        parser.add_argument('--source', choices=['database', 'snapshot'], default='database',
+                            help='Read customers from the database or from the latest Parquet snapshot.')
+        parser.add_argument('--workers', type=int, help='Worker processes (defaults to POLICY_SIMULATION_WORKERS).')
+        parser.add_argument('--loan-to-limit', type=float, help='Share of the approved limit every customer asks for.')
+        parser.add_argument('--interest-rate', type=float, help='Requested annual interest rate, in percent.')
+        parser.add_argument('--tenure', type=int, help='Requested tenure, in months.')
+        parser.add_argument('--json', action='store_true', help='Print the full results as JSON.')
+
+    def handle(self, *args, **options):
+        body = {}
+        if options['policies']:
+            with open(options['policies']) as file:
+                body = json.load(file)
+            if isinstance(body, list):
+                body = {'policies': body}
+        scenario = body.setdefault('scenario', {})
+        for name in ('loan_to_limit', 'interest_rate', 'tenure'):
+            if options[name] is not None:
+                scenario[name] = options[name]
+
+        serializer = PolicySimulationRequestSerializer(data=body)
+        if not serializer.is_valid():
+            raise CommandError(json.dumps(serializer.errors))
+        customers = load_customers(options['source'])
+        results = simulate_policies(serializer.validated_data['policies'],
+                                    scenario=serializer.validated_data['scenario'], customers=customers,
+                                    workers=options['workers'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{len(customers['credit_score'])} customers")
+        width = max(len(result['name']) for result in results)
+        self.stdout.write(f"{'policy':<{width}} {'approval':>9} {'avg rate':>9} {'uplift':>7} {'EMI/income':>11} "
+                          f"{'over cap':>9} {'new EMIs':>14}")
+        for result in results:
+            rate = '-' if result['average_corrected_rate'] is None else f"{result['average_corrected_rate']:.2f}"
+            uplift = '-' if result['average_rate_uplift'] is None else f"{result['average_rate_uplift']:.2f}"
+            self.stdout.write(f"{result['name']:<{width}} {result['approval_rate']:>9.1%} {rate:>9} {uplift:>7} "
+                              f"{result['emi_to_income']['after']:>11.3f} "
+                              f"{result['emi_to_income']['over_cap_after']:>9} "
+                              f"{result['projected_monthly_installments']:>14.0f}")
@@ -0,0 +1,114 @@
+import datetime
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test import Client
+from django.test.utils import override_settings
+
+from credit import finance
+from credit.bench import throwaway_database
+from credit.models import Customer, DebtLedgerEntry, Loan
+from credit.rules import eligibility_rules
+from credit.utils import check_eligibility, refresh_customer_score
+
+INTEREST_RATE = 12
+TENURE = 12
+
+
+def legacy_create_loan(customer_id, loan_amount):
+    # The former create-loan path: read, check and insert with no lock on the customer
+    with transaction.atomic():
+        customer = Customer.objects.get(customer_id=customer_id)
+        approval, corrected_interest_rate = check_eligibility(credit_score=customer.credit_score,
+                                                              interest_rate=INTEREST_RATE, customer=customer)
+        if approval:
+            start_date = datetime.date.today()
+            Loan.objects.create(customer=customer, loan_amount=loan_amount, interest_rate=corrected_interest_rate,
+                                tenure=TENURE, start_date=start_date,
+                                end_date=start_date + relativedelta(months=+TENURE), emis_paid_on_time=0,
+                                monthly_repayment=finance.pmt(finance.monthly_rate(corrected_interest_rate), TENURE,
+                                                               loan_amount))
+            refresh_customer_score(customer_id)
+    return approval
+
+
+class Command(BaseCommand):
+    help = 'Fire concurrent create-loan requests at a few customers and check that none is approved past the EMI ' \
+           'cap.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=10)
+        parser.add_argument('--requests', type=int, default=400)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--emi-share', type=float, default=0.2,
+                            help='EMI of each requested loan as a share of the monthly salary.')
+        parser.add_argument('--legacy', action='store_true',
+                            help='Replay the former unlocked create-loan path instead, for comparison.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        cap = eligibility_rules.get().emi_to_income_cap
+        with throwaway_database(), override_settings(ALLOWED_HOSTS=['testserver']):
+            customers = Customer.objects.bulk_create([
+                Customer(first_name='Stress', last_name=str(index), age=30, phone_number='9000000000',
+                         monthly_salary=100000, approved_limit=3600000, credit_score=80, active_emi_total=0)
+                for index in range(options['customers'])])
+            salary = 100000
+            loan_amount = options['emi_share'] * salary / finance.pmt(finance.monthly_rate(INTEREST_RATE), TENURE, 1)
+            targets = [rng.choice(customers).customer_id for _ in range(options['requests'])]
+
+            def create(customer_id):
+                try:
+                    if options['legacy']:
+                        return legacy_create_loan(customer_id, loan_amount)
+                    response = Client().post('/create-loan/', {'customer_id': customer_id, 'loan_amount': loan_amount,
+                                                               'interest_rate': INTEREST_RATE, 'tenure': TENURE},
+                                             content_type='application/json')
+                    if response.status_code != 200:
+                        raise CommandError(f'create-loan returned {response.status_code}')
+                    return response.json()['loan_approved']
+                finally:
+                    # Worker threads hold their own connections, which would keep the test database from being dropped
+                    connections.close_all()
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(options['concurrency']) as pool:
+                approvals = list(pool.map(create, targets))
+            seconds = time.perf_counter() - start
+
+            # Replay every customer's loans in creation order: each one must have been approved while the EMIs
+            # before it were within the cap
+            over_approvals = 0
+            emis = defaultdict(float)
+            for customer_id, monthly_repayment in Loan.objects.order_by('loan_id').values_list('customer_id',
+                                                                                              'monthly_repayment'):
+                if emis[customer_id] > salary * cap:
+                    over_approvals += 1
+                emis[customer_id] += monthly_repayment
+
+            ledger_errors = 0
+            if not options['legacy']:
+                previous = defaultdict(float)
+                for entry in DebtLedgerEntry.objects.order_by('id'):
+                    if abs(entry.emi_after - entry.emi_delta - previous[entry.customer_id]) > 1e-6:
+                        ledger_errors += 1
+                    previous[entry.customer_id] = entry.emi_after
+                for customer in Customer.objects.all():
+                    if abs(customer.active_emi_total - emis[customer.customer_id]) > 1e-6 or \
+                            abs(previous[customer.customer_id] - emis[customer.customer_id]) > 1e-6:
+                        ledger_errors += 1
+
+        mode = 'legacy unlocked path' if options['legacy'] else 'create-loan with row lock and ledger'
+        self.stdout.write(f"{mode}: {len(targets)} requests over {options['customers']} customers at concurrency "
+                          f"{options['concurrency']} in {seconds:.2f}s ({len(targets) / seconds:.0f} req/s)")
+        self.stdout.write(f'approved: {sum(approvals)}, over-approvals past the EMI cap: {over_approvals}')
+        if not options['legacy']:
+            self.stdout.write(f'ledger inconsistencies: {ledger_errors}')
+            if over_approvals or ledger_errors:
+                raise CommandError('Loans were approved past the EMI cap or the ledger disagrees with the loans')
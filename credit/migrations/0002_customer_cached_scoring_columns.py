@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("credit", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customer",
+            name="active_emi_total",
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name="customer",
+            name="credit_score",
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.AlterField(
+            model_name="customer",
+            name="current_debt",
+            field=models.FloatField(db_index=True, default=0, null=True),
+        ),
+    ]
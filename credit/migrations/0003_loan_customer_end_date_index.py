@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("credit", "0002_customer_cached_scoring_columns"),
+    ]
+
+    operations = [
+        # Create the composite index before dropping the now redundant single-column FK index
+        migrations.AddIndex(
+            model_name="loan",
+            index=models.Index(
+                fields=["customer", "end_date"],
+                include=(
+                    "loan_id",
+                    "loan_amount",
+                    "tenure",
+                    "interest_rate",
+                    "monthly_repayment",
+                    "emis_paid_on_time",
+                    "start_date",
+                ),
+                name="credit_loan_cust_end_idx",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="loan",
+            name="customer",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="credit.customer",
+            ),
+        ),
+    ]
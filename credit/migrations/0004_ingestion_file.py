@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("credit", "0003_loan_customer_end_date_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IngestionFile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("file_path", models.CharField(max_length=1024)),
+                ("table_name", models.CharField(max_length=64)),
+                ("content_hash", models.CharField(max_length=64)),
+                ("chunk_size", models.IntegerField()),
+                ("chunks_committed", models.IntegerField(default=0)),
+                ("rows_read", models.BigIntegerField(default=0)),
+                ("rows_written", models.BigIntegerField(default=0)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="running",
+                        max_length=16,
+                    ),
+                ),
+                ("error", models.TextField(blank=True, default="")),
+                ("started_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("completed_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("table_name", "content_hash"),
+                        name="credit_ingestion_file_hash_uniq",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,117 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("credit", "0004_ingestion_file"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IngestRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("shard_count", models.IntegerField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="running",
+                        max_length=16,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="IngestShard",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("table_name", models.CharField(max_length=64)),
+                ("file_path", models.CharField(max_length=1024)),
+                ("shard_index", models.IntegerField()),
+                (
+                    "state",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=16,
+                    ),
+                ),
+                ("rows_read", models.BigIntegerField(default=0)),
+                ("rows_written", models.BigIntegerField(default=0)),
+                ("duplicates", models.BigIntegerField(default=0)),
+                ("skipped", models.BooleanField(default=False)),
+                ("error", models.TextField(blank=True, default="")),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RemoveConstraint(
+            model_name="ingestionfile",
+            name="credit_ingestion_file_hash_uniq",
+        ),
+        migrations.AddField(
+            model_name="ingestionfile",
+            name="shard_count",
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name="ingestionfile",
+            name="shard_index",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name="ingestionfile",
+            constraint=models.UniqueConstraint(
+                fields=("table_name", "content_hash", "shard_index", "shard_count"),
+                name="credit_ingestion_file_shard_uniq",
+            ),
+        ),
+        migrations.AddField(
+            model_name="ingestshard",
+            name="run",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="shards",
+                to="credit.ingestrun",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="ingestshard",
+            constraint=models.UniqueConstraint(
+                fields=("run", "table_name", "shard_index"),
+                name="credit_ingest_shard_uniq",
+            ),
+        ),
+    ]
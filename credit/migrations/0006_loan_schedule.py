@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("credit", "0005_partitioned_ingestion"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LoanSchedule",
+            fields=[
+                (
+                    "loan",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="schedule",
+                        serialize=False,
+                        to="credit.loan",
+                    ),
+                ),
+                ("loan_amount", models.FloatField()),
+                ("interest_rate", models.FloatField()),
+                ("tenure", models.IntegerField()),
+                ("monthly_repayment", models.FloatField()),
+                ("payments", models.BinaryField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("credit", "0006_loan_schedule"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EligibilityRuleSet",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, unique=True)),
+                ("rules", models.JSONField()),
+                ("is_active", models.BooleanField(default=False)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("is_active", True)),
+                        fields=("is_active",),
+                        name="credit_eligibility_rule_set_one_active",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:41
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("credit", "0008_debt_ledger"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DirtyCustomer",
+            fields=[
+                (
+                    "customer",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to="credit.customer",
+                    ),
+                ),
+                (
+                    "reason",
+                    models.CharField(
+                        choices=[
+                            ("loan", "New loan"),
+                            ("payment", "EMI update"),
+                            ("maturity", "Loan matured"),
+                        ],
+                        max_length=16,
+                    ),
+                ),
+                ("marked_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="RecomputeRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("shard_count", models.IntegerField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="running",
+                        max_length=16,
+                    ),
+                ),
+                ("as_of", models.DateField()),
+                ("cutoff", models.DateTimeField()),
+                ("matured", models.IntegerField(default=0)),
+                ("customers", models.IntegerField(default=0)),
+                ("adjustments", models.IntegerField(default=0)),
+                ("lag_seconds_total", models.FloatField(default=0)),
+                ("max_lag_seconds", models.FloatField(default=0)),
+                ("backlog", models.IntegerField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
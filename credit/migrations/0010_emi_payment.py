@@ -0,0 +1,80 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+# PostgreSQL gets a table range-partitioned by month of paid_on, with a default partition as a catch-all; monthly
+# partitions are created on demand by credit.payments.ensure_partitions. Primary and unique keys of a partitioned
+# table must include the partition key, so the primary key is (id, paid_on) there. Other databases get the plain
+# table Django would create.
+PARTITIONED_TABLE_SQL = [
+    """
+    CREATE TABLE credit_emipayment (
+        id bigserial NOT NULL,
+        loan_id integer NOT NULL REFERENCES credit_loan (loan_id) DEFERRABLE INITIALLY DEFERRED,
+        paid_on date NOT NULL,
+        amount double precision NOT NULL,
+        on_time boolean NOT NULL,
+        reference varchar(64) NULL,
+        PRIMARY KEY (id, paid_on),
+        CONSTRAINT credit_payment_reference_uniq UNIQUE (reference, paid_on)
+    ) PARTITION BY RANGE (paid_on)
+    """,
+    "CREATE TABLE credit_emipayment_default PARTITION OF credit_emipayment DEFAULT",
+    "CREATE INDEX credit_payment_loan_idx ON credit_emipayment (loan_id, paid_on)",
+]
+
+
+def create_payments_table(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        for sql in PARTITIONED_TABLE_SQL:
+            schema_editor.execute(sql)
+    else:
+        schema_editor.create_model(apps.get_model("credit", "EmiPayment"))
+
+
+def drop_payments_table(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP TABLE credit_emipayment CASCADE")
+    else:
+        schema_editor.delete_model(apps.get_model("credit", "EmiPayment"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("credit", "0009_dirty_customer_recompute"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="EmiPayment",
+                    fields=[
+                        ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                        ("paid_on", models.DateField()),
+                        ("amount", models.FloatField()),
+                        ("on_time", models.BooleanField(default=True)),
+                        ("reference", models.CharField(blank=True, max_length=64, null=True)),
+                        (
+                            "loan",
+                            models.ForeignKey(
+                                db_index=False,
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="emi_payments",
+                                to="credit.loan",
+                            ),
+                        ),
+                    ],
+                    options={
+                        "indexes": [models.Index(fields=["loan", "paid_on"], name="credit_payment_loan_idx")],
+                        "constraints": [
+                            models.UniqueConstraint(
+                                fields=("reference", "paid_on"), name="credit_payment_reference_uniq"
+                            )
+                        ],
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_payments_table, drop_payments_table),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+# Rows loaded with explicit ids before reserve_ids existed (the initial data load, and legacy bulk registrations)
+# left the PostgreSQL id sequences behind MAX(id), so the first reservations would hand out ids already in use.
+# The sequences are moved up to MAX(id) once, and never backwards. SQLite's AUTOINCREMENT counter is caught up by
+# reserve_ids itself, so there is nothing to do there.
+SEQUENCE_TABLES = [
+    ("credit_customer", "customer_id"),
+    ("credit_loan", "loan_id"),
+]
+
+
+def sync_id_sequences(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table_name, pk in SEQUENCE_TABLES:
+        schema_editor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table_name}', '{pk}'), "
+            f"GREATEST(MAX({pk}), pg_sequence_last_value(pg_get_serial_sequence('{table_name}', '{pk}')), 1)) "
+            f"FROM {table_name}"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("credit", "0010_emi_payment"),
+    ]
+
+    operations = [
+        migrations.RunPython(sync_id_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("credit", "0011_sync_id_sequences"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ingestrun",
+            name="error",
+            field=models.TextField(blank=True, default=""),
+        ),
+    ]
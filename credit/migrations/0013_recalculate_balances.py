@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:07
+
+from django.db import migrations, models
+from django.utils import timezone
+
+# Remaining balances used to be read after tenure - emis_paid_on_time payments instead of after the payments made,
+# so every cached current_debt (and the ledger totals behind it) is wrong. Every customer with a loan is marked for
+# the next recompute run, which rewrites the figures under the customer row locks and records the corrections as
+# ledger adjustments; run `python manage.py recompute_dirty` right after migrating rather than waiting for the
+# nightly run.
+
+
+def mark_customers_with_loans(apps, schema_editor):
+    connection = schema_editor.connection
+    schema_editor.execute(
+        "INSERT INTO credit_dirtycustomer (customer_id, reason, marked_at) "
+        "SELECT DISTINCT customer_id, %s, %s FROM credit_loan WHERE true ON CONFLICT DO NOTHING",
+        ["recalculation", connection.ops.adapt_datetimefield_value(timezone.now())],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("credit", "0012_ingest_run_error"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="dirtycustomer",
+            name="reason",
+            field=models.CharField(
+                choices=[
+                    ("loan", "New loan"),
+                    ("payment", "EMI update"),
+                    ("maturity", "Loan matured"),
+                    ("recalculation", "Formula change"),
+                ],
+                max_length=16,
+            ),
+        ),
+        migrations.RunPython(mark_customers_with_loans, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,9 @@
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
+
+from credit.rules import validate_rules
+from credit.schedules import amortization_schedules, balance_at, pack_schedule
 
 # Create your models here.
 class Customer(models.Model):
@@ -9,13 +14,25 @@ class Customer(models.Model):
     phone_number = models.CharField(max_length=20)
     monthly_salary = models.FloatField()
     approved_limit = models.IntegerField()
+    # Maintained on loan creation and by the bulk recompute so reads never walk the loan history
+    current_debt = models.FloatField(default=0, null=True, db_index=True)
+    credit_score = models.FloatField(default=0, db_index=True)
+    active_emi_total = models.FloatField(default=0, db_index=True)
+
+    @property
+    def available_limit(self):
+        return self.approved_limit - (self.current_debt or 0)
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
 
 class Loan(models.Model):
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    # Advanced by payment recording; re-ingesting a loan file keeps the greater of the stored and file values
+    MONOTONIC_FIELDS = ('emis_paid_on_time',)
+
+    # Lookups by customer are served by the composite index below, which has customer_id as its leading column
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, db_index=False)
     loan_id = models.AutoField(unique=True, primary_key=True)
     loan_amount = models.FloatField()
     tenure = models.IntegerField()
@@ -25,5 +42,302 @@ class Loan(models.Model):
     start_date = models.DateField()
     end_date = models.DateField()
 
+    class Meta:
+        indexes = [
+            # Serves every "active loans of a customer" lookup; the included columns let PostgreSQL answer
+            # view-loans and the eligibility aggregates with an index-only scan
+            models.Index(fields=['customer', 'end_date'], name='credit_loan_cust_end_idx',
+                         include=['loan_id', 'loan_amount', 'tenure', 'interest_rate', 'monthly_repayment',
+                                  'emis_paid_on_time', 'start_date']),
+        ]
+
     def __str__(self):
         return f"Loan {self.loan_id} for {self.customer}"
+
+
+class LoanSchedule(models.Model):
+    """Amortization schedule of a loan, materialized once as packed float64 (principal, interest, balance) rows."""
+    TERM_FIELDS = ('loan_amount', 'interest_rate', 'tenure', 'monthly_repayment')
+
+    loan = models.OneToOneField(Loan, on_delete=models.CASCADE, primary_key=True, related_name='schedule')
+    # Loan terms the schedule was built from, so re-ingested or edited loans are detected as stale
+    loan_amount = models.FloatField()
+    interest_rate = models.FloatField()
+    tenure = models.IntegerField()
+    monthly_repayment = models.FloatField()
+    payments = models.BinaryField()
+
+    @classmethod
+    def from_loan(cls, loan):
+        schedule = amortization_schedules([loan.loan_amount], [loan.interest_rate], [loan.tenure],
+                                          [loan.monthly_repayment])[0]
+        return cls(loan=loan, payments=pack_schedule(schedule),
+                   **{field: getattr(loan, field) for field in cls.TERM_FIELDS})
+
+    def matches(self, loan):
+        return all(getattr(self, field) == getattr(loan, field) for field in self.TERM_FIELDS)
+
+    def balance_at(self, month):
+        return balance_at(self.payments, month)
+
+    def remaining_balance(self, emis_paid_on_time):
+        # Same figure as utils.calculate_remaining_loan_balance, read from the schedule instead of recomputed
+        # (the balance after emis_paid_on_time payments; clamped for loans paid past their tenure)
+        month = min(max(emis_paid_on_time, 0), self.tenure)
+        return max(self.balance_at(month), 0.0)
+
+    def __str__(self):
+        return f"Schedule of loan {self.loan_id}"
+
+
+class DebtLedgerEntry(models.Model):
+    """Append-only record of every change loan origination and recompute runs make to a customer's debt and active
+    EMI total.
+
+    Each entry carries the running totals after it, which are also written to the customer's cached columns in the
+    same transaction, so available limit and active EMI are read in O(1) from the customer row.
+    """
+    KIND_ORIGINATION = 'origination'
+    KIND_ADJUSTMENT = 'adjustment'
+    KIND_CHOICES = [
+        (KIND_ORIGINATION, 'Origination'),
+        (KIND_ADJUSTMENT, 'Adjustment'),
+    ]
+
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='ledger_entries', db_index=False)
+    loan = models.ForeignKey(Loan, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    debt_delta = models.FloatField()
+    emi_delta = models.FloatField()
+    debt_after = models.FloatField()
+    emi_after = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'id'], name='credit_ledger_customer_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Debt ledger entries are append-only.')
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.kind} of {self.debt_delta:+.2f} for customer {self.customer_id}"
+
+
+class EmiPayment(models.Model):
+    """Append-only EMI payment event.
+
+    On PostgreSQL the table is range-partitioned by month of paid_on (see migration 0010 and
+    credit.payments.ensure_partitions), so its primary key is (id, paid_on) there.
+    """
+    id = models.BigAutoField(primary_key=True)
+    loan = models.ForeignKey(Loan, on_delete=models.CASCADE, related_name='emi_payments', db_index=False)
+    paid_on = models.DateField()
+    amount = models.FloatField()
+    # Only on-time payments count towards the loan's emis_paid_on_time
+    on_time = models.BooleanField(default=True)
+    # Optional id from the payment source; an event resent with the same reference and date is ignored
+    reference = models.CharField(max_length=64, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['loan', 'paid_on'], name='credit_payment_loan_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['reference', 'paid_on'], name='credit_payment_reference_uniq'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('EMI payments are append-only.')
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Payment of {self.amount:.2f} on loan {self.loan_id} ({self.paid_on})"
+
+
+class EligibilityRuleSet(models.Model):
+    """Eligibility rules edited in the database; the active row overrides ELIGIBILITY_RULES_FILE."""
+    name = models.CharField(max_length=100, unique=True)
+    rules = models.JSONField()
+    is_active = models.BooleanField(default=False)
+    # Serving processes compare this against the version they compiled to pick up edits
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['is_active'], condition=models.Q(is_active=True),
+                                    name='credit_eligibility_rule_set_one_active'),
+        ]
+
+    def clean(self):
+        try:
+            validate_rules(self.rules)
+        except ValueError as e:
+            raise ValidationError({'rules': str(e)})
+
+    def __str__(self):
+        return f"{self.name}{' (active)' if self.is_active else ''}"
+
+
+class IngestionFile(models.Model):
+    """Tracks every file loaded by the ingestion pipeline, with a checkpoint after each committed chunk."""
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    file_path = models.CharField(max_length=1024)
+    table_name = models.CharField(max_length=64)
+    content_hash = models.CharField(max_length=64)
+    # Sharded loads track each row-range shard of a file separately
+    shard_index = models.IntegerField(default=0)
+    shard_count = models.IntegerField(default=1)
+    chunk_size = models.IntegerField()
+    chunks_committed = models.IntegerField(default=0)
+    rows_read = models.BigIntegerField(default=0)
+    rows_written = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    error = models.TextField(blank=True, default='')
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['table_name', 'content_hash', 'shard_index', 'shard_count'],
+                                    name='credit_ingestion_file_shard_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.file_path} -> {self.table_name} ({self.status})"
+
+
+class IngestRun(models.Model):
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    shard_count = models.IntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Ingest run {self.pk} ({self.status})"
+
+
+class IngestShard(models.Model):
+    STATE_PENDING = 'pending'
+    STATE_RUNNING = 'running'
+    STATE_COMPLETED = 'completed'
+    STATE_FAILED = 'failed'
+    STATE_CHOICES = [
+        (STATE_PENDING, 'Pending'),
+        (STATE_RUNNING, 'Running'),
+        (STATE_COMPLETED, 'Completed'),
+        (STATE_FAILED, 'Failed'),
+    ]
+
+    run = models.ForeignKey(IngestRun, on_delete=models.CASCADE, related_name='shards')
+    table_name = models.CharField(max_length=64)
+    file_path = models.CharField(max_length=1024)
+    shard_index = models.IntegerField()
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default=STATE_PENDING)
+    rows_read = models.BigIntegerField(default=0)
+    rows_written = models.BigIntegerField(default=0)
+    duplicates = models.BigIntegerField(default=0)
+    skipped = models.BooleanField(default=False)
+    error = models.TextField(blank=True, default='')
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'table_name', 'shard_index'], name='credit_ingest_shard_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.table_name} shard {self.shard_index} of run {self.run_id} ({self.state})"
+
+
+class DirtyCustomer(models.Model):
+    """Customers whose cached debt, credit score and active EMI total are due for the next recompute run."""
+    REASON_LOAN = 'loan'
+    REASON_PAYMENT = 'payment'
+    REASON_MATURITY = 'maturity'
+    REASON_RECALCULATION = 'recalculation'
+    REASON_CHOICES = [
+        (REASON_LOAN, 'New loan'),
+        (REASON_PAYMENT, 'EMI update'),
+        (REASON_MATURITY, 'Loan matured'),
+        (REASON_RECALCULATION, 'Formula change'),
+    ]
+
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    reason = models.CharField(max_length=16, choices=REASON_CHOICES)
+    # When the customer first became dirty; later marks keep it, so recompute lag is measured from the oldest change
+    marked_at = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def mark(cls, customer_ids, reason):
+        cls.objects.bulk_create([cls(customer_id=customer_id, reason=reason) for customer_id in customer_ids],
+                                ignore_conflicts=True, batch_size=5000)
+
+    def __str__(self):
+        return f"Customer {self.customer_id} ({self.reason})"
+
+
+class RecomputeRun(models.Model):
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    shard_count = models.IntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    # Loans ending since the previous run's as_of date are marked dirty up to this one
+    as_of = models.DateField()
+    # Customers marked dirty after the cutoff are left for the next run
+    cutoff = models.DateTimeField()
+    matured = models.IntegerField(default=0)
+    customers = models.IntegerField(default=0)
+    adjustments = models.IntegerField(default=0)
+    # Summed and worst time between a customer being marked dirty and its recompute committing
+    lag_seconds_total = models.FloatField(default=0)
+    max_lag_seconds = models.FloatField(default=0)
+    backlog = models.IntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def seconds(self):
+        return (self.finished_at - self.created_at).total_seconds() if self.finished_at else None
+
+    @property
+    def customers_per_second(self):
+        return self.customers / self.seconds if self.seconds else None
+
+    @property
+    def mean_lag_seconds(self):
+        return self.lag_seconds_total / self.customers if self.customers else None
+
+    def __str__(self):
+        return f"Recompute run {self.pk} ({self.status})"
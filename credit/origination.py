@@ -0,0 +1,84 @@
+import datetime
+import random
+import time
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+from credit import finance
+from credit.cache import customer_summaries
+from credit.instrumentation import span
+from credit.models import Customer, DebtLedgerEntry, DirtyCustomer, Loan, LoanSchedule
+from credit.utils import check_eligibility, credit_score_from_stats, get_loan_stats
+
+# Deadlocks, serialization failures and lock timeouts on PostgreSQL; a busy database on SQLite
+TRANSIENT_SQLSTATES = ('40P01', '40001', '55P03')
+
+
+def is_transient(error):
+    cause = error.__cause__
+    sqlstate = getattr(cause, 'sqlstate', None) or getattr(cause, 'pgcode', None)
+    return sqlstate in TRANSIENT_SQLSTATES or 'database is locked' in str(error)
+
+
+def _originate(customer_id, loan_amount, interest_rate, tenure):
+    # The row lock serializes every origination for this customer until the surrounding transaction commits, so
+    # each one sees the debt and EMI totals left by the previous one
+    customer = Customer.objects.select_for_update().get(customer_id=customer_id)
+    approval, corrected_interest_rate = check_eligibility(credit_score=customer.credit_score,
+                                                          interest_rate=interest_rate, customer=customer)
+    with span('installment'):
+        monthly_installment = finance.pmt(finance.monthly_rate(corrected_interest_rate), tenure, loan_amount)
+    if not approval:
+        return {'loan': None, 'approval': False, 'message': 'Loan not approved', 'monthly_installment': None}
+    if settings.LOAN_ENFORCE_APPROVED_LIMIT and loan_amount > customer.available_limit:
+        return {'loan': None, 'approval': False, 'message': 'Loan exceeds the available limit',
+                'monthly_installment': None}
+
+    start_date = datetime.datetime.today().date()
+    loan = Loan.objects.create(
+        customer=customer,
+        loan_amount=loan_amount,
+        interest_rate=corrected_interest_rate,
+        tenure=tenure,
+        start_date=start_date,
+        end_date=start_date + relativedelta(months=+tenure),
+        emis_paid_on_time=0,
+        monthly_repayment=monthly_installment
+    )
+    # The schedule is materialized once here; balances are read from it from now on
+    schedule = LoanSchedule.from_loan(loan)
+    schedule.save()
+    balance = schedule.remaining_balance(loan.emis_paid_on_time)
+
+    entry = DebtLedgerEntry.objects.create(
+        customer=customer, loan=loan, kind=DebtLedgerEntry.KIND_ORIGINATION,
+        debt_delta=balance, emi_delta=monthly_installment,
+        debt_after=(customer.current_debt or 0) + balance,
+        emi_after=customer.active_emi_total + monthly_installment,
+    )
+    Customer.objects.filter(customer_id=customer_id).update(
+        current_debt=entry.debt_after, active_emi_total=entry.emi_after,
+        credit_score=credit_score_from_stats(get_loan_stats(customer_id)))
+    # The score's loan counts change with every new loan, so the next recompute run revisits this customer
+    DirtyCustomer.mark([customer_id], DirtyCustomer.REASON_LOAN)
+    transaction.on_commit(lambda: customer_summaries.invalidate(customer_id))
+    return {'loan': loan, 'approval': True, 'message': 'Loan approved', 'monthly_installment': monthly_installment}
+
+
+def originate_loan(customer_id, loan_amount, interest_rate, tenure) -> dict:
+    """Check and create a loan under a lock on the customer row, appending to the debt ledger.
+
+    Runs in a savepoint that is retried with jittered backoff on transient lock conflicts. Raises
+    Customer.DoesNotExist for unknown customers.
+    """
+    retries = settings.LOAN_ORIGINATION_RETRIES
+    for attempt in range(retries + 1):
+        try:
+            with transaction.atomic():
+                return _originate(customer_id, loan_amount, interest_rate, tenure)
+        except OperationalError as e:
+            if attempt == retries or not is_transient(e):
+                raise
+            time.sleep(settings.LOAN_ORIGINATION_BACKOFF * 2 ** attempt * random.random())
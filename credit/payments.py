@@ -0,0 +1,224 @@
+import datetime
+import io
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.db.models.functions import Least
+import pandas as pd
+
+from credit.cache import customer_summaries
+from credit.ingestion import iter_file_chunks
+from credit.models import DirtyCustomer, Loan
+from credit.utils import iter_chunks
+
+# EMI payment events: validated into a frame, appended to the payments table (monthly partitions on PostgreSQL),
+# and folded into the loans' emis_paid_on_time counters with set-based statements. Customers whose loans changed
+# are queued in DirtyCustomer for the next recompute run.
+
+PAYMENT_COLUMNS = ('loan_id', 'paid_on', 'amount', 'on_time', 'reference')
+REQUIRED_COLUMNS = ('loan_id', 'paid_on', 'amount')
+TRUE_VALUES = {'true', 't', 'yes', 'y', '1'}
+FALSE_VALUES = {'false', 'f', 'no', 'n', '0'}
+
+
+def _check(invalid, message):
+    if invalid.any():
+        raise ValueError(f'Row {invalid.idxmax()}: {message}')
+
+
+def _on_time_values(values):
+    if pd.api.types.is_bool_dtype(values):
+        return values
+    text = values.astype('string').str.strip().str.lower()
+    _check(text.notna() & ~text.isin(TRUE_VALUES | FALSE_VALUES), 'on_time must be true or false.')
+    # A blank cell is an on-time payment, like a missing column
+    return ~text.isin(FALSE_VALUES).fillna(False)
+
+
+def prepare_payments(frame, today=None) -> pd.DataFrame:
+    """Validate payment events and coerce them to PAYMENT_COLUMNS; raises ValueError naming the first bad row."""
+    missing = [column for column in REQUIRED_COLUMNS if column not in frame.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}.")
+    today = today or datetime.date.today()
+
+    loan_ids = pd.to_numeric(frame['loan_id'], errors='coerce')
+    _check(loan_ids.isna() | (loan_ids % 1 != 0), 'loan_id must be an integer.')
+    paid_on = pd.to_datetime(frame['paid_on'], errors='coerce', format='ISO8601')
+    _check(paid_on.isna(), 'paid_on must be a date (YYYY-MM-DD).')
+    paid_on = paid_on.dt.normalize()
+    _check(paid_on > pd.Timestamp(today), 'paid_on cannot be in the future.')
+    amounts = pd.to_numeric(frame['amount'], errors='coerce')
+    _check(amounts.isna() | (amounts < 0), 'amount must be a non-negative number.')
+
+    prepared = pd.DataFrame({'loan_id': loan_ids.astype('int64'), 'paid_on': paid_on,
+                             'amount': amounts.astype('float64')}, index=frame.index)
+    prepared['on_time'] = _on_time_values(frame['on_time']) if 'on_time' in frame.columns else True
+    if 'reference' in frame.columns:
+        references = frame['reference'].astype('string').str.strip().replace('', pd.NA)
+        _check(references.str.len().fillna(0) > 64, 'reference must be at most 64 characters.')
+        prepared['reference'] = references.astype(object).where(references.notna(), None)
+    else:
+        prepared['reference'] = None
+    return prepared
+
+
+# (database name, first day of month) of partitions known to exist, so each is checked once per process
+_partitions = set()
+
+
+def partition_name(month):
+    return f'credit_emipayment_p{month:%Y%m}'
+
+
+def ensure_partitions(paid_on):
+    """Create the monthly partitions of credit_emipayment that the given dates fall in (PostgreSQL only).
+
+    Rows for a month without a partition would land in the default partition, which keeps working but is never
+    pruned, so partitions are created before each load rather than ahead of time.
+    """
+    if connection.vendor != 'postgresql':
+        return []
+    database = connection.settings_dict['NAME']
+    months = {day.replace(day=1) for day in pd.to_datetime(pd.Series(paid_on)).dt.date.unique()}
+    created = []
+    for month in sorted(months):
+        if (database, month) in _partitions:
+            continue
+        end = datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        name = partition_name(month)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+            if not cursor.fetchone()[0]:
+                try:
+                    with transaction.atomic():
+                        cursor.execute(f"CREATE TABLE {name} PARTITION OF credit_emipayment "
+                                       f"FOR VALUES FROM ('{month.isoformat()}') TO ('{end.isoformat()}')")
+                    created.append(name)
+                except DatabaseError:
+                    # Another load created it first, or the default partition already holds rows of that month
+                    # (which PostgreSQL refuses to move); either way the rows still have a partition to go to
+                    pass
+        # A partition created in a transaction that rolls back is gone again, so it is only remembered on commit
+        transaction.on_commit(lambda key=(database, month): _partitions.add(key))
+    return created
+
+
+RECORD_PAYMENTS_SQL = """
+WITH inserted AS (
+    INSERT INTO credit_emipayment (loan_id, paid_on, amount, on_time, reference)
+    SELECT s.loan_id, s.paid_on, s.amount, s.on_time, s.reference
+    FROM credit_emipayment_staging s JOIN credit_loan l ON l.loan_id = s.loan_id
+    ON CONFLICT DO NOTHING
+    RETURNING loan_id, on_time
+), paid AS (
+    SELECT loan_id, count(*) AS emis FROM inserted WHERE on_time GROUP BY loan_id
+), updated AS (
+    UPDATE credit_loan l SET emis_paid_on_time = LEAST(l.tenure, l.emis_paid_on_time + paid.emis)
+    FROM paid
+    WHERE l.loan_id = paid.loan_id AND l.emis_paid_on_time < l.tenure
+    RETURNING l.customer_id
+), marked AS (
+    INSERT INTO credit_dirtycustomer (customer_id, reason, marked_at)
+    SELECT DISTINCT customer_id, %s, now() FROM updated
+    ON CONFLICT DO NOTHING
+)
+SELECT
+    (SELECT count(*) FROM credit_emipayment_staging s
+     WHERE NOT EXISTS (SELECT 1 FROM credit_loan l WHERE l.loan_id = s.loan_id)),
+    (SELECT count(*) FROM inserted),
+    (SELECT count(*) FROM updated),
+    (SELECT coalesce(array_agg(DISTINCT customer_id), '{}') FROM updated)
+"""
+
+
+def _record_postgresql(payments):
+    ensure_partitions(payments['paid_on'])
+    buffer = io.StringIO()
+    payments.to_csv(buffer, index=False, header=False, columns=list(PAYMENT_COLUMNS), date_format='%Y-%m-%d')
+    with connection.cursor() as cursor:
+        # Rows are dropped on commit, and emptied up front in case several loads share one transaction
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS credit_emipayment_staging (loan_id integer, paid_on date, "
+                       "amount double precision, on_time boolean, reference varchar(64)) ON COMMIT DELETE ROWS")
+        cursor.execute("TRUNCATE credit_emipayment_staging")
+        copy_sql = f"COPY credit_emipayment_staging ({', '.join(PAYMENT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+        if hasattr(cursor, 'copy_expert'):
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+        else:
+            with cursor.copy(copy_sql) as copy:
+                copy.write(buffer.getvalue())
+        cursor.execute(RECORD_PAYMENTS_SQL, [DirtyCustomer.REASON_PAYMENT])
+        unknown, recorded, loans_updated, customer_ids = cursor.fetchone()
+    return unknown, recorded, loans_updated, list(customer_ids)
+
+
+def _record_portable(payments, batch_size=2000):
+    loan_ids = payments['loan_id'].unique().tolist()
+    known = set()
+    for chunk in iter_chunks(loan_ids, batch_size):
+        known.update(Loan.objects.filter(loan_id__in=chunk).values_list('loan_id', flat=True))
+    rows = payments[payments['loan_id'].isin(known)]
+    records = zip(rows['loan_id'].tolist(), rows['paid_on'].dt.strftime('%Y-%m-%d').tolist(),
+                  rows['amount'].tolist(), rows['on_time'].tolist(), rows['reference'].tolist())
+
+    inserted = []
+    with connection.cursor() as cursor:
+        for chunk in iter_chunks(records, batch_size):
+            values = ', '.join(['(%s, %s, %s, %s, %s)'] * len(chunk))
+            cursor.execute(f"INSERT INTO credit_emipayment ({', '.join(PAYMENT_COLUMNS)}) VALUES {values} "
+                           f"ON CONFLICT DO NOTHING RETURNING loan_id, on_time",
+                           [value for record in chunk for value in record])
+            inserted += cursor.fetchall()
+
+    paid = Counter(loan_id for loan_id, on_time in inserted if on_time)
+    open_loans = dict(Loan.objects.filter(loan_id__in=list(paid), emis_paid_on_time__lt=F('tenure'))
+                      .values_list('loan_id', 'customer_id'))
+    # One UPDATE per distinct payment count rather than one per loan
+    by_count = defaultdict(list)
+    for loan_id in open_loans:
+        by_count[paid[loan_id]].append(loan_id)
+    for emis, chunk_ids in by_count.items():
+        for chunk in iter_chunks(chunk_ids, batch_size):
+            Loan.objects.filter(loan_id__in=chunk).update(
+                emis_paid_on_time=Least(F('tenure'), F('emis_paid_on_time') + emis))
+    customer_ids = sorted(set(open_loans.values()))
+    DirtyCustomer.mark(customer_ids, DirtyCustomer.REASON_PAYMENT)
+    return len(payments) - len(rows), len(inserted), len(open_loans), customer_ids
+
+
+def record_payments(payments) -> dict:
+    """Append prepared payment events and advance the paid loans' emis_paid_on_time counters.
+
+    Events for unknown loans are skipped, and so are events whose (reference, paid_on) was already recorded.
+    Each on-time payment counts one EMI, capped at the loan's tenure. Customers of updated loans are marked dirty
+    for the next recompute run, and their cached summaries are dropped once the transaction commits.
+    """
+    if not len(payments):
+        return {'received': 0, 'recorded': 0, 'duplicates': 0, 'unknown_loans': 0, 'loans_updated': 0,
+                'customers_marked': 0}
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            unknown, recorded, loans_updated, customer_ids = _record_postgresql(payments)
+        else:
+            unknown, recorded, loans_updated, customer_ids = _record_portable(payments)
+        transaction.on_commit(lambda: customer_summaries.invalidate_many(customer_ids))
+    return {'received': len(payments), 'recorded': recorded, 'duplicates': len(payments) - unknown - recorded,
+            'unknown_loans': unknown, 'loans_updated': loans_updated, 'customers_marked': len(customer_ids)}
+
+
+def load_payments_file(file_path, chunk_size=None) -> dict:
+    """Stream a CSV, Excel or Parquet file of payment events into the payments table, one transaction per chunk."""
+    stats = {'received': 0, 'recorded': 0, 'duplicates': 0, 'unknown_loans': 0, 'loans_updated': 0,
+             'customers_marked': 0, 'chunks': 0}
+    started = time.perf_counter()
+    for chunk in iter_file_chunks(file_path, chunk_size or settings.PAYMENTS_CHUNK_SIZE):
+        for key, value in record_payments(prepare_payments(chunk)).items():
+            stats[key] += value
+        stats['chunks'] += 1
+    stats['seconds'] = time.perf_counter() - started
+    stats['events_per_second'] = stats['received'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
@@ -0,0 +1,147 @@
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.conf import settings
+
+from credit import finance
+from credit.models import Customer
+from credit.rules import CompiledRules, eligibility_rules
+from credit.snapshots import SnapshotReader
+from credit.utils import iter_chunks
+
+# The application every customer is assumed to make: loan_to_limit of their approved limit, at an annual
+# interest_rate percentage, over tenure months
+DEFAULT_SCENARIO = {
+    'loan_to_limit': 0.1,
+    'interest_rate': 10.0,
+    'tenure': 36,
+}
+
+CUSTOMER_COLUMNS = ('credit_score', 'monthly_salary', 'active_emi_total', 'approved_limit')
+
+# Policies use the eligibility rules format of credit.rules, plus a name.
+# Policy fields a grid may vary; every combination of the listed values becomes one policy
+GRID_FIELDS = ('emi_to_income_cap', 'bands')
+
+
+def current_policy() -> dict:
+    """The eligibility rules currently served by check_eligibility, as a policy."""
+    return {**eligibility_rules.get().rules, 'name': 'current'}
+
+
+def expand_grid(base, grid) -> list:
+    """Every combination of the grid's values applied to the base policy."""
+    axes = [field for field in GRID_FIELDS if field in grid]
+    policies = []
+    for choice in itertools.product(*(range(len(grid[field])) for field in axes)):
+        labels = [f'bands#{index}' if field == 'bands' else f'{field}={grid[field][index]}'
+                  for field, index in zip(axes, choice)]
+        policies.append({**base, **{field: grid[field][index] for field, index in zip(axes, choice)},
+                         'name': ' '.join([base.get('name', 'policy'), *labels])})
+    return policies
+
+
+def load_customers(source='database', chunk_size=None) -> dict:
+    """Scoring columns of every customer as aligned float64 arrays, from the database or the latest snapshot."""
+    if source == 'snapshot':
+        reader = SnapshotReader()
+        buckets = [reader.columns('credit_customer', bucket, list(CUSTOMER_COLUMNS)) for bucket in reader.buckets]
+        return {column: np.concatenate([bucket[column] for bucket in buckets]).astype(np.float64)
+                for column in CUSTOMER_COLUMNS}
+
+    chunk_size = chunk_size or settings.PORTFOLIO_CHUNK_SIZE
+    rows = Customer.objects.order_by().values_list(*CUSTOMER_COLUMNS).iterator(chunk_size=chunk_size)
+    chunks = [np.array(chunk, dtype=np.float64) for chunk in iter_chunks(rows, chunk_size)]
+    table = np.concatenate(chunks) if chunks else np.empty((0, len(CUSTOMER_COLUMNS)))
+    return {column: np.ascontiguousarray(table[:, index]) for index, column in enumerate(CUSTOMER_COLUMNS)}
+
+
+def evaluate_policy(policy, customers, scenario) -> dict:
+    """Per-customer outcome of the scenario application under one policy, as aligned arrays."""
+    rules = CompiledRules(policy)
+    scores = customers['credit_score']
+    interest_rates = np.full(len(scores), float(scenario['interest_rate']))
+    approvals, corrected_rates = rules.evaluate_batch(scores, interest_rates, customers['monthly_salary'],
+                                                      customers['active_emi_total'])
+    bands = rules.bands(scores)
+
+    loan_amounts = customers['approved_limit'] * scenario['loan_to_limit']
+    installments = np.where(approvals, finance.pmt(finance.monthly_rate(corrected_rates), scenario['tenure'],
+                                                   loan_amounts), 0.0)
+    return {
+        'band': bands,
+        'approval': approvals,
+        'rejected_emi_cap': (bands >= 0) & ~approvals,
+        'corrected_interest_rate': corrected_rates,
+        'monthly_installment': installments,
+    }
+
+
+def summarize(policy, customers, scenario, outcome) -> dict:
+    approvals = outcome['approval']
+    approved = int(approvals.sum())
+    salaries = customers['monthly_salary']
+    with_salary = salaries > 0
+    before = customers['active_emi_total'][with_salary] / salaries[with_salary]
+    after = (customers['active_emi_total'] + outcome['monthly_installment'])[with_salary] / salaries[with_salary]
+    rates = outcome['corrected_interest_rate'][approvals]
+    thresholds = sorted(band['min_score'] for band in policy['bands'])
+    band_counts = np.bincount(outcome['band'][approvals], minlength=len(thresholds))
+
+    return {
+        'name': policy.get('name', 'policy'),
+        'customers': len(approvals),
+        'approved': approved,
+        'approval_rate': approved / len(approvals) if len(approvals) else 0.0,
+        'rejected_score': int((outcome['band'] < 0).sum()),
+        'rejected_emi_cap': int(outcome['rejected_emi_cap'].sum()),
+        'average_corrected_rate': float(rates.mean()) if approved else None,
+        'average_rate_uplift': float(rates.mean() - scenario['interest_rate']) if approved else None,
+        'projected_monthly_installments': float(outcome['monthly_installment'].sum()),
+        'emi_to_income': {
+            'before': float(before.mean()) if len(before) else 0.0,
+            'after': float(after.mean()) if len(after) else 0.0,
+            'over_cap_after': int((after > policy['emi_to_income_cap']).sum()),
+        },
+        'approved_by_band': [{'min_score': min_score, 'approved': int(count)}
+                             for min_score, count in zip(thresholds, band_counts.tolist())],
+    }
+
+
+def simulate_policy(policy, customers, scenario) -> dict:
+    return summarize(policy, customers, scenario, evaluate_policy(policy, customers, scenario))
+
+
+# Customer arrays of a simulation worker process, set once per worker by the pool initializer
+_worker_customers = None
+
+
+def _init_worker(customers):
+    global _worker_customers
+    _worker_customers = customers
+
+
+def _simulate_batch(policies, scenario):
+    return [simulate_policy(policy, _worker_customers, scenario) for policy in policies]
+
+
+def simulate_policies(policies, scenario=None, customers=None, workers=None) -> list:
+    """Summaries of every policy over the same loaded customers, in the order given.
+
+    Large policy grids are split across worker processes, each receiving the customer arrays once.
+    """
+    scenario = {**DEFAULT_SCENARIO, **(scenario or {})}
+    customers = load_customers() if customers is None else customers
+    workers = settings.POLICY_SIMULATION_WORKERS if workers is None else workers
+    if workers <= 1 or len(policies) < settings.POLICY_SIMULATION_PARALLEL_MIN_POLICIES:
+        return [simulate_policy(policy, customers, scenario) for policy in policies]
+
+    # Forked workers inherit the customer arrays without pickling them, and never touch the database
+    batch_size = max(1, -(-len(policies) // (workers * 4)))
+    batches = [policies[start:start + batch_size] for start in range(0, len(policies), batch_size)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+                             initializer=_init_worker, initargs=(customers,)) as pool:
+        results = pool.map(_simulate_batch, batches, itertools.repeat(scenario))
+        return [summary for batch in results for summary in batch]
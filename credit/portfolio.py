@@ -0,0 +1,134 @@
+import datetime
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from credit.models import Customer, Loan
+from credit.rules import eligibility_rules
+from credit.utils import calculate_remaining_loan_balances, iter_chunks
+
+# Fixed bin edges keep every accumulator a few dozen numbers, however large the book is
+CREDIT_SCORE_BINS = np.arange(0, 101, 10, dtype=np.float64)
+EMI_TO_INCOME_BINS = np.array([0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1.0, np.inf])
+INTEREST_RATE_BANDS = np.array([0, 8, 10, 12, 14, 16, 18, np.inf])
+
+SNAPSHOT_KEY = 'portfolio-summary:v1'
+
+
+def _edges(bins):
+    return [None if np.isinf(edge) else float(edge) for edge in bins]
+
+
+def _histogram(values, bins):
+    # Values beyond the last finite edge land in the last bin rather than being dropped
+    return np.bincount(np.clip(np.searchsorted(bins, values, side='right') - 1, 0, len(bins) - 2),
+                       minlength=len(bins) - 1)
+
+
+def compute_portfolio_summary(chunk_size: int = None) -> dict:
+    """Book-level risk figures over every customer and active loan.
+
+    Rows are streamed as column chunks into NumPy and folded into fixed-size accumulators, so memory stays
+    bounded by the chunk size regardless of the number of customers and loans.
+    """
+    chunk_size = chunk_size or settings.PORTFOLIO_CHUNK_SIZE
+    today = datetime.date.today()
+    # Customers over the cap are counted against the same compiled rules check_eligibility enforces
+    emi_to_income_cap = eligibility_rules.get().emi_to_income_cap
+
+    customers = 0
+    score_counts = np.zeros(len(CREDIT_SCORE_BINS) - 1, dtype=np.int64)
+    score_total = 0.0
+    ratio_counts = np.zeros(len(EMI_TO_INCOME_BINS) - 1, dtype=np.int64)
+    ratio_total = 0.0
+    ratio_customers = 0
+    over_cap = 0
+    rows = (Customer.objects.order_by()
+            .values_list('credit_score', 'monthly_salary', 'active_emi_total')
+            .iterator(chunk_size=chunk_size))
+    for chunk in iter_chunks(rows, chunk_size):
+        scores, salaries, emis = np.array(chunk, dtype=np.float64).T
+        customers += len(scores)
+        score_counts += _histogram(scores, CREDIT_SCORE_BINS)
+        score_total += scores.sum()
+
+        # Customers without a salary on file have no meaningful ratio
+        with_salary = salaries > 0
+        ratios = emis[with_salary] / salaries[with_salary]
+        ratio_counts += _histogram(ratios, EMI_TO_INCOME_BINS)
+        ratio_total += ratios.sum()
+        ratio_customers += len(ratios)
+        over_cap += int((ratios > emi_to_income_cap).sum())
+
+    bands = len(INTEREST_RATE_BANDS) - 1
+    band_loans = np.zeros(bands, dtype=np.int64)
+    band_principal = np.zeros(bands)
+    band_outstanding = np.zeros(bands)
+    band_installments = np.zeros(bands)
+    rows = (Loan.objects.filter(end_date__gte=today).order_by()
+            .values_list('interest_rate', 'tenure', 'emis_paid_on_time', 'monthly_repayment', 'loan_amount')
+            .iterator(chunk_size=chunk_size))
+    for chunk in iter_chunks(rows, chunk_size):
+        rates, tenures, paid, installments, amounts = np.array(chunk, dtype=np.float64).T
+        # Same remaining-balance figure as Customer.current_debt, computed for the whole chunk at once
+        balances = calculate_remaining_loan_balances(interest_rates=rates, tenures=tenures, emis_paid_on_time=paid,
+                                                     monthly_repayments=installments, loan_amounts=amounts)
+        band = np.clip(np.searchsorted(INTEREST_RATE_BANDS, rates, side='right') - 1, 0, bands - 1)
+        band_loans += np.bincount(band, minlength=bands)
+        band_principal += np.bincount(band, weights=amounts, minlength=bands)
+        band_outstanding += np.bincount(band, weights=balances, minlength=bands)
+        band_installments += np.bincount(band, weights=installments, minlength=bands)
+
+    rate_edges = _edges(INTEREST_RATE_BANDS)
+    return {
+        'as_of': today.isoformat(),
+        'generated_at': timezone.now().isoformat(),
+        'customers': customers,
+        'active_loans': int(band_loans.sum()),
+        'total_outstanding': float(band_outstanding.sum()),
+        'total_monthly_installments': float(band_installments.sum()),
+        'credit_score': {
+            'bins': _edges(CREDIT_SCORE_BINS),
+            'counts': score_counts.tolist(),
+            'mean': score_total / customers if customers else 0.0,
+        },
+        'emi_to_income': {
+            'bins': _edges(EMI_TO_INCOME_BINS),
+            'counts': ratio_counts.tolist(),
+            'mean': ratio_total / ratio_customers if ratio_customers else 0.0,
+            'over_cap': over_cap,
+            'cap': emi_to_income_cap,
+        },
+        'exposure_by_rate_band': [{
+            'min_rate': rate_edges[index],
+            'max_rate': rate_edges[index + 1],
+            'loans': int(band_loans[index]),
+            'principal': float(band_principal[index]),
+            'outstanding': float(band_outstanding[index]),
+            'monthly_installments': float(band_installments[index]),
+        } for index in range(bands)],
+    }
+
+
+def get_snapshot():
+    try:
+        return caches['snapshots'].get(SNAPSHOT_KEY)
+    except (RedisError, OSError):
+        return None
+
+
+def store_snapshot(summary):
+    try:
+        caches['snapshots'].set(SNAPSHOT_KEY, summary, settings.PORTFOLIO_SNAPSHOT_TTL)
+    except (RedisError, OSError):
+        return False
+    return True
+
+
+def refresh_snapshot() -> dict:
+    summary = compute_portfolio_summary()
+    store_snapshot(summary)
+    return summary
@@ -0,0 +1,109 @@
+import json
+
+from django.db.models import F
+from django.http import HttpResponse
+
+from credit.instrumentation import span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Lightweight rendering for the hot read endpoints: rows are read as values_list() tuples, mapped to response
+# dicts through a field mapping compiled once at import, and encoded without a DRF serializer or renderer.
+
+
+def stdlib_dumps(data) -> bytes:
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+@span('serialization')
+def dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+    return stdlib_dumps(data)
+
+
+@span('serialization')
+def dumps_lines(items) -> bytes:
+    """Newline-delimited JSON, one line per item."""
+    if orjson is not None:
+        return b''.join(orjson.dumps(item, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE)
+                        for item in items)
+    return b''.join(stdlib_dumps(item) + b'\n' for item in items)
+
+
+class FastJSONResponse(HttpResponse):
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
+
+
+class ValuesMapping:
+    """Response field -> model field (or expression) mapping, compiled into values_list() columns.
+
+    A nested dict in the mapping becomes a nested object in each row, e.g. a related customer.
+    """
+
+    def __init__(self, fields):
+        self.columns = []
+        self.shape = self._compile(fields)
+        self.flat = all(isinstance(index, int) for _, index in self.shape)
+        self.keys = tuple(key for key, _ in self.shape)
+
+    def _compile(self, fields):
+        shape = []
+        for key, source in fields.items():
+            if isinstance(source, dict):
+                shape.append((key, self._compile(source)))
+            else:
+                shape.append((key, len(self.columns)))
+                self.columns.append(source)
+        return tuple(shape)
+
+    def values(self, queryset):
+        return queryset.values_list(*self.columns)
+
+    def row(self, values):
+        if self.flat:
+            return dict(zip(self.keys, values))
+        return self._build(self.shape, values)
+
+    def _build(self, shape, values):
+        return {key: self._build(index, values) if isinstance(index, tuple) else values[index]
+                for key, index in shape}
+
+    def rows(self, queryset):
+        if self.flat:
+            keys = self.keys
+            return [dict(zip(keys, values)) for values in self.values(queryset)]
+        return [self._build(self.shape, values) for values in self.values(queryset)]
+
+    async def arows(self, queryset):
+        return [self.row(values) async for values in self.values(queryset)]
+
+
+# Same fields as LoanDetailSerializer
+LOAN_DETAIL = ValuesMapping({
+    'loan_id': 'loan_id',
+    'loan_amount': 'loan_amount',
+    'interest_rate': 'interest_rate',
+    'monthly_installment': 'monthly_repayment',
+    'repayments_left': F('tenure') - F('emis_paid_on_time'),
+})
+
+# Same fields as SingleLoanDetailSerializer, with the customer read through the same query
+SINGLE_LOAN_DETAIL = ValuesMapping({
+    'loan_id': 'loan_id',
+    'customer': {
+        'first_name': 'customer__first_name',
+        'last_name': 'customer__last_name',
+        'phone_number': 'customer__phone_number',
+        'age': 'customer__age',
+    },
+    'loan_amount': 'loan_amount',
+    'interest_rate': 'interest_rate',
+    'tenure': 'tenure',
+    'monthly_installment': 'monthly_repayment',
+})
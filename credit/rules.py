@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+# Rules format, shared by the rules file, EligibilityRuleSet rows and the policies of credit.policy.
+# A customer is approved in the band with the highest min_score strictly below their credit score and charged
+# at least that band's rate_floor (None for no floor). Customers at or below the lowest min_score, and customers
+# whose active EMIs exceed emi_to_income_cap of their monthly salary, are rejected.
+DEFAULT_RULES = {
+    'emi_to_income_cap': 0.5,
+    'bands': [
+        {'min_score': 50, 'rate_floor': None},
+        {'min_score': 30, 'rate_floor': 12},
+        {'min_score': 10, 'rate_floor': 16},
+    ],
+}
+
+
+def validate_rules(rules):
+    if not isinstance(rules, dict):
+        raise ValueError('Rules must be an object with emi_to_income_cap and bands.')
+    cap = rules.get('emi_to_income_cap')
+    if isinstance(cap, bool) or not isinstance(cap, (int, float)) or cap < 0:
+        raise ValueError('emi_to_income_cap must be a non-negative number.')
+    bands = rules.get('bands')
+    if not isinstance(bands, list) or not bands:
+        raise ValueError('bands must be a non-empty list.')
+    for band in bands:
+        if not isinstance(band, dict) or not isinstance(band.get('min_score'), (int, float)):
+            raise ValueError('Every band needs a numeric min_score.')
+        rate_floor = band.get('rate_floor')
+        if rate_floor is not None and not isinstance(rate_floor, (int, float)):
+            raise ValueError('rate_floor must be a number or null.')
+    scores = [band['min_score'] for band in bands]
+    if len(set(scores)) != len(scores):
+        raise ValueError('Band min_score values must be distinct.')
+
+
+class CompiledRules:
+    """Rules compiled into score breakpoints with aligned rate floors.
+
+    A single check walks the bands from the highest min_score down, the same if/elif chain check_eligibility
+    used before the rules were data-driven; with a handful of bands that beats a bisect. Batches use
+    np.searchsorted over the ascending breakpoints.
+    """
+    __slots__ = ('rules', 'version', 'thresholds', 'rate_floors', 'emi_to_income_cap', 'chain', 'threshold_array',
+                 'rate_floor_array')
+
+    def __init__(self, rules, version=None):
+        validate_rules(rules)
+        bands = sorted(rules['bands'], key=lambda band: band['min_score'])
+        self.rules = rules
+        self.version = version
+        self.thresholds = tuple(float(band['min_score']) for band in bands)
+        self.rate_floors = tuple(band.get('rate_floor') for band in bands)
+        self.emi_to_income_cap = float(rules['emi_to_income_cap'])
+        self.chain = tuple(zip(reversed(self.thresholds), reversed(self.rate_floors)))
+        self.threshold_array = np.array(self.thresholds)
+        self.rate_floor_array = np.array([-np.inf if floor is None else floor for floor in self.rate_floors],
+                                         dtype=np.float64)
+
+    def evaluate(self, credit_score, interest_rate, monthly_salary, active_emi_total) -> tuple:
+        """(approval, corrected_interest_rate) of one application."""
+        if active_emi_total > monthly_salary * self.emi_to_income_cap:
+            return False, interest_rate
+        # Strictly above, so a score equal to a threshold falls to the band below it
+        for min_score, rate_floor in self.chain:
+            if credit_score > min_score:
+                return True, interest_rate if rate_floor is None else max(interest_rate, rate_floor)
+        return False, interest_rate
+
+    def bands(self, credit_scores) -> np.ndarray:
+        """Band index of every score in ascending threshold order, -1 for scores that are rejected."""
+        return np.searchsorted(self.threshold_array, credit_scores, side='left') - 1
+
+    def evaluate_batch(self, credit_scores, interest_rates, monthly_salaries, active_emi_totals) -> tuple:
+        credit_scores = np.asarray(credit_scores, dtype=np.float64)
+        interest_rates = np.asarray(interest_rates, dtype=np.float64)
+        within_emi_cap = ~(np.asarray(active_emi_totals) > np.asarray(monthly_salaries) * self.emi_to_income_cap)
+
+        bands = self.bands(credit_scores)
+        approvals = within_emi_cap & (bands >= 0)
+        rate_floors = self.rate_floor_array[np.maximum(bands, 0)]
+        corrected_interest_rates = np.where(approvals, np.maximum(interest_rates, rate_floors), interest_rates)
+        return approvals, corrected_interest_rates
+
+
+def read_rules_file(path):
+    with open(path) as file:
+        if os.path.splitext(path)[1] in ('.yaml', '.yml'):
+            if yaml is None:
+                raise ImproperlyConfigured('PyYAML is required to read YAML eligibility rules.')
+            try:
+                return yaml.safe_load(file)
+            except yaml.YAMLError as e:
+                raise ValueError(str(e))
+        return json.load(file)
+
+
+class EligibilityRules:
+    """Per-process compiled eligibility rules, reloaded when the rules file or the active rule set changes.
+
+    Sources are checked at most every ELIGIBILITY_RULES_CHECK_INTERVAL seconds: a stat of the file and one
+    indexed query for the active EligibilityRuleSet. An edit that fails validation keeps the previous rules.
+    """
+
+    def __init__(self):
+        self._compiled = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self._failed_version = None
+        self.reloads = 0
+        self.last_error = None
+
+    def _source(self):
+        rule_set = (apps.get_model('credit', 'EligibilityRuleSet').objects.filter(is_active=True)
+                    .values_list('pk', 'updated_at', 'rules').first())
+        if rule_set is not None:
+            pk, updated_at, rules = rule_set
+            return ('database', pk, updated_at.isoformat()), lambda: rules
+        path = settings.ELIGIBILITY_RULES_FILE
+        try:
+            return ('file', path, os.stat(path).st_mtime_ns), lambda: read_rules_file(path)
+        except FileNotFoundError:
+            return ('default',), lambda: DEFAULT_RULES
+
+    def get(self) -> CompiledRules:
+        compiled = self._compiled
+        if (compiled is not None and
+                time.monotonic() - self._checked_at < settings.ELIGIBILITY_RULES_CHECK_INTERVAL):
+            return compiled
+
+        with self._lock:
+            version, load = self._source()
+            if self._compiled is None or version not in (self._compiled.version, self._failed_version):
+                try:
+                    self._compiled = CompiledRules(load(), version)
+                    self.reloads += 1
+                    self.last_error = None
+                except (OSError, ValueError) as e:
+                    self._failed_version = version
+                    self.last_error = f'{version}: {e}'
+                    logger.warning("Keeping the current eligibility rules, failed to load %s: %s", version, e)
+                    if self._compiled is None:
+                        self._compiled = CompiledRules(DEFAULT_RULES, version)
+            self._checked_at = time.monotonic()
+            return self._compiled
+
+    async def aget(self) -> CompiledRules:
+        compiled = self._compiled
+        if (compiled is not None and
+                time.monotonic() - self._checked_at < settings.ELIGIBILITY_RULES_CHECK_INTERVAL):
+            return compiled
+        return await sync_to_async(self.get)()
+
+    def invalidate(self):
+        self._checked_at = float('-inf')
+
+
+eligibility_rules = EligibilityRules()
+
+
+@receiver([post_save, post_delete], sender='credit.EligibilityRuleSet', dispatch_uid='credit.rules.invalidate')
+def invalidate_eligibility_rules(**kwargs):
+    # Other processes pick the change up at their next check
+    eligibility_rules.invalidate()
@@ -0,0 +1,46 @@
+import numpy as np
+
+from credit import finance
+
+# A schedule is a (tenure + 1, 3) float64 array: row m holds the principal and interest paid in month m and the
+# balance left after it. Row 0 is the opening balance, so row m is also "balance after m payments".
+SCHEDULE_COLUMNS = ('principal', 'interest', 'balance')
+SCHEDULE_DTYPE = np.dtype('<f8')
+ROW_BYTES = len(SCHEDULE_COLUMNS) * SCHEDULE_DTYPE.itemsize
+BALANCE_OFFSET = SCHEDULE_COLUMNS.index('balance') * SCHEDULE_DTYPE.itemsize
+
+
+def amortization_schedules(loan_amounts, interest_rates, tenures, monthly_repayments) -> list:
+    """Vectorized amortization schedules for aligned loan column arrays (interest rates are annual percentages)."""
+    tenures = np.asarray(tenures, dtype=np.int64)
+    if not len(tenures):
+        return []
+    table = finance.schedule(finance.monthly_rate(np.asarray(interest_rates, dtype=np.float64)), tenures.max(),
+                             monthly_repayments, loan_amounts)
+    return [table[index, :tenure + 1] for index, tenure in enumerate(tenures)]
+
+
+def pack_schedule(schedule) -> bytes:
+    return np.ascontiguousarray(schedule, dtype=SCHEDULE_DTYPE).tobytes()
+
+
+def unpack_schedule(data) -> np.ndarray:
+    return np.frombuffer(data, dtype=SCHEDULE_DTYPE).reshape(-1, len(SCHEDULE_COLUMNS))
+
+
+def schedule_months(data) -> int:
+    return len(data) // ROW_BYTES - 1
+
+
+def schedule_row(data, month) -> np.ndarray:
+    """One month of a packed schedule, read in place without decoding the rest."""
+    if not 0 <= month <= schedule_months(data):
+        raise IndexError(f'Month {month} is outside the schedule (0-{schedule_months(data)}).')
+    return np.frombuffer(data, dtype=SCHEDULE_DTYPE, count=len(SCHEDULE_COLUMNS), offset=month * ROW_BYTES)
+
+
+def balance_at(data, month) -> float:
+    """Balance left after `month` payments, read in place from a packed schedule."""
+    if not 0 <= month <= schedule_months(data):
+        raise IndexError(f'Month {month} is outside the schedule (0-{schedule_months(data)}).')
+    return float(np.frombuffer(data, dtype=SCHEDULE_DTYPE, count=1, offset=month * ROW_BYTES + BALANCE_OFFSET)[0])
@@ -1,5 +1,11 @@
+from django.conf import settings
+import numpy as np
+import pandas as pd
 from rest_framework import serializers
-from .models import Customer, Loan
+from .models import Customer, IngestRun, IngestShard, Loan, LoanSchedule
+from .payments import PAYMENT_COLUMNS, prepare_payments
+from .policy import DEFAULT_SCENARIO, current_policy, expand_grid
+from .schedules import SCHEDULE_COLUMNS, schedule_row, unpack_schedule
 
 
 class CustomerSerializer(serializers.ModelSerializer):
@@ -26,11 +32,94 @@ class RegisterSerializer(serializers.ModelSerializer):
         fields = ['first_name', 'last_name', 'age', 'monthly_income', 'phone_number']
 
 
+class RegisterBulkRequestSerializer(serializers.Serializer):
+    customers = RegisterSerializer(many=True, allow_empty=False)
+
+    def to_internal_value(self, data):
+        # Oversized requests are rejected before any record is validated
+        max_size = settings.REGISTER_BULK_MAX_SIZE
+        customers = data.get('customers') if isinstance(data, dict) else None
+        if isinstance(customers, list) and len(customers) > max_size:
+            raise serializers.ValidationError(
+                {'customers': [f'At most {max_size} customers are accepted per request.']})
+        return super().to_internal_value(data)
+
+
+# Annual interest rates, in percent, accepted on loan applications
+MAX_INTEREST_RATE = 100
+
+
 class CheckEligibilityRequestSerializer(serializers.Serializer):
     customer_id = serializers.IntegerField()
     loan_amount = serializers.FloatField()
-    interest_rate = serializers.FloatField()
-    tenure = serializers.IntegerField()
+    interest_rate = serializers.FloatField(min_value=0, max_value=MAX_INTEREST_RATE)
+    tenure = serializers.IntegerField(min_value=1)
+
+
+class CheckEligibilityBatchRequestSerializer(serializers.Serializer):
+    applications = serializers.ListField(allow_empty=False)
+
+    def validate_applications(self, value):
+        fields = list(CheckEligibilityRequestSerializer().fields)
+        max_size = settings.ELIGIBILITY_BATCH_MAX_SIZE
+        if len(value) > max_size:
+            raise serializers.ValidationError(f'At most {max_size} applications are accepted per batch.')
+        try:
+            rows = [[item[field] for field in fields] if isinstance(item, dict) else item for item in value]
+            applications = np.array(rows, dtype=np.float64)
+        except (KeyError, TypeError, ValueError):
+            raise serializers.ValidationError(
+                f'Each application must be an object or a list of {", ".join(fields)}.')
+        if applications.ndim != 2 or applications.shape[1] != len(fields):
+            raise serializers.ValidationError(f'Each application must have exactly {len(fields)} values.')
+        if not np.isfinite(applications).all():
+            raise serializers.ValidationError('Application values must be finite numbers.')
+        integral = applications[:, [fields.index('customer_id'), fields.index('tenure')]]
+        if (integral != np.round(integral)).any() or (applications[:, fields.index('tenure')] <= 0).any():
+            raise serializers.ValidationError('customer_id and tenure must be integers and tenure positive.')
+        interest_rates = applications[:, fields.index('interest_rate')]
+        if ((interest_rates < 0) | (interest_rates > MAX_INTEREST_RATE)).any():
+            raise serializers.ValidationError(f'interest_rate must be between 0 and {MAX_INTEREST_RATE}.')
+        return {field: applications[:, column] for column, field in enumerate(fields)}
+
+
+class LoanPageSerializer(serializers.Serializer):
+    cursor = serializers.IntegerField(min_value=0, default=0)
+    limit = serializers.IntegerField(min_value=1, required=False)
+
+    def validate_limit(self, value):
+        max_size = settings.VIEW_LOANS_PAGE_MAX_SIZE
+        if value > max_size:
+            raise serializers.ValidationError(f'At most {max_size} loans are returned per page.')
+        return value
+
+
+class LoanExportRequestSerializer(serializers.Serializer):
+    # Not "format", which DRF reserves for choosing a renderer
+    output = serializers.ChoiceField(choices=['csv', 'ndjson'], default='csv')
+    customer_id = serializers.IntegerField(required=False)
+    active = serializers.BooleanField(default=False)
+
+
+class PaymentsBulkRequestSerializer(serializers.Serializer):
+    payments = serializers.ListField(allow_empty=False)
+
+    def validate_payments(self, value):
+        max_size = settings.PAYMENTS_BULK_MAX_SIZE
+        if len(value) > max_size:
+            raise serializers.ValidationError(f'At most {max_size} payments are accepted per request.')
+        if all(isinstance(item, dict) for item in value):
+            frame = pd.DataFrame.from_records(value)
+        elif all(isinstance(item, list) and 3 <= len(item) <= len(PAYMENT_COLUMNS) for item in value):
+            frame = pd.DataFrame.from_records(value, columns=PAYMENT_COLUMNS[:max(len(item) for item in value)])
+        else:
+            raise serializers.ValidationError(
+                f'Each payment must be an object or a list of {", ".join(PAYMENT_COLUMNS)} '
+                f'(on_time and reference are optional).')
+        try:
+            return prepare_payments(frame)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
 
 
 class CheckEligibilityResponseSerializer(serializers.Serializer):
@@ -42,11 +131,65 @@ class CheckEligibilityResponseSerializer(serializers.Serializer):
     monthly_installment = serializers.FloatField()
 
 
+class PolicyBandSerializer(serializers.Serializer):
+    min_score = serializers.FloatField(min_value=0)
+    rate_floor = serializers.FloatField(min_value=0, allow_null=True, default=None)
+
+
+class PolicySerializer(serializers.Serializer):
+    name = serializers.CharField(required=False, max_length=100)
+    emi_to_income_cap = serializers.FloatField(min_value=0)
+    bands = PolicyBandSerializer(many=True, allow_empty=False)
+
+    def validate_bands(self, value):
+        scores = [band['min_score'] for band in value]
+        if len(set(scores)) != len(scores):
+            raise serializers.ValidationError('Band min_score values must be distinct.')
+        return value
+
+
+class PolicyScenarioSerializer(serializers.Serializer):
+    loan_to_limit = serializers.FloatField(min_value=0, default=DEFAULT_SCENARIO['loan_to_limit'])
+    interest_rate = serializers.FloatField(min_value=0, default=DEFAULT_SCENARIO['interest_rate'])
+    tenure = serializers.IntegerField(min_value=1, default=DEFAULT_SCENARIO['tenure'])
+
+
+class PolicyGridSerializer(serializers.Serializer):
+    emi_to_income_cap = serializers.ListField(child=serializers.FloatField(min_value=0), allow_empty=False,
+                                              required=False)
+    bands = serializers.ListField(child=PolicyBandSerializer(many=True, allow_empty=False), allow_empty=False,
+                                  required=False)
+
+
+class PolicySimulationRequestSerializer(serializers.Serializer):
+    policies = PolicySerializer(many=True, required=False, default=list)
+    # Expanded over the first policy, which it replaces, or over the current policy when none is given
+    grid = PolicyGridSerializer(required=False)
+    scenario = PolicyScenarioSerializer(required=False)
+    include_current = serializers.BooleanField(default=True)
+
+    def validate(self, attrs):
+        policies = list(attrs['policies'])
+        if 'grid' in attrs:
+            base = policies.pop(0) if policies else {**current_policy(), 'name': 'grid'}
+            policies += expand_grid(base, attrs['grid'])
+        if attrs['include_current']:
+            policies.insert(0, current_policy())
+        if not policies:
+            raise serializers.ValidationError('Give at least one policy or a grid.')
+        max_policies = settings.POLICY_SIMULATION_MAX_POLICIES
+        if len(policies) > max_policies:
+            raise serializers.ValidationError(f'At most {max_policies} policies can be compared per request.')
+        for index, policy in enumerate(policies):
+            policy.setdefault('name', f'policy {index}')
+        return {'policies': policies, 'scenario': attrs.get('scenario', {})}
+
+
 class CreateLoanRequestSerializer(serializers.Serializer):
     customer_id = serializers.IntegerField()
     loan_amount = serializers.FloatField()
-    interest_rate = serializers.FloatField()
-    tenure = serializers.IntegerField()
+    interest_rate = serializers.FloatField(min_value=0, max_value=MAX_INTEREST_RATE)
+    tenure = serializers.IntegerField(min_value=1)
 
 
 class CreateLoanResponseSerializer(serializers.Serializer):
@@ -82,3 +225,47 @@ class LoanDetailSerializer(serializers.ModelSerializer):
 
     def get_repayments_left(self, obj: Loan):
         return obj.tenure - obj.emis_paid_on_time
+
+
+class LoanScheduleSerializer(serializers.ModelSerializer):
+    monthly_installment = serializers.FloatField(source='monthly_repayment')
+    repayments_left = serializers.SerializerMethodField()
+    remaining_balance = serializers.SerializerMethodField()
+    schedule = serializers.SerializerMethodField()
+
+    class Meta:
+        model = LoanSchedule
+        fields = ['loan_id', 'loan_amount', 'interest_rate', 'tenure', 'monthly_installment', 'repayments_left',
+                  'remaining_balance', 'schedule']
+
+    def get_repayments_left(self, obj: LoanSchedule):
+        return obj.tenure - self.context['emis_paid_on_time']
+
+    def get_remaining_balance(self, obj: LoanSchedule):
+        return round(obj.remaining_balance(self.context['emis_paid_on_time']), 2)
+
+    def get_schedule(self, obj: LoanSchedule):
+        # A single requested month is read in place; otherwise every month after the opening row is returned
+        month = self.context.get('month')
+        if month is not None:
+            rows, months = schedule_row(obj.payments, month)[None, :], [month]
+        else:
+            rows, months = unpack_schedule(obj.payments)[1:], range(1, obj.tenure + 1)
+        return [{'month': month, **dict(zip(SCHEDULE_COLUMNS, row))}
+                for month, row in zip(months, rows.round(2).tolist())]
+
+
+class IngestShardSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = IngestShard
+        fields = ['table_name', 'shard_index', 'state', 'rows_read', 'rows_written', 'duplicates', 'skipped', 'error',
+                  'started_at', 'finished_at']
+
+
+class IngestRunSerializer(serializers.ModelSerializer):
+    run_id = serializers.IntegerField(source='pk')
+    shards = IngestShardSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = IngestRun
+        fields = ['run_id', 'status', 'error', 'shard_count', 'created_at', 'finished_at', 'shards']
@@ -0,0 +1,194 @@
+import datetime
+import json
+import os
+import shutil
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from credit.models import Customer, Loan
+from credit.utils import calculate_remaining_loan_balances, credit_scores_from_arrays, iter_chunks
+
+SNAPSHOT_MODELS = {
+    'credit_customer': Customer,
+    'credit_loan': Loan,
+}
+# Both tables are bucketed on the customer, so a customer and all of their loans always share a bucket
+BUCKET_COLUMNS = {
+    'credit_customer': 'customer_id',
+    'credit_loan': 'customer_id',
+}
+MANIFEST_NAME = '_manifest.json'
+LATEST_NAME = 'LATEST'
+
+
+def arrow_type(field):
+    if isinstance(field, (models.AutoField, models.IntegerField, models.ForeignKey)):
+        return pa.int64()
+    if isinstance(field, models.FloatField):
+        return pa.float64()
+    if isinstance(field, models.DateField):
+        return pa.date32()
+    return pa.string()
+
+
+def arrow_schema(model):
+    return pa.schema([pa.field(field.column, arrow_type(field), nullable=field.null)
+                      for field in model._meta.concrete_fields])
+
+
+def _write_table(table_name, directory, buckets, chunk_size):
+    model = SNAPSHOT_MODELS[table_name]
+    schema = arrow_schema(model)
+    bucket_column = schema.get_field_index(BUCKET_COLUMNS[table_name])
+    writers = {}
+    rows = 0
+    # iterator() streams through a server-side cursor on PostgreSQL, so the table is never held in memory
+    queryset = model.objects.order_by().values_list(*schema.names).iterator(chunk_size=chunk_size)
+    try:
+        for chunk in iter_chunks(queryset, chunk_size):
+            batch = pa.RecordBatch.from_arrays([pa.array(column, type=schema.field(index).type)
+                                                for index, column in enumerate(zip(*chunk))], schema=schema)
+            keys = batch.column(bucket_column).to_numpy() % buckets
+            for bucket in np.unique(keys):
+                if bucket not in writers:
+                    path = os.path.join(directory, table_name, f'bucket={bucket:03d}', 'part-0.parquet')
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    writers[bucket] = pq.ParquetWriter(path, schema, compression='zstd')
+                writers[bucket].write_batch(batch.filter(pa.array(keys == bucket)))
+            rows += len(chunk)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return {'rows': rows, 'columns': schema.names, 'buckets': sorted(int(bucket) for bucket in writers)}
+
+
+def export_snapshot(directory=None, buckets=None, chunk_size=None, keep=None):
+    """Export customers and loans to a bucketed Parquet snapshot and mark it as the latest.
+
+    Both tables are read inside one read-only REPEATABLE READ transaction on PostgreSQL, so the snapshot is
+    consistent across them. Returns the snapshot manifest.
+    """
+    directory = directory or settings.SNAPSHOT_DIR
+    buckets = buckets or settings.SNAPSHOT_BUCKETS
+    chunk_size = chunk_size or settings.SNAPSHOT_CHUNK_SIZE
+    keep = keep or settings.SNAPSHOT_KEEP
+    created_at = timezone.now()
+    snapshot_id = created_at.strftime('%Y%m%dT%H%M%S%fZ')
+    path = os.path.join(directory, snapshot_id)
+    os.makedirs(path)
+
+    # The isolation level can only be set by the statement that opens the transaction; nested in a caller's
+    # transaction the export shares that transaction's view instead
+    consistent_read = connection.vendor == 'postgresql' and not connection.in_atomic_block
+    try:
+        with transaction.atomic():
+            if consistent_read:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+            tables = {table_name: _write_table(table_name, path, buckets, chunk_size)
+                      for table_name in SNAPSHOT_MODELS}
+    except Exception:
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+
+    manifest = {
+        'snapshot_id': snapshot_id,
+        'created_at': created_at.isoformat(),
+        'bucket_count': buckets,
+        'tables': tables,
+    }
+    with open(os.path.join(path, MANIFEST_NAME), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    # Readers only ever see complete snapshots: the pointer moves once everything is on disk
+    latest = os.path.join(directory, LATEST_NAME)
+    with open(latest + '.tmp', 'w') as file:
+        file.write(snapshot_id)
+    os.replace(latest + '.tmp', latest)
+
+    snapshot_ids = sorted(name for name in os.listdir(directory)
+                          if os.path.isfile(os.path.join(directory, name, MANIFEST_NAME)))
+    for old in snapshot_ids[:-keep]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    return manifest
+
+
+def latest_snapshot_path(directory=None):
+    directory = directory or settings.SNAPSHOT_DIR
+    try:
+        with open(os.path.join(directory, LATEST_NAME)) as file:
+            return os.path.join(directory, file.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+class SnapshotReader:
+    """Reads a Parquet snapshot through memory-mapped files, one bucket at a time.
+
+    Columns come back as NumPy arrays; non-null numeric columns stored as a single chunk are handed over
+    without copying.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or latest_snapshot_path()
+        if self.path is None:
+            raise FileNotFoundError(f'No snapshot found in {settings.SNAPSHOT_DIR}; run export_snapshot first.')
+        with open(os.path.join(self.path, MANIFEST_NAME)) as file:
+            self.manifest = json.load(file)
+
+    @property
+    def buckets(self):
+        return range(self.manifest['bucket_count'])
+
+    def read(self, table_name, bucket, columns=None) -> pa.Table:
+        path = os.path.join(self.path, table_name, f'bucket={bucket:03d}', 'part-0.parquet')
+        if not os.path.exists(path):
+            schema = arrow_schema(SNAPSHOT_MODELS[table_name])
+            return schema.empty_table().select(columns or schema.names)
+        return pq.read_table(path, columns=columns, memory_map=True)
+
+    def columns(self, table_name, bucket, columns) -> dict:
+        table = self.read(table_name, bucket, columns)
+        return {name: table.column(name).to_numpy() for name in columns}
+
+    def iter_customer_stats(self, today=None):
+        """Per-bucket recompute of every cached customer column, without touching the database.
+
+        Yields (customer_ids, {'current_debt', 'credit_score', 'active_emi_total'}) with the same figures as
+        recompute_all_customers.
+        """
+        today = np.datetime64(today or datetime.date.today(), 'D')
+        current_year = today.astype('datetime64[Y]')
+        for bucket in self.buckets:
+            customer_ids = np.sort(self.columns('credit_customer', bucket, ['customer_id'])['customer_id'])
+            loans = self.columns('credit_loan', bucket, ['customer_id', 'loan_amount', 'tenure', 'interest_rate',
+                                                         'monthly_repayment', 'emis_paid_on_time', 'start_date',
+                                                         'end_date'])
+            if not len(customer_ids):
+                continue
+            owner = np.searchsorted(customer_ids, loans['customer_id'])
+            size = len(customer_ids)
+
+            def per_customer(weights=None, where=None):
+                index = owner if where is None else owner[where]
+                if weights is not None and where is not None:
+                    weights = weights[where]
+                return np.bincount(index, weights=weights, minlength=size).astype(np.float64)
+
+            active = loans['end_date'] >= today
+            balances = calculate_remaining_loan_balances(
+                interest_rates=loans['interest_rate'][active], tenures=loans['tenure'][active],
+                emis_paid_on_time=loans['emis_paid_on_time'][active],
+                monthly_repayments=loans['monthly_repayment'][active], loan_amounts=loans['loan_amount'][active])
+            current_debts = np.bincount(owner[active], weights=balances, minlength=size)
+            credit_scores = credit_scores_from_arrays(
+                past_loans=per_customer(), emis_paid_on_time=per_customer(loans['emis_paid_on_time'].astype(np.float64)),
+                emis_tenure=per_customer(loans['tenure'].astype(np.float64)),
+                current_year_loans=per_customer(where=loans['start_date'].astype('datetime64[Y]') == current_year))
+            active_emi_totals = per_customer(loans['monthly_repayment'], where=loans['end_date'] > today)
+            yield customer_ids, {'current_debt': current_debts, 'credit_score': credit_scores,
+                                 'active_emi_total': active_emi_totals}
@@ -1,99 +1,410 @@
 import os.path
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from celery import shared_task
-import pandas as pd
+from celery import chain, chord, group, shared_task
+import numpy as np
 from django.conf import settings
-from django.db import connection
-from sqlalchemy import create_engine
+from django.db import connection, transaction
+from django.db.models import F, Min, Q, Sum
+from django.db.models.functions import Greatest, Mod
+from django.utils import timezone
 
-from CreditNest.settings import env
-from credit.models import Loan, Customer
-from credit.utils import calculate_remaining_loan_balance
+from credit.cache import customer_summaries
+from credit.ingestion import ingest_file, reset_sequence, shard_count_for, shardable_copy
+from credit.models import (Customer, DebtLedgerEntry, DirtyCustomer, IngestRun, IngestShard, Loan, LoanSchedule,
+                           RecomputeRun)
+from credit.payments import load_payments_file
+from credit.portfolio import refresh_snapshot
+from credit.schedules import amortization_schedules, pack_schedule
+from credit.snapshots import SnapshotReader, export_snapshot
+from credit.utils import (calculate_remaining_loan_balances, credit_scores_from_arrays, iter_chunks,
+                          loan_stats_aggregates)
 
 
-def load_data(file_path, table_name, engine):
-    try:
-        data = pd.read_excel(file_path)
-        data.columns = [col.lower().replace(' ', '_') for col in data.columns]
-
-        if table_name == 'credit_loan':
-            rename_columns = {
-                "monthly_payment": "monthly_repayment",
-                "date_of_approval": "start_date"
-            }
-            data.rename(columns=rename_columns, inplace=True)
-
-            # Initializing a set to keep track of unique loan_ids
-            unique_loan_ids = set()
-            rows_to_drop = []
-
-            # Iterate over the DataFrame
-            for index, row in data.iterrows():
-                loan_id = row['loan_id']
-                # If the loan_id is already in the set, mark this row for deletion
-                if loan_id in unique_loan_ids:
-                    rows_to_drop.append(index)
-                else:
-                    # Otherwise, add the loan_id to the set
-                    unique_loan_ids.add(loan_id)
-
-            # Drop the rows with duplicate loan_ids
-            data.drop(rows_to_drop, inplace=True)
-
-        # Ingest data into the PostgreSQL database
-        data.to_sql(table_name, engine, if_exists='append', index=False)
-
-        reset_seq_sql = f"""
-                SELECT setval(pg_get_serial_sequence('{table_name}', '{table_name.split("_")[-1]}_id'), 
-                COALESCE(MAX({table_name.split("_")[-1]}_id), 0) + 1) FROM {table_name};
-                """
-
-        # Execute the SQL command to reset the sequence
+INGEST_MODELS = {
+    'credit_customer': Customer,
+    'credit_loan': Loan,
+}
+
+
+def write_customer_columns(customer_ids, **columns):
+    """Write per-customer values back in one statement per call."""
+    if not len(customer_ids):
+        return 0
+
+    if connection.vendor == 'postgresql':
+        assignments = ', '.join(f'{name} = v.{name}' for name in columns)
+        unnests = ', '.join(f'unnest(%s::float8[]) AS {name}' for name in columns)
         with connection.cursor() as cursor:
-            cursor.execute(reset_seq_sql)
+            cursor.execute(
+                f"""
+                UPDATE credit_customer AS c SET {assignments}
+                FROM (SELECT unnest(%s::int[]) AS customer_id, {unnests}) AS v
+                WHERE c.customer_id = v.customer_id
+                """,
+                [list(map(int, customer_ids))] + [list(map(float, values)) for values in columns.values()],
+            )
+        return len(customer_ids)
+
+    customers = [Customer(customer_id=int(customer_id), **{name: float(values[index])
+                                                            for name, values in columns.items()})
+                 for index, customer_id in enumerate(customer_ids)]
+    Customer.objects.bulk_update(customers, list(columns), batch_size=1000)
+    return len(customers)
+
+
+def recompute_locked_customers(customer_ids, today=None) -> int:
+    """Recompute and write the cached columns of the given customers under their row locks.
+
+    Rows are locked in customer_id order before the loans are read, as loan origination locks them, so a concurrent
+    origination is never overwritten. Changed debt and EMI totals are recorded as ledger adjustments. Runs in the
+    caller's transaction and returns the number of adjustments.
+    """
+    current = {customer_id: (debt or 0, emi) for customer_id, debt, emi in
+               Customer.objects.select_for_update().filter(customer_id__in=list(customer_ids))
+               .order_by('customer_id').values_list('customer_id', 'current_debt', 'active_emi_total')}
+    ids, columns = recompute_customers(list(current), today=today)
+    write_customer_columns(ids, **columns)
+    entries = []
+    for customer_id, debt, emi in zip(ids.tolist(), columns['current_debt'].tolist(),
+                                      columns['active_emi_total'].tolist()):
+        old_debt, old_emi = current[customer_id]
+        if abs(debt - old_debt) > 1e-6 or abs(emi - old_emi) > 1e-6:
+            entries.append(DebtLedgerEntry(customer_id=customer_id, kind=DebtLedgerEntry.KIND_ADJUSTMENT,
+                                           debt_delta=debt - old_debt, emi_delta=emi - old_emi,
+                                           debt_after=debt, emi_after=emi))
+    DebtLedgerEntry.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+def recompute_all_customers(chunk_size=None, today=None) -> int:
+    """Recompute the cached debt, credit score and active EMI total of every customer.
+
+    Customers are walked in keyset chunks, each recomputed in its own transaction by recompute_locked_customers.
+    """
+    chunk_size = chunk_size or settings.DEBT_RECOMPUTE_CHUNK_SIZE
+    today = today or datetime.today().date()
+    customers = Customer.objects.order_by('customer_id').values_list('customer_id', flat=True)
+    updated = 0
+    last_customer_id = 0
+
+    while customer_ids := list(customers.filter(customer_id__gt=last_customer_id)[:chunk_size]):
+        with transaction.atomic():
+            recompute_locked_customers(customer_ids, today)
+        updated += len(customer_ids)
+        last_customer_id = customer_ids[-1]
+
+    return updated
+
+
+def refresh_loan_schedules(loan_ids=None, chunk_size=None):
+    """Build the amortization schedules of loans that have none or whose terms changed since they were built."""
+    chunk_size = chunk_size or settings.SCHEDULE_CHUNK_SIZE
+    loans = Loan.objects.all() if loan_ids is None else Loan.objects.filter(loan_id__in=loan_ids)
+    stale = Q(schedule__isnull=True)
+    for field in LoanSchedule.TERM_FIELDS:
+        stale |= ~Q(**{f'schedule__{field}': F(field)})
+    loans = loans.filter(stale).order_by('loan_id').values_list('loan_id', *LoanSchedule.TERM_FIELDS)
+    updated = 0
+    last_loan_id = 0
+
+    # Keyset batches rather than one long cursor, since each batch writes to the table the filter joins
+    while batch := list(loans.filter(loan_id__gt=last_loan_id)[:chunk_size]):
+        terms = np.array(batch, dtype=np.float64)
+        schedules = amortization_schedules(loan_amounts=terms[:, 1], interest_rates=terms[:, 2], tenures=terms[:, 3],
+                                           monthly_repayments=terms[:, 4])
+        LoanSchedule.objects.bulk_create(
+            [LoanSchedule(loan_id=row[0], payments=pack_schedule(schedule),
+                          **dict(zip(LoanSchedule.TERM_FIELDS, row[1:])))
+             for row, schedule in zip(batch, schedules)],
+            update_conflicts=True, unique_fields=['loan'], update_fields=[*LoanSchedule.TERM_FIELDS, 'payments'],
+        )
+        updated += len(batch)
+        last_loan_id = batch[-1][0]
+
+    return updated
+
+
+def recompute_customers_from_snapshot(path=None, chunk_size=None, today=None) -> int:
+    """recompute_all_customers for the customers a Parquet snapshot shows to be stale.
+
+    The snapshot figures only pick out customers whose cached columns differ from what their loans give. Those are
+    recomputed from the loan table by recompute_locked_customers, so a loan booked after the export is never
+    overwritten with the snapshot's totals. Returns the number of customers recomputed.
+    """
+    chunk_size = chunk_size or settings.DEBT_RECOMPUTE_CHUNK_SIZE
+    today = today or datetime.today().date()
+    reader = SnapshotReader(path)
+    updated = 0
+    for customer_ids, columns in reader.iter_customer_stats(today):
+        index = {customer_id: position for position, customer_id in enumerate(customer_ids.tolist())}
+        stale = []
+        for ids in iter_chunks(index, chunk_size):
+            for customer_id, *stored in Customer.objects.filter(customer_id__in=ids).values_list('customer_id',
+                                                                                                  *columns):
+                if any(value is None or abs(value - columns[name][index[customer_id]]) > 1e-6
+                       for name, value in zip(columns, stored)):
+                    stale.append(customer_id)
+        for ids in iter_chunks(stale, chunk_size):
+            with transaction.atomic():
+                recompute_locked_customers(ids, today)
+            updated += len(ids)
+    return updated
+
+
+def recompute_customers(customer_ids, today=None) -> tuple:
+    """Current debt, credit score and active EMI total of the given customers, computed from their loans.
+
+    Returns the sorted ids and aligned current_debt, credit_score and active_emi_total arrays.
+    """
+    today = today or datetime.today().date()
+    ids = np.unique(np.asarray(customer_ids, dtype=np.int64))
+    aggregates = loan_stats_aggregates(current_year=today.year, today=today)
+    stats = {name: np.zeros(len(ids)) for name in aggregates}
+    rows = np.array(list(Loan.objects.filter(customer_id__in=ids.tolist()).values('customer_id')
+                         .annotate(**aggregates).values_list('customer_id', *aggregates)),
+                    dtype=np.float64).reshape(-1, len(aggregates) + 1)
+    positions = np.searchsorted(ids, rows[:, 0].astype(np.int64))
+    for column, name in enumerate(aggregates, start=1):
+        stats[name][positions] = rows[:, column]
+
+    loans = np.array(list(Loan.objects.filter(customer_id__in=ids.tolist(), end_date__gte=today)
+                          .values_list('customer_id', 'interest_rate', 'tenure', 'emis_paid_on_time',
+                                       'monthly_repayment', 'loan_amount')),
+                     dtype=np.float64).reshape(-1, 6)
+    balances = calculate_remaining_loan_balances(interest_rates=loans[:, 1], tenures=loans[:, 2],
+                                                 emis_paid_on_time=loans[:, 3], monthly_repayments=loans[:, 4],
+                                                 loan_amounts=loans[:, 5])
+    debts = np.bincount(np.searchsorted(ids, loans[:, 0].astype(np.int64)), weights=balances, minlength=len(ids))
+
+    return ids, {
+        'current_debt': debts,
+        'credit_score': credit_scores_from_arrays(stats['past_loans'], stats['emis_paid_on_time'],
+                                                  stats['emis_tenure'], stats['current_year_loans']),
+        'active_emi_total': stats['active_emi_total'],
+    }
+
+
+def mark_matured_customers(since, today):
+    """Mark customers dirty whose loans ended after `since` (any time, when None) and up to `today`."""
+    # Debts count loans up to their end date and EMI totals only before it, so the day before `since` is rechecked
+    loans = Loan.objects.filter(end_date__lte=today)
+    if since is not None:
+        loans = loans.filter(end_date__gte=since - timedelta(days=1))
+    marked = 0
+    for customer_ids in iter_chunks(loans.order_by().values_list('customer_id', flat=True).distinct().iterator(),
+                                    5000):
+        DirtyCustomer.mark(customer_ids, DirtyCustomer.REASON_MATURITY)
+        marked += len(customer_ids)
+    return marked
+
+
+def start_recompute_run(shard_count=None, today=None):
+    today = today or datetime.today().date()
+    since = (RecomputeRun.objects.filter(status=RecomputeRun.STATUS_COMPLETED).order_by('-as_of')
+             .values_list('as_of', flat=True).first())
+    matured = mark_matured_customers(since, today)
+    return RecomputeRun.objects.create(shard_count=shard_count or settings.DIRTY_RECOMPUTE_SHARDS, as_of=today,
+                                       cutoff=timezone.now(), matured=matured)
+
+
+def process_dirty_shard(run, shard_index, chunk_size=None):
+    """Recompute the customers of one customer_id % shard_count shard that were dirty at the run's cutoff.
+
+    Each chunk is recomputed by recompute_locked_customers, and the chunk's dirty rows are removed in the same
+    transaction.
+    """
+    chunk_size = chunk_size or settings.DIRTY_RECOMPUTE_CHUNK_SIZE
+    dirty = (DirtyCustomer.objects.alias(shard=Mod('customer_id', run.shard_count))
+             .filter(shard=shard_index, marked_at__lte=run.cutoff))
+    processed = adjustments = 0
+    lag_seconds_total = max_lag_seconds = 0.0
+
+    while True:
+        with transaction.atomic():
+            claimed = list(dirty.order_by('customer_id').values_list('customer_id', 'marked_at')[:chunk_size])
+            if not claimed:
+                break
+            claimed_ids = [customer_id for customer_id, _ in claimed]
+            DirtyCustomer.objects.filter(customer_id__in=claimed_ids, marked_at__lte=run.cutoff).delete()
+            chunk_adjustments = recompute_locked_customers(claimed_ids, today=run.as_of)
 
-        return f"Data from {file_path} successfully loaded into {table_name} table."
+        now = timezone.now()
+        lags = [(now - marked_at).total_seconds() for _, marked_at in claimed]
+        processed += len(claimed)
+        adjustments += chunk_adjustments
+        lag_seconds_total += sum(lags)
+        max_lag_seconds = max(max_lag_seconds, *lags)
+
+    RecomputeRun.objects.filter(pk=run.pk).update(
+        customers=F('customers') + processed, adjustments=F('adjustments') + adjustments,
+        lag_seconds_total=F('lag_seconds_total') + lag_seconds_total,
+        max_lag_seconds=Greatest('max_lag_seconds', max_lag_seconds))
+    return processed
+
+
+def finish_recompute_run(run):
+    run.backlog = DirtyCustomer.objects.count()
+    run.status = RecomputeRun.STATUS_COMPLETED
+    run.finished_at = timezone.now()
+    run.save(update_fields=['backlog', 'status', 'finished_at'])
+    customer_summaries.invalidate_all()
+    return run
+
+
+def recompute_report(run):
+    oldest = DirtyCustomer.objects.aggregate(oldest=Min('marked_at'))['oldest']
+    backlog_lag = (run.finished_at - oldest).total_seconds() if oldest else 0
+    return (f"Recompute run {run.pk}: {run.customers} dirty customers ({run.matured} marked for matured loans) "
+            f"across {run.shard_count} shards in {run.seconds:.2f}s, {run.customers_per_second or 0:.0f} "
+            f"customers/s, {run.adjustments} ledger adjustments. Lag mean {run.mean_lag_seconds or 0:.1f}s, "
+            f"max {run.max_lag_seconds:.1f}s. {run.backlog} customers left for the next run (oldest "
+            f"{backlog_lag:.1f}s).")
+
+
+@shared_task
+def recompute_dirty_shard(run_id, shard_index):
+    run = RecomputeRun.objects.get(pk=run_id)
+    try:
+        return process_dirty_shard(run, shard_index)
     except Exception as e:
-        return f"An error occurred: {e}"
+        RecomputeRun.objects.filter(pk=run_id).update(status=RecomputeRun.STATUS_FAILED, finished_at=timezone.now())
+        print(f"An error occurred: {e}")
+        raise
 
 
-def update_customer_debts():
-    # Iterate over all customers
-    for customer in Customer.objects.all():
-        # Fetch loans for the customer that are still active
-        active_loans = Loan.objects.filter(customer=customer, end_date__gte=datetime.today().date())
+@shared_task
+def finalize_recompute(run_id):
+    run = finish_recompute_run(RecomputeRun.objects.get(pk=run_id))
+    print(recompute_report(run))
 
-        # Calculate total debt from all active loans
-        total_debt = sum(calculate_remaining_loan_balance(loan) for loan in active_loans)
 
-        # Update the current debt field of the customer
-        customer.current_debt = total_debt
-        customer.save()
+@shared_task
+def recompute_dirty_customers(shard_count=None):
+    run = start_recompute_run(shard_count)
+    # Shards are disjoint customer_id residues, so workers never contend for the same customer rows
+    chord(group(recompute_dirty_shard.si(run.pk, shard_index) for shard_index in range(run.shard_count)),
+          finalize_recompute.si(run.pk)).delay()
+    return run.pk
 
 
 @shared_task
-def ingest_data():
-    db_name = env.str('DB_NAME')
-    db_user = env.str('DB_USER')
-    db_pass = env.str('DB_PASSWORD')
-    db_host = env.str('DB_HOST')
-    db_port = env.str('DB_PORT')
+def export_snapshot_task(recompute=False):
+    manifest = export_snapshot()
+    tables = ', '.join(f"{table['rows']} {name}" for name, table in manifest['tables'].items())
+    print(f"Exported snapshot {manifest['snapshot_id']}: {tables}")
+    if recompute:
+        updated = recompute_customers_from_snapshot()
+        print(f"Recomputed debts and credit scores for {updated} customers the snapshot showed stale")
+        customer_summaries.invalidate_all()
+    return manifest['snapshot_id']
 
-    conn_str = f'postgresql://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}'
-    engine = create_engine(conn_str)
 
-    # File paths for the Excel files
-    customer_data_file = os.path.join(settings.STATIC_DIR, 'customer_data.xlsx')
-    loan_data_file = os.path.join(settings.STATIC_DIR, 'loan_data.xlsx')
+@shared_task
+def refresh_portfolio_snapshot():
+    summary = refresh_snapshot()
+    print(f"Refreshed portfolio snapshot: {summary['customers']} customers, {summary['active_loans']} active loans")
+    return summary['generated_at']
+
 
-    load_customer_data_result = load_data(customer_data_file, 'credit_customer', engine)
-    print(load_customer_data_result)
-    load_loan_data_result = load_data(loan_data_file, 'credit_loan', engine)
-    print(load_loan_data_result)
+@shared_task
+def ingest_shard(run_id, table_name, file_path, shard_index, shard_count):
+    model = INGEST_MODELS[table_name]
+    shard = IngestShard.objects.filter(run_id=run_id, table_name=table_name, shard_index=shard_index)
+    shard.update(state=IngestShard.STATE_RUNNING, started_at=timezone.now())
 
     try:
-        update_customer_debts()
-        print("Updated Debts")
+        stats = ingest_file(file_path, model, shard_index=shard_index, shard_count=shard_count)
     except Exception as e:
-        print(e)
+        shard.update(state=IngestShard.STATE_FAILED, error=str(e), finished_at=timezone.now())
+        IngestRun.objects.filter(pk=run_id).update(status=IngestRun.STATUS_FAILED, finished_at=timezone.now())
+        print(f"An error occurred: {e}")
+        raise
+
+    shard.update(state=IngestShard.STATE_COMPLETED, rows_read=stats['rows_read'], rows_written=stats['rows_written'],
+                 duplicates=stats['duplicates'], skipped=stats['skipped'], finished_at=timezone.now())
+    if stats['skipped']:
+        print(f"Data from {file_path} shard {shard_index}/{shard_count} was already loaded into {table_name} table, "
+              f"skipping.")
+    else:
+        resumed = f" (resumed after chunk {stats['resumed_from_chunk']})" if stats['resumed_from_chunk'] else ""
+        print(f"Data from {file_path} shard {shard_index}/{shard_count} successfully loaded into {table_name} "
+              f"table{resumed}: {stats['rows_written']} of {stats['rows_read']} rows new or changed, "
+              f"{stats['duplicates']} duplicates skipped, {stats['rows_per_second']:.0f} rows/sec.")
+    return stats['rows_written']
+
+
+@shared_task
+def ingest_payments(file_path, chunk_size=None):
+    stats = load_payments_file(file_path, chunk_size)
+    print(f"Payments from {file_path}: {stats['recorded']} of {stats['received']} events recorded, "
+          f"{stats['duplicates']} duplicates and {stats['unknown_loans']} for unknown loans skipped, "
+          f"{stats['loans_updated']} loans updated, {stats['events_per_second']:.0f} events/sec.")
+    return stats['recorded']
+
+
+@shared_task
+def finalize_ingest(run_id):
+    # Execute the SQL command to reset the sequences
+    for model in INGEST_MODELS.values():
+        reset_sequence(model)
+
+    written = IngestShard.objects.filter(run_id=run_id).aggregate(total=Sum('rows_written'))['total']
+    if not written:
+        print("No new or changed rows, skipping recompute")
+    else:
+        try:
+            updated = recompute_all_customers()
+            print(f"Updated Debts and Credit Scores for {updated} customers")
+            updated = refresh_loan_schedules()
+            print(f"Built amortization schedules for {updated} loans")
+        except Exception as e:
+            IngestRun.objects.filter(pk=run_id).update(status=IngestRun.STATUS_FAILED, error=str(e),
+                                                       finished_at=timezone.now())
+            print(f"An error occurred: {e}")
+            raise
+
+        customer_summaries.invalidate_all()
+        if settings.PORTFOLIO_SNAPSHOT_ENABLED:
+            refresh_portfolio_snapshot.delay()
+
+    IngestRun.objects.filter(pk=run_id).update(status=IngestRun.STATUS_COMPLETED, finished_at=timezone.now())
+
+
+@shared_task
+def ingest_data(run_id=None, files=None):
+    """Load a customer and a loan file, given by table name in `files` (the bundled Excel files by default)."""
+    run = IngestRun.objects.get(pk=run_id) if run_id else IngestRun.objects.create(shard_count=settings.INGEST_SHARDS)
+
+    files = files or {
+        'credit_customer': os.path.join(settings.STATIC_DIR, 'customer_data.xlsx'),
+        'credit_loan': os.path.join(settings.STATIC_DIR, 'loan_data.xlsx'),
+    }
+    try:
+        # Excel sheets can only be streamed from the top, so workbooks are converted once to CSV, which every
+        # shard can seek into for its own row range
+        files = {table_name: shardable_copy(file_path) for table_name, file_path in files.items()}
+    except Exception as e:
+        IngestRun.objects.filter(pk=run.pk).update(status=IngestRun.STATUS_FAILED, error=str(e),
+                                                   finished_at=timezone.now())
+        print(f"An error occurred: {e}")
+        raise
+
+    shard_counts = {table_name: shard_count_for(file_path, run.shard_count) for table_name, file_path in files.items()}
+
+    IngestShard.objects.bulk_create([
+        IngestShard(run=run, table_name=table_name, file_path=file_path, shard_index=shard_index)
+        for table_name, file_path in files.items() for shard_index in range(shard_counts[table_name])
+    ], ignore_conflicts=True)
+    shards = {
+        table_name: [ingest_shard.si(run.pk, table_name, file_path, shard_index, shard_counts[table_name])
+                     for shard_index in range(shard_counts[table_name])]
+        for table_name, file_path in files.items()
+    }
+
+    # Loans reference customers, so loan shards only start once every customer shard has committed; the chord
+    # body then resets sequences and recomputes debts exactly once
+    workflow = chain(group(shards['credit_customer']),
+                     chord(shards['credit_loan'], finalize_ingest.si(run.pk)))
+    workflow.delay()
+    return run.pk
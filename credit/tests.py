@@ -1,3 +1,643 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import numpy_financial as npf
+import pandas as pd
+from django.conf import settings
+from django.db import connections
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.urls import URLPattern, get_resolver, resolve
+
+from CreditNest.celery import app as celery_app
+from credit import finance
+from credit.bench import REQUEST_MIX, generate_request_log, legacy_check_eligibility, seed_dataset
+from credit.cache import customer_summaries
+from credit.db import IdAllocator
+from credit.ingestion import BulkInsertLoader, ingest_file, iter_file_chunks, reset_sequence
+from credit.listings import EXPORT_COLUMNS
+from credit.models import (Customer, DebtLedgerEntry, DirtyCustomer, EligibilityRuleSet, IngestionFile, IngestRun,
+                           IngestShard, Loan, LoanSchedule)
+from credit.origination import originate_loan
+from credit.payments import load_payments_file
+from credit.portfolio import compute_portfolio_summary
+from credit.rules import DEFAULT_RULES, EligibilityRules, eligibility_rules
+from credit.snapshots import export_snapshot
+from credit.tasks import (finalize_ingest, ingest_data, recompute_all_customers,
+                          recompute_customers_from_snapshot)
+from credit.utils import check_eligibility_bulk
+from credit.views import CheckEligibilityBatchView
+
+
+def npf_balance(rate, nper, payment, principal):
+    return -npf.fv(rate, nper, -payment, principal)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class CheckEligibilityViewTests(TestCase):
+    def test_unknown_customer_is_not_found(self):
+        response = self.client.post('/check-eligibility/', {'customer_id': 1, 'loan_amount': 100000,
+                                                            'interest_rate': 12, 'tenure': 12},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), {'error': 'Customer not found.'})
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class CheckEligibilityBatchTests(TestCase):
+    def test_batch_matches_single_checks(self):
+        # Summaries cached here would outlive the rolled-back customers
+        customer_summaries.invalidate_all()
+        self.addCleanup(customer_summaries.invalidate_all)
+        customers = seed_dataset(30, 4)
+        rng = random.Random(0)
+        applications = [{'customer_id': rng.choice(customers).customer_id,
+                         'loan_amount': rng.randrange(10000, 500000, 1000),
+                         'interest_rate': round(rng.uniform(6, 20), 2),
+                         'tenure': rng.choice([6, 12, 24, 36])} for _ in range(200)]
+        # Blocks smaller than the batch, so results are checked and sent across several of them
+        with mock.patch.object(CheckEligibilityBatchView, 'stream_block_size', 64):
+            response = self.client.post('/check-eligibility/batch/', {'applications': applications},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            blocks = list(response.streaming_content)
+        self.assertEqual([len(block.splitlines()) for block in blocks], [64, 64, 64, 8])
+        batch = [json.loads(line) for line in b''.join(blocks).splitlines()]
+        self.assertEqual(len(batch), len(applications))
+        for application, result in zip(applications, batch):
+            with self.subTest(application=application):
+                single = self.client.post('/check-eligibility/', application, content_type='application/json').json()
+                self.assertEqual(result['approval'], single['approval'])
+                self.assertAlmostEqual(result['corrected_interest_rate'], single['corrected_interest_rate'])
+                self.assertAlmostEqual(result['monthly_installment'], single['monthly_installment'])
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class InstallmentRateTests(TestCase):
+    # A score of 20 falls in the band with a 16% rate floor, so a 10% application is corrected to 16%
+    def setUp(self):
+        customer_summaries.invalidate_all()
+        self.customer = Customer.objects.create(first_name='Asha', last_name='Rao', age=30, phone_number='9000000000',
+                                                monthly_salary=100000, approved_limit=3600000, credit_score=20)
+        self.installment = finance.pmt(finance.monthly_rate(16), 12, 100000)
+
+    def test_degenerate_terms_are_rejected(self):
+        for url in ('/check-eligibility/', '/create-loan/'):
+            for field, value in (('tenure', 0), ('interest_rate', -1200)):
+                with self.subTest(url=url, field=field):
+                    response = self.client.post(url, {'customer_id': self.customer.customer_id,
+                                                      'loan_amount': 100000, 'interest_rate': 10, 'tenure': 12,
+                                                      field: value}, content_type='application/json')
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn(field, response.json())
+
+    def test_eligibility_prices_at_the_corrected_rate(self):
+        response = self.client.post('/check-eligibility/', {'customer_id': self.customer.customer_id,
+                                                            'loan_amount': 100000, 'interest_rate': 10, 'tenure': 12},
+                                    content_type='application/json')
+        self.assertEqual(response.json()['corrected_interest_rate'], 16)
+        self.assertAlmostEqual(response.json()['monthly_installment'], self.installment)
+
+    def test_batch_prices_at_the_corrected_rate(self):
+        results = check_eligibility_bulk([self.customer.customer_id], [100000], [10], [12])
+        self.assertAlmostEqual(results['monthly_installment'][0], self.installment)
+
+    def test_loan_is_booked_with_the_installment_of_its_rate(self):
+        result = originate_loan(self.customer.customer_id, 100000, 10, 12)
+        self.assertEqual(result['loan'].interest_rate, 16)
+        self.assertAlmostEqual(result['loan'].monthly_repayment, self.installment)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class LoanScheduleViewTests(TestCase):
+    def setUp(self):
+        customer = Customer.objects.create(first_name='Asha', last_name='Rao', age=30, phone_number='9000000000',
+                                           monthly_salary=100000, approved_limit=3600000)
+        self.loan = Loan.objects.create(customer=customer, loan_amount=100000, tenure=12, interest_rate=12,
+                                        monthly_repayment=finance.pmt(0.01, 12, 100000), emis_paid_on_time=3,
+                                        start_date='2024-01-01', end_date='2025-01-01')
+
+    def test_missing_schedule_is_built_on_read(self):
+        response = self.client.get(f'/loan-schedule/{self.loan.loan_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['schedule']), 12)
+        self.assertTrue(LoanSchedule.objects.filter(loan=self.loan).exists())
+
+    def test_stale_schedule_is_replaced_in_place(self):
+        LoanSchedule.from_loan(self.loan).save()
+        Loan.objects.filter(pk=self.loan.pk).update(tenure=24, monthly_repayment=finance.pmt(0.01, 24, 100000))
+        response = self.client.get(f'/loan-schedule/{self.loan.loan_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(LoanSchedule.objects.get(loan=self.loan).tenure, 24)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class CustomerIdTests(TestCase):
+    def create(self, **kwargs):
+        return Customer.objects.create(first_name='Asha', last_name='Rao', age=30, phone_number='9000000000',
+                                       monthly_salary=100000, approved_limit=3600000, **kwargs)
+
+    def test_allocated_ids_never_repeat_or_collide_with_the_sequence(self):
+        allocator = IdAllocator(Customer, block_size=5)
+        first = self.create().customer_id
+        # Ingested rows carry their own ids, and the load moves the sequence past them
+        self.create(customer_id=first + 100)
+        reset_sequence(Customer)
+        for _ in range(3):
+            for _ in range(4):
+                self.create(customer_id=allocator.next())
+            for customer_id in allocator.allocate(3):
+                self.create(customer_id=customer_id)
+            self.create()
+        register = {'first_name': 'Asha', 'last_name': 'Rao', 'age': 30, 'monthly_income': 100000,
+                    'phone_number': '9000000000'}
+        response = self.client.post('/register/', register, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/register/bulk/', {'customers': [register] * 5}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        ids = list(Customer.objects.values_list('customer_id', flat=True))
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(ids), 2 + 3 * 8 + 6)
+        self.assertGreater(min(set(ids) - {first, first + 100}), first + 100)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class PaymentTests(TestCase):
+    def setUp(self):
+        customer = Customer.objects.create(first_name='Asha', last_name='Rao', age=30, phone_number='9000000000',
+                                           monthly_salary=100000, approved_limit=3600000)
+        terms = {'customer': customer, 'loan_amount': 100000, 'interest_rate': 12, 'start_date': '2024-01-01',
+                 'end_date': '2030-01-01'}
+        self.nearly_paid = Loan.objects.create(tenure=3, emis_paid_on_time=2, monthly_repayment=34002.21, **terms)
+        self.new = Loan.objects.create(tenure=12, emis_paid_on_time=0, monthly_repayment=8884.88, **terms)
+        self.payments = [
+            {'loan_id': loan.loan_id, 'paid_on': f'2024-0{month}-05', 'amount': 10000, 'on_time': on_time,
+             'reference': f'{loan.loan_id}-{month}'}
+            for loan, month, on_time in ((self.nearly_paid, 1, True), (self.nearly_paid, 2, True),
+                                         (self.new, 1, True), (self.new, 2, False), (self.new, 3, True))]
+
+    def assertEmisPaid(self, nearly_paid, new):
+        self.assertEqual(Loan.objects.get(pk=self.nearly_paid.pk).emis_paid_on_time, nearly_paid)
+        self.assertEqual(Loan.objects.get(pk=self.new.pk).emis_paid_on_time, new)
+
+    def test_replayed_file_is_recorded_once_and_capped_at_tenure(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'payments.csv')
+        pd.DataFrame(self.payments + self.payments[:2]).to_csv(path, index=False)
+
+        stats = load_payments_file(path)
+        self.assertEqual((stats['recorded'], stats['duplicates']), (5, 2))
+        # Two on-time payments against the one EMI left, and two of the three payments on time
+        self.assertEmisPaid(3, 2)
+        self.assertEqual(set(DirtyCustomer.objects.values_list('customer_id', flat=True)),
+                         {self.new.customer_id})
+
+        stats = load_payments_file(path)
+        self.assertEqual((stats['recorded'], stats['duplicates']), (0, 7))
+        self.assertEmisPaid(3, 2)
+
+    def test_reingested_loan_file_keeps_recorded_payments(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'loans.csv')
+        # The file still carries the counts from before the payments, except a later count for the new loan
+        pd.DataFrame([{'Customer ID': loan.customer_id, 'Loan ID': loan.loan_id, 'Loan Amount': loan.loan_amount,
+                       'Tenure': loan.tenure, 'Interest Rate': loan.interest_rate,
+                       'Monthly payment': loan.monthly_repayment, 'EMIs paid on Time': emis,
+                       'Date of Approval': loan.start_date, 'End Date': loan.end_date}
+                      for loan, emis in ((self.nearly_paid, 2), (self.new, 5))]).to_csv(path, index=False)
+
+        self.client.post('/payments/bulk/', {'payments': self.payments}, content_type='application/json')
+        self.assertEmisPaid(3, 2)
+        ingest_file(path, Loan)
+        self.assertEmisPaid(3, 5)
+
+    def test_replayed_request_is_recorded_once(self):
+        for recorded in (5, 0):
+            response = self.client.post('/payments/bulk/', {'payments': self.payments},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['recorded'], recorded)
+            self.assertEmisPaid(3, 2)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class LoanListingTests(TestCase):
+    def setUp(self):
+        customer_summaries.invalidate_all()
+        self.addCleanup(customer_summaries.invalidate_all)
+        self.customer = seed_dataset(2, 23)[0]
+
+    def test_cursor_pages_return_every_loan_once(self):
+        expected = self.client.get(f'/view-loans/{self.customer.customer_id}').json()
+        self.assertGreater(len(expected), 5)
+        for limit in (1, 5, len(expected), 100):
+            with self.subTest(limit=limit):
+                loans, cursor, pages = [], 0, 0
+                while cursor is not None:
+                    response = self.client.get(f'/view-loans/{self.customer.customer_id}?limit={limit}&cursor={cursor}')
+                    self.assertEqual(response.status_code, 200)
+                    loans += response.json()
+                    cursor = response.headers.get('X-Next-Cursor')
+                    pages += 1
+                self.assertEqual(sorted(loans, key=lambda loan: loan['loan_id']),
+                                 sorted(expected, key=lambda loan: loan['loan_id']))
+                self.assertEqual(pages, -(-len(expected) // limit))
+
+    def test_export_streams_every_loan_once(self):
+        expected = list(Loan.objects.order_by('loan_id').values_list('loan_id', flat=True))
+        response = self.client.get('/loans/export/?output=ndjson')
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual([json.loads(line)['loan_id'] for line in lines], expected)
+        response = self.client.get(f'/loans/export/?customer_id={self.customer.customer_id}')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], list(EXPORT_COLUMNS))
+        self.assertEqual([int(row[0]) for row in rows[1:]],
+                         list(self.customer.loan_set.order_by('loan_id').values_list('loan_id', flat=True)))
+
+
+class PortfolioSummaryTests(TestCase):
+    def test_over_cap_follows_the_active_rules(self):
+        # The rule set is rolled back without a delete signal, so the compiled rules are rechecked afterwards
+        self.addCleanup(eligibility_rules.invalidate)
+        for emi in (20000, 40000, 60000):
+            Customer.objects.create(first_name='Asha', last_name='Rao', age=30, phone_number='9000000000',
+                                    monthly_salary=100000, approved_limit=3600000, active_emi_total=emi)
+        EligibilityRuleSet.objects.create(name='tight', is_active=True,
+                                          rules={'emi_to_income_cap': 0.3, 'bands': [{'min_score': 10}]})
+        summary = compute_portfolio_summary()['emi_to_income']
+        self.assertEqual(summary['cap'], 0.3)
+        self.assertEqual(summary['over_cap'], 2)
+
+
+class SnapshotRecomputeTests(TestCase):
+    def test_loans_booked_after_the_export_are_not_overwritten(self):
+        customers = seed_dataset(20, 3, seed=11)
+        recompute_all_customers()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        manifest = export_snapshot(directory=directory, buckets=4)
+
+        booked, drifted = customers[0].customer_id, customers[1].customer_id
+        Customer.objects.filter(customer_id=booked).update(monthly_salary=10 ** 7)
+        self.assertTrue(originate_loan(booked, 100000, 12, 12)['approval'])
+        Customer.objects.filter(customer_id=drifted).update(credit_score=-1)
+        expected = dict(Customer.objects.filter(customer_id=booked).values_list('customer_id', 'active_emi_total'))
+
+        updated = recompute_customers_from_snapshot(os.path.join(directory, manifest['snapshot_id']))
+        self.assertEqual(updated, 2)
+        customer = Customer.objects.get(customer_id=booked)
+        self.assertAlmostEqual(customer.active_emi_total, expected[booked], places=4)
+        totals = DebtLedgerEntry.objects.filter(customer=customer).aggregate(emi=Sum('emi_delta'))
+        self.assertAlmostEqual(totals['emi'] or 0, customer.active_emi_total, places=4)
+        self.assertGreaterEqual(Customer.objects.get(customer_id=drifted).credit_score, 0)
+
+
+class EligibilityRulesTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'rules.json')
+        self.write_rules(DEFAULT_RULES)
+        self.enterContext(override_settings(ELIGIBILITY_RULES_FILE=self.path, ELIGIBILITY_RULES_CHECK_INTERVAL=0))
+        self.loader = EligibilityRules()
+
+    def write_rules(self, rules):
+        with open(self.path, 'w') as file:
+            file.write(rules if isinstance(rules, str) else json.dumps(rules))
+        # Reloads are triggered by a new mtime, which a quick rewrite may not change
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    def test_compiled_rules_match_the_if_elif_chain(self):
+        rng = np.random.default_rng(0)
+        # Whole-number scores hit every band boundary exactly
+        scores = rng.integers(0, 101, 2000).astype(np.float64)
+        rates = rng.uniform(5, 20, 2000).round(2)
+        salaries = rng.uniform(10000, 200000, 2000).round()
+        emis = salaries * rng.uniform(0, 0.8, 2000)
+        rules = self.loader.get()
+        expected = [legacy_check_eligibility(*application) for application in zip(scores, rates, salaries, emis)]
+        self.assertEqual([rules.evaluate(*application) for application in zip(scores, rates, salaries, emis)],
+                         expected)
+        approvals, corrected_interest_rates = rules.evaluate_batch(scores, rates, salaries, emis)
+        self.assertEqual(list(zip(approvals.tolist(), corrected_interest_rates.tolist())), expected)
+
+    def test_file_edit_is_picked_up(self):
+        self.assertEqual(self.loader.get().emi_to_income_cap, 0.5)
+        self.write_rules({**DEFAULT_RULES, 'emi_to_income_cap': 0.4})
+        self.assertEqual(self.loader.get().emi_to_income_cap, 0.4)
+        self.assertEqual(self.loader.reloads, 2)
+
+    def test_invalid_edit_keeps_the_previous_rules(self):
+        previous = self.loader.get()
+        for rules in ('{"emi_to_income_cap": 0.4, "bands": [', {**DEFAULT_RULES, 'bands': []}):
+            with self.subTest(rules=rules):
+                self.write_rules(rules)
+                with self.assertLogs('credit.rules', 'WARNING'):
+                    self.assertIs(self.loader.get(), previous)
+                self.assertIsNotNone(self.loader.last_error)
+                # A failed version is not retried on every check
+                with self.assertNoLogs('credit.rules', 'WARNING'):
+                    self.assertIs(self.loader.get(), previous)
+
+    def test_active_rule_set_overrides_the_file_and_is_picked_up_on_edit(self):
+        self.addCleanup(eligibility_rules.invalidate)
+        rule_set = EligibilityRuleSet.objects.create(name='tight', is_active=True,
+                                                     rules={**DEFAULT_RULES, 'emi_to_income_cap': 0.3})
+        self.assertEqual(self.loader.get().emi_to_income_cap, 0.3)
+        rule_set.rules = {**DEFAULT_RULES, 'emi_to_income_cap': 0.35}
+        rule_set.save()
+        self.assertEqual(self.loader.get().emi_to_income_cap, 0.35)
+        rule_set.is_active = False
+        rule_set.save()
+        self.assertEqual(self.loader.get().emi_to_income_cap, 0.5)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentOriginationTests(TransactionTestCase):
+    # Each loan's EMI is 20% of the salary, so the 50% EMI cap allows three loans per customer and rejects the rest
+    salary = 100000
+    loan_amount = 0.2 * salary / finance.pmt(finance.monthly_rate(12), 12, 1)
+
+    def setUp(self):
+        customer_summaries.invalidate_all()
+        self.customers = [Customer.objects.create(first_name='Stress', last_name=str(index), age=30,
+                                                  phone_number='9000000000', monthly_salary=self.salary,
+                                                  approved_limit=3600000, credit_score=80)
+                          for index in range(3)]
+
+    def originate(self, customer_id):
+        try:
+            return originate_loan(customer_id, self.loan_amount, 12, 12)['approval']
+        finally:
+            connections.close_all()
+
+    def recompute_until(self, done):
+        try:
+            while not done.is_set():
+                recompute_all_customers(chunk_size=2)
+        finally:
+            connections.close_all()
+
+    def test_parallel_originations_stay_within_the_cap_and_match_the_ledger(self):
+        targets = [customer.customer_id for customer in self.customers] * 8
+        done = threading.Event()
+        with ThreadPoolExecutor(8) as pool:
+            # Full recomputes run alongside, as an ingest finishing during the day would
+            recompute = pool.submit(self.recompute_until, done)
+            approvals = list(pool.map(self.originate, targets))
+            done.set()
+            recompute.result()
+
+        self.assertEqual(sum(approvals), 3 * len(self.customers))
+        emis = defaultdict(float)
+        for customer_id, monthly_repayment in Loan.objects.order_by('loan_id').values_list('customer_id',
+                                                                                          'monthly_repayment'):
+            self.assertLessEqual(emis[customer_id], self.salary * 0.5, 'loan approved past the EMI cap')
+            emis[customer_id] += monthly_repayment
+
+        recompute_all_customers()
+        for customer in Customer.objects.all():
+            totals = DebtLedgerEntry.objects.filter(customer=customer).aggregate(debt=Sum('debt_delta'),
+                                                                                 emi=Sum('emi_delta'))
+            last = DebtLedgerEntry.objects.filter(customer=customer).latest('id')
+            self.assertAlmostEqual(totals['debt'], customer.current_debt, places=4)
+            self.assertAlmostEqual(totals['emi'], customer.active_emi_total, places=4)
+            self.assertAlmostEqual(last.debt_after, customer.current_debt, places=4)
+            self.assertAlmostEqual(customer.active_emi_total, emis[customer.customer_id], places=4)
+
+
+class FileShardTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.frame = pd.DataFrame({'Customer ID': np.arange(1, 1001), 'Monthly Salary': np.arange(1000.0, 2000.0)})
+        self.paths = [os.path.join(directory.name, 'customers.csv'), os.path.join(directory.name, 'customers.parquet')]
+        self.frame.to_csv(self.paths[0], index=False)
+        self.frame.to_parquet(self.paths[1], index=False, row_group_size=150)
+
+    def test_row_ranges_cover_every_row_once(self):
+        for path in self.paths:
+            for shard_count in (1, 3, 7):
+                with self.subTest(path=path, shard_count=shard_count):
+                    ids = [customer_id for shard_index in range(shard_count)
+                           for chunk in iter_file_chunks(path, 64, shard_index, shard_count)
+                           for customer_id in chunk['customer_id'].tolist()]
+                    self.assertEqual(ids, self.frame['Customer ID'].tolist())
+
+    def test_excel_is_not_sharded(self):
+        with self.assertRaises(ValueError):
+            next(iter_file_chunks('customers.xlsx', 64, 0, 2))
+
+
+class IngestCheckpointTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'customers.csv')
+        pd.DataFrame({'Customer ID': np.arange(1, 101), 'First Name': 'Asha', 'Last Name': 'Rao', 'Age': 30,
+                      'Phone Number': 9000000000, 'Monthly Salary': 100000, 'Approved Limit': 3600000}
+                     ).to_csv(self.path, index=False)
+
+    def test_interrupted_load_resumes_after_its_last_committed_chunk(self):
+        load = BulkInsertLoader.load
+        calls = []
+
+        def fail_on_third_chunk(loader, chunk, update_columns):
+            calls.append(chunk['customer_id'].iloc[0])
+            if len(calls) == 3:
+                raise RuntimeError('connection lost')
+            return load(loader, chunk, update_columns)
+
+        with mock.patch.object(BulkInsertLoader, 'load', fail_on_third_chunk):
+            with self.assertRaises(RuntimeError):
+                ingest_file(self.path, Customer, chunk_size=25)
+        tracking = IngestionFile.objects.get()
+        self.assertEqual((tracking.status, tracking.chunks_committed), (IngestionFile.STATUS_FAILED, 2))
+        self.assertEqual(Customer.objects.count(), 50)
+
+        calls.clear()
+        with mock.patch.object(BulkInsertLoader, 'load', autospec=True, side_effect=load) as resumed_load:
+            stats = ingest_file(self.path, Customer, chunk_size=25)
+        self.assertEqual(stats['resumed_from_chunk'], 2)
+        self.assertEqual(stats['rows_read'], 50)
+        self.assertEqual([call.args[1]['customer_id'].iloc[0] for call in resumed_load.call_args_list], [51, 76])
+        self.assertEqual(Customer.objects.count(), 100)
+        self.assertEqual(IngestionFile.objects.get().status, IngestionFile.STATUS_COMPLETED)
+
+    def test_completed_file_is_skipped(self):
+        ingest_file(self.path, Customer, chunk_size=25)
+        with mock.patch.object(BulkInsertLoader, 'load') as load:
+            stats = ingest_file(self.path, Customer, chunk_size=25)
+        load.assert_not_called()
+        self.assertTrue(stats['skipped'])
+        self.assertEqual(stats['rows_read'], 100)
+
+
+class ShardedIngestTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(INGEST_CONVERTED_DIR=directory.name, INGEST_SHARDS=3))
+        # Shards run inline, in the order the chain and chord would run them on workers
+        always_eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', always_eager)
+
+    def test_workbooks_fan_out_into_row_range_shards(self):
+        run = IngestRun.objects.get(pk=ingest_data())
+        self.assertEqual(run.status, IngestRun.STATUS_COMPLETED)
+        for table_name, workbook in (('credit_customer', 'customer_data.xlsx'), ('credit_loan', 'loan_data.xlsx')):
+            with self.subTest(table_name=table_name):
+                shards = run.shards.filter(table_name=table_name)
+                self.assertEqual(shards.count(), 3)
+                self.assertFalse(shards.exclude(state=IngestShard.STATE_COMPLETED).exists())
+                self.assertTrue(all(shard.file_path.endswith('.csv') for shard in shards))
+                rows = sum(len(chunk) for chunk in iter_file_chunks(os.path.join(settings.STATIC_DIR, workbook),
+                                                                    1000))
+                self.assertEqual(sum(shard.rows_read for shard in shards), rows)
+        self.assertTrue(Loan.objects.exists())
+
+    def test_workbooks_are_converted_once(self):
+        ingest_data()
+        with mock.patch('credit.ingestion.iter_excel_chunks') as iter_excel_chunks:
+            run = IngestRun.objects.get(pk=ingest_data())
+        iter_excel_chunks.assert_not_called()
+        # Same converted files, so every shard is skipped as already loaded
+        self.assertTrue(all(shard.skipped for shard in run.shards.all()))
+
+
+class FinalizeIngestTests(TestCase):
+    def test_recompute_failure_fails_the_run(self):
+        run = IngestRun.objects.create(shard_count=1)
+        IngestShard.objects.create(run=run, table_name='credit_loan', file_path='loans.csv', shard_index=0,
+                                   rows_written=1)
+        with mock.patch('credit.tasks.recompute_all_customers', side_effect=RuntimeError('disk full')):
+            with self.assertRaises(RuntimeError):
+                finalize_ingest(run.pk)
+        run.refresh_from_db()
+        self.assertEqual(run.status, IngestRun.STATUS_FAILED)
+        self.assertEqual(run.error, 'disk full')
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class RequestLogTests(TransactionTestCase):
+    def test_request_mix_replays_every_endpoint(self):
+        customers = seed_dataset(20, 2)
+        run = IngestRun.objects.create(shard_count=1, status=IngestRun.STATUS_COMPLETED)
+        loan_ids = list(Loan.objects.values_list('loan_id', flat=True))
+        log = [entry for name, _ in REQUEST_MIX
+               for entry in generate_request_log([customer.customer_id for customer in customers], loan_ids, 1,
+                                                 ingest_run_id=run.pk, batch_size=5, mix=[(name, 1)])]
+
+        routes = {str(pattern.pattern) for pattern in get_resolver().url_patterns if isinstance(pattern, URLPattern)}
+        self.assertEqual({resolve(entry['path'].split('?', 1)[0]).route for entry in log}, routes - {'fill-data/'})
+        for entry in log:
+            with self.subTest(path=entry['path']):
+                if entry['method'] == 'GET':
+                    response = self.client.get(entry['path'])
+                else:
+                    response = self.client.post(entry['path'], entry['body'], content_type='application/json')
+                self.assertLess(response.status_code, 500)
+
+
+class FinanceTests(SimpleTestCase):
+    """credit.finance against numpy_financial over random loans: monthly rates up to 5% (a tenth of them exactly
+    zero), tenures up to 40 years and any number of EMIs paid."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        count = 5000
+        self.rates = rng.uniform(1e-6, 0.05, count)
+        self.rates[rng.random(count) < 0.1] = 0.0
+        self.nper = rng.integers(1, 481, count).astype(np.float64)
+        self.principal = rng.uniform(1, 1e7, count)
+        self.payments = finance.pmt(self.rates, self.nper, self.principal)
+        self.paid = np.floor(rng.random(count) * (self.nper + 1))
+        # Balances are differences of terms as large as principal * growth, which bounds their rounding error
+        self.magnitude = self.principal * (1 + self.rates) ** self.nper
+        # numpy_financial divides by zero rates before discarding the result
+        self.enterContext(np.errstate(divide='ignore', invalid='ignore'))
+
+    def assertClose(self, actual, expected, rtol=1e-9, atol=1e-6):
+        actual, expected = np.asarray(actual, dtype=np.float64), np.asarray(expected, dtype=np.float64)
+        bad = ~np.isclose(actual, expected, rtol=rtol, atol=atol)
+        if bad.any():
+            index = np.flatnonzero(bad)[0]
+            self.fail(f'{bad.sum()} cases differ, e.g. {actual.flat[index]!r} != {expected.flat[index]!r}')
+
+    def test_pmt_matches_numpy_financial(self):
+        self.assertClose(self.payments, npf.pmt(self.rates, self.nper, -self.principal))
+
+    def test_fv_matches_numpy_financial(self):
+        self.assertClose(finance.fv(self.rates, self.paid, self.payments, self.principal),
+                         npf_balance(self.rates, self.paid, self.payments, self.principal), atol=1e-9 * self.magnitude)
+
+    def test_scalar_path_matches_array_path(self):
+        sample = slice(0, 500)
+        terms = [values[sample].tolist() for values in (self.rates, self.nper, self.principal, self.payments,
+                                                        self.paid)]
+        self.assertClose([finance.pmt(rate, nper, principal) for rate, nper, principal, _, _ in zip(*terms)],
+                         self.payments[sample], rtol=1e-12, atol=0)
+        self.assertClose([finance.fv(rate, paid, payment, principal)
+                          for rate, _, principal, payment, paid in zip(*terms)],
+                         finance.fv(self.rates[sample], self.paid[sample], self.payments[sample],
+                                    self.principal[sample]),
+                         rtol=1e-12, atol=1e-12 * self.magnitude[sample])
+
+    def test_pmt_repays_the_principal(self):
+        self.assertClose(finance.fv(self.rates, self.nper, self.payments, self.principal), 0, rtol=0,
+                         atol=1e-12 * self.magnitude)
+
+    def test_zero_rate_is_straight_line(self):
+        zero = self.rates == 0
+        self.assertClose(self.payments[zero], self.principal[zero] / self.nper[zero], rtol=0, atol=0)
+        self.assertEqual(finance.pmt(0, 12, 1200), 100)
+        self.assertEqual(finance.fv(0, 3, 100, 1200), 900)
+
+    def test_near_zero_rates_converge_to_the_zero_rate_payment(self):
+        tiny = np.full(len(self.nper), 1e-12)
+        self.assertClose(finance.pmt(tiny, self.nper, self.principal), self.principal / self.nper, rtol=1e-9, atol=0)
+        self.assertAlmostEqual(finance.pmt(1e-12, 12, 1200), 100, places=6)
+
+    def test_schedules_pay_off_the_principal(self):
+        for index in np.flatnonzero(self.nper <= 120)[:200].tolist():
+            with self.subTest(case=index):
+                tenure, atol = int(self.nper[index]), 1e-12 * self.magnitude[index]
+                payment, principal = self.payments[index], self.principal[index]
+                table = finance.schedule(self.rates[index], tenure, payment, principal)
+                self.assertClose(table[:, 2], finance.fv(self.rates[index], np.arange(tenure + 1), payment, principal),
+                                 rtol=0, atol=atol)
+                self.assertLessEqual(abs(table[-1, 2]), atol)
+                self.assertClose(table[1:, 0].sum(), principal)
+                self.assertClose(table[1:, 0] + table[1:, 1], payment, rtol=1e-12)
+
+    def test_degenerate_terms_are_nan_on_both_paths(self):
+        # No periods to repay over, a rate of -100% and one below it
+        rates, nper = [0.01, 0.0, -1.0, -2.0], [0, 0, 12, 12]
+        self.assertTrue(np.isnan(finance.pmt(np.array(rates), np.array(nper), 1000)).all())
+        for rate, periods in zip(rates, nper):
+            with self.subTest(rate=rate, nper=periods):
+                self.assertTrue(np.isnan(finance.pmt(rate, periods, 1000)))
+        self.assertTrue(np.isnan(finance.fv(-1.0, 3, 100, 1000)))
+        self.assertTrue(np.isnan(finance.fv(np.array([-1.0, -2.0]), 3, 100, 1000)).all())
+
+    def test_remaining_balance_is_owed_after_the_emis_paid(self):
+        annual = self.rates * 1200
+        expected = np.maximum(npf_balance(self.rates, self.paid, self.payments, self.principal), 0)
+        self.assertClose(finance.remaining_balance(annual, self.nper, self.paid, self.payments, self.principal),
+                         expected, atol=1e-9 * self.magnitude)
+        self.assertEqual(finance.remaining_balance(12, 12, 0, finance.pmt(0.01, 12, 1000), 1000), 1000)
+        self.assertEqual(finance.remaining_balance(12, 12, 15, finance.pmt(0.01, 12, 1000), 1000), 0)
@@ -1,80 +1,181 @@
 import datetime
+from itertools import islice
 
-from django.db.models import QuerySet
-import numpy_financial as npf
+from django.db.models import Count, Q, QuerySet, Sum
+from django.db.models.functions import Coalesce
+import numpy as np
 
+from credit import finance
+from credit.db import IdAllocator
+from credit.instrumentation import span
 from credit.models import Customer, Loan
+from credit.rules import CompiledRules, eligibility_rules
 
 
-def calculate_credit_score(loans: Loan, customer: Customer) -> int:
-    current_year = datetime.datetime.now().year
-    number_of_past_loans = loans.count()
-    loan_activity_current_year = 0
-    loan_approved_volume = 0
-    total_emis_paid_on_time = 0
-    total_emis_tenure = 0
-    current_loans_sum = sum(loan.loan_amount for loan in loans if loan.start_date.year == current_year)
-
-    if number_of_past_loans > 0:
-        max_loan_amount = max(loan.loan_amount for loan in loans)
-    else:
-        max_loan_amount = 1  # Avoid division by zero by setting a default value
-
-    for loan in loans:
-        total_emis_paid_on_time += loan.emis_paid_on_time
-        total_emis_tenure += loan.tenure
-        if loan.start_date.year == current_year:
-            loan_activity_current_year += 1
-        loan_approved_volume = 1.8
-
-    past_loans_paid_on_time_ratio = (total_emis_paid_on_time / total_emis_tenure) if total_emis_tenure else 0
-
-    # Initial credit score calculation
-    credit_score = (past_loans_paid_on_time_ratio * 25 + 
-                    number_of_past_loans * 25 + 
-                    loan_activity_current_year * 25 + 
+def iter_chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+# Customer ids for registrations, reserved from the customer id sequence
+customer_ids = IdAllocator(Customer)
+
+
+def approved_limits(monthly_incomes):
+    """36 months of income rounded up to the nearest lakh, for a scalar or an array of incomes."""
+    return np.ceil(np.asarray(monthly_incomes, dtype=np.float64) * 36 / 100000).astype(np.int64) * 100000
+
+
+# Every past loan contributes a flat approved-volume component to the score.
+LOAN_APPROVED_VOLUME = 1.8
+
+
+def loan_stats_aggregates(current_year: int = None, today: datetime.date = None) -> dict:
+    """Aggregate expressions for every scoring input, usable with aggregate() or values().annotate()."""
+    current_year = current_year or datetime.datetime.now().year
+    today = today or datetime.date.today()
+    return {
+        'past_loans': Count('loan_id'),
+        'emis_paid_on_time': Coalesce(Sum('emis_paid_on_time'), 0),
+        'emis_tenure': Coalesce(Sum('tenure'), 0),
+        'current_year_loans': Count('loan_id', filter=Q(start_date__year=current_year)),
+        'approved_volume': Coalesce(Sum('loan_amount'), 0.0),
+        'active_emi_total': Coalesce(Sum('monthly_repayment', filter=Q(end_date__gt=today)), 0.0),
+    }
+
+
+@span('scoring')
+def get_loan_stats(customer_id: int) -> dict:
+    # A single aggregate query replaces the count + full row fetch of the old scoring loop
+    return Loan.objects.filter(customer_id=customer_id).aggregate(**loan_stats_aggregates())
+
+
+def credit_score_from_stats(stats: dict) -> float:
+    number_of_past_loans = stats['past_loans']
+    total_emis_tenure = stats['emis_tenure']
+    past_loans_paid_on_time_ratio = (stats['emis_paid_on_time'] / total_emis_tenure) if total_emis_tenure else 0
+    loan_approved_volume = LOAN_APPROVED_VOLUME if number_of_past_loans > 0 else 0
+
+    credit_score = (past_loans_paid_on_time_ratio * 25 +
+                    number_of_past_loans * 25 +
+                    stats['current_year_loans'] * 25 +
                     loan_approved_volume * 25)
 
     return min(credit_score, 100)  # Ensure credit score does not exceed 100
 
 
-def check_eligibility(credit_score: float, interest_rate: float, customer: Customer, loans: QuerySet):
+def credit_scores_from_arrays(past_loans, emis_paid_on_time, emis_tenure, current_year_loans) -> np.ndarray:
+    """Vectorized credit_score_from_stats over per-customer stat arrays."""
+    past_loans = np.asarray(past_loans, dtype=np.float64)
+    emis_paid_on_time = np.asarray(emis_paid_on_time, dtype=np.float64)
+    emis_tenure = np.asarray(emis_tenure, dtype=np.float64)
+    current_year_loans = np.asarray(current_year_loans, dtype=np.float64)
+
+    ratio = np.divide(emis_paid_on_time, emis_tenure, out=np.zeros_like(emis_paid_on_time),
+                      where=emis_tenure != 0)
+    loan_approved_volume = np.where(past_loans > 0, LOAN_APPROVED_VOLUME, 0.0)
+
+    credit_scores = ratio * 25 + past_loans * 25 + current_year_loans * 25 + loan_approved_volume * 25
+    return np.minimum(credit_scores, 100)
+
+
+def refresh_customer_score(customer_id: int) -> float:
+    """Recompute and persist the cached credit_score and active_emi_total of one customer."""
+    stats = get_loan_stats(customer_id)
+    credit_score = credit_score_from_stats(stats)
+    Customer.objects.filter(customer_id=customer_id).update(credit_score=credit_score,
+                                                            active_emi_total=stats['active_emi_total'])
+    return credit_score
+
+
+@span('scoring')
+def get_customer_scoring_bulk(customer_ids, chunk_size: int = 500) -> tuple:
+    """Cached scoring columns for many customers, fetched with chunked primary-key IN queries.
+
+    Returns the sorted unique ids and a dict of aligned arrays; customers that do not exist have a NaN salary.
+    """
+    fields = ('monthly_salary', 'credit_score', 'active_emi_total')
+    unique_ids = np.unique(np.asarray(customer_ids, dtype=np.int64))
+    columns = {field: np.full(len(unique_ids), np.nan) for field in fields}
+
+    for start in range(0, len(unique_ids), chunk_size):
+        chunk = unique_ids[start:start + chunk_size].tolist()
+        rows = np.array(list(Customer.objects.filter(customer_id__in=chunk).values_list('customer_id', *fields)),
+                        dtype=np.float64).reshape(-1, len(fields) + 1)
+        positions = np.searchsorted(unique_ids, rows[:, 0])
+        for column, field in enumerate(fields, start=1):
+            columns[field][positions] = rows[:, column]
+
+    return unique_ids, columns
+
+
+@span('eligibility')
+def check_eligibility_batch(credit_scores, interest_rates, monthly_salaries, active_emi_totals,
+                            rules: CompiledRules = None) -> tuple:
+    """Vectorized check_eligibility returning (approvals, corrected_interest_rates) arrays."""
+    rules = rules or eligibility_rules.get()
+    return rules.evaluate_batch(credit_scores, interest_rates, monthly_salaries, active_emi_totals)
+
+
+@span('eligibility')
+def check_eligibility_bulk(customer_ids, loan_amounts, interest_rates, tenures, rules: CompiledRules = None) -> dict:
+    """Check a batch of applications with a few IN queries and array math; returns aligned result arrays."""
+    customer_ids = np.asarray(customer_ids, dtype=np.int64)
+    loan_amounts = np.asarray(loan_amounts, dtype=np.float64)
+    interest_rates = np.asarray(interest_rates, dtype=np.float64)
+    tenures = np.asarray(tenures, dtype=np.int64)
+
+    unique_ids, customers = get_customer_scoring_bulk(customer_ids)
+    positions = np.searchsorted(unique_ids, customer_ids)
+    monthly_salaries = customers['monthly_salary'][positions]
+    found = ~np.isnan(monthly_salaries)
+
+    approvals, corrected_interest_rates = check_eligibility_batch(customers['credit_score'][positions],
+                                                                  interest_rates, monthly_salaries,
+                                                                  customers['active_emi_total'][positions], rules)
+    approvals &= found
+    monthly_installments = np.where(approvals, finance.pmt(finance.monthly_rate(corrected_interest_rates), tenures,
+                                                           loan_amounts), 0)
+
+    return {
+        'customer_id': customer_ids,
+        'found': found,
+        'approval': approvals,
+        'interest_rate': interest_rates,
+        'corrected_interest_rate': corrected_interest_rates,
+        'tenure': tenures,
+        'monthly_installment': monthly_installments,
+    }
+
+
+def calculate_credit_score(loans: QuerySet, customer: Customer) -> float:
+    return credit_score_from_stats(loans.aggregate(**loan_stats_aggregates()))
+
+
+@span('eligibility')
+def check_eligibility(credit_score: float, interest_rate: float, customer: Customer, loans: QuerySet = None,
+                      active_emi_total: float = None, rules: CompiledRules = None):
     monthly_salary = customer.monthly_salary
-    total_emi = sum(loan.monthly_repayment for loan in loans if loan.end_date > datetime.date.today())
-    
-    if total_emi > monthly_salary * 0.5:
-        return False, interest_rate  # No loan approval if EMIs exceed 50% of monthly salary
-
-    approval = False
-    corrected_interest_rate = interest_rate
-    
-    if credit_score > 50:
-        approval = True
-    elif 50 >= credit_score > 30:
-        approval = True
-        corrected_interest_rate = max(interest_rate, 12)
-    elif 30 >= credit_score > 10:
-        approval = True
-        corrected_interest_rate = max(interest_rate, 16)
-    elif credit_score <= 10:
-        approval = False  # Do not approve any loans
-
-    # Correct the interest rate in the response based on the credit score
-    if corrected_interest_rate != interest_rate:
-        interest_rate = corrected_interest_rate
-    
-    return approval, interest_rate
+    if active_emi_total is None:
+        active_emi_total = customer.active_emi_total if loans is None else \
+            loans.aggregate(**loan_stats_aggregates())['active_emi_total']
 
+    # Score bands, rate floors and the EMI cap come from the compiled eligibility rules
+    rules = rules or eligibility_rules.get()
+    return rules.evaluate(credit_score, interest_rate, monthly_salary, active_emi_total)
 
-def calculate_remaining_loan_balance(loan):
-    monthly_interest_rate = loan.interest_rate / 12 / 100
-
-    # Calculate the number of payments already made
-    payments_made = loan.emis_paid_on_time
 
-    # The remaining balance is the future value of the remaining payments
-    remaining_balance = npf.fv(rate=monthly_interest_rate, nper=loan.tenure - payments_made,
-                               pmt=-loan.monthly_repayment,
-                               pv=loan.loan_amount, when='end')
-
-    return abs(remaining_balance)
\ No newline at end of file
+def calculate_remaining_loan_balance(loan):
+    return finance.remaining_balance(loan.interest_rate, loan.tenure, loan.emis_paid_on_time, loan.monthly_repayment,
+                                     loan.loan_amount)
+
+
+def calculate_remaining_loan_balances(interest_rates, tenures, emis_paid_on_time, monthly_repayments,
+                                      loan_amounts) -> np.ndarray:
+    """Vectorized calculate_remaining_loan_balance over aligned loan column arrays."""
+    return finance.remaining_balance(np.asarray(interest_rates, dtype=np.float64),
+                                     np.asarray(tenures, dtype=np.float64),
+                                     np.asarray(emis_paid_on_time, dtype=np.float64),
+                                     np.asarray(monthly_repayments, dtype=np.float64),
+                                     np.asarray(loan_amounts, dtype=np.float64))
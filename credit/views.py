@@ -1,19 +1,24 @@
-from django.shortcuts import render
-import datetime
-from decimal import Decimal
-import numpy_financial as npf
-from dateutil.relativedelta import relativedelta
+import json
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from . import utils
+from . import finance, utils
+from .cache import customer_summaries
+from .db import pool_stats
+from .instrumentation import PROMETHEUS_CONTENT_TYPE, render_metrics, span
+from .listings import EXPORT_CONTENT_TYPES, export_queryset, iter_export, loan_page
+from .origination import originate_loan
+from .payments import record_payments
+from .policy import DEFAULT_SCENARIO, load_customers, simulate_policies
+from .portfolio import compute_portfolio_summary, get_snapshot, refresh_snapshot
+from .rendering import SINGLE_LOAN_DETAIL, FastJSONResponse
+from .rules import eligibility_rules
 from .serializers import *
-from .models import Customer, Loan
-import math, random
+from .models import Customer, IngestRun, Loan, LoanSchedule
 from .tasks import ingest_data
-from .utils import calculate_remaining_loan_balance
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 
 # Create your views here.
 
@@ -23,75 +28,163 @@ class Home(APIView):
 
 class FillDataView(APIView):
     def get(self, request):
-        ingest_data.delay()
+        run = IngestRun.objects.create(shard_count=settings.INGEST_SHARDS)
+        # The worker must see the run row, so the task is only queued once this request commits
+        transaction.on_commit(lambda: ingest_data.delay(run.pk))
         return Response({
-            "Data Filled": True
+            "Data Filled": True,
+            "run_id": run.pk,
         })
 
 
+class IngestProgressView(APIView):
+    def get(self, request, run_id):
+        try:
+            run = IngestRun.objects.prefetch_related('shards').get(pk=run_id)
+        except ObjectDoesNotExist:
+            return Response({
+                'error': 'Ingest run not found.'
+            }, status=404)
+        return Response(IngestRunSerializer(run).data)
+
+
+def registration_response(customer):
+    return {
+        'customer_id': customer.customer_id,
+        'name': f"{customer.first_name} {customer.last_name}",
+        'age': customer.age,
+        'monthly_income': customer.monthly_salary,
+        'approved_limit': customer.approved_limit,
+        'phone_number': customer.phone_number
+    }
+
+
+def build_customer(customer_id, data, approved_limit):
+    return Customer(
+        customer_id=customer_id,
+        first_name=data['first_name'],
+        last_name=data['last_name'],
+        phone_number=data['phone_number'],
+        age=data['age'],
+        monthly_salary=data['monthly_income'],
+        approved_limit=approved_limit,
+    )
+
+
 class RegisterView(APIView):
     def post(self, request):
         serializer = RegisterSerializer(data=request.data)
         if serializer.is_valid():
             data = serializer.validated_data
-            approved_limit = math.ceil(data['monthly_income'] * 36 / 100000) * 100000
-            customer_id = random.randint(10000, 99999)
-            customer = Customer.objects.create(
-                customer_id=customer_id,
-                first_name=data['first_name'],
-                last_name=data['last_name'],
-                phone_number=data['phone_number'],
-                age=data['age'],
-                monthly_salary=data['monthly_income'],
-                approved_limit=approved_limit,
-            )
-            return Response({
-                'customer_id': customer.customer_id,
-                'name': f"{customer.first_name} {customer.last_name}",
-                'age': data['age'],
-                'monthly_income': data['monthly_income'],
-                'approved_limit': approved_limit,
-                'phone_number': data['phone_number']
-            })
+            approved_limit = int(utils.approved_limits(data['monthly_income']))
+            # Ids come from the customer sequence, so they never collide however large the table grows
+            customer = build_customer(utils.customer_ids.next(), data, approved_limit)
+            customer.save(force_insert=True)
+            return Response(registration_response(customer))
         return Response(serializer.errors, status=400)
 
 
+class RegisterBulkView(APIView):
+    def post(self, request):
+        serializer = RegisterBulkRequestSerializer(data=request.data)
+        if serializer.is_valid():
+            records = serializer.validated_data['customers']
+            approved_limits = utils.approved_limits([data['monthly_income'] for data in records]).tolist()
+            customer_ids = utils.customer_ids.allocate(len(records))
+            customers = [build_customer(customer_id, data, approved_limit)
+                         for customer_id, data, approved_limit in zip(customer_ids, records, approved_limits)]
+            Customer.objects.bulk_create(customers, batch_size=1000)
+            return Response({'customers': [registration_response(customer) for customer in customers]})
+        return Response(serializer.errors, status=400)
+
+
+def eligibility_response(customer, validated_data, rules=None):
+    """Build the response of one eligibility check against a customer with cached scoring columns.
+
+    The values are already of the types CheckEligibilityResponseSerializer would produce, so the response is
+    rendered as is instead of being validated again.
+    """
+    loan_amount = validated_data['loan_amount']
+    interest_rate = validated_data['interest_rate']
+    tenure = validated_data['tenure']
+    # Determine loan approval and interest rates
+    approval, corrected_interest_rate = utils.check_eligibility(credit_score=customer.credit_score,
+                                                                interest_rate=interest_rate, customer=customer,
+                                                                rules=rules)
+
+    # Calculate monthly installment if approved, at the rate the loan would be booked at
+    if approval:
+        with span('installment'):
+            monthly_installment = finance.pmt(finance.monthly_rate(corrected_interest_rate), tenure, loan_amount)
+    else:
+        monthly_installment = 0
+
+    return {
+        'customer_id': validated_data['customer_id'],
+        'approval': bool(approval),
+        'interest_rate': interest_rate,
+        'corrected_interest_rate': float(corrected_interest_rate),
+        'tenure': tenure,
+        'monthly_installment': float(monthly_installment)
+    }
+
+
 class CheckEligibilityView(APIView):
     def post(self, request):
         serializer = CheckEligibilityRequestSerializer(data=request.data)
         if serializer.is_valid():
             # Retrieve customer and loan data
             customer_id = serializer.validated_data['customer_id']
-            customer = Customer.objects.get(customer_id=customer_id)
-            loans = Loan.objects.filter(customer_id=customer_id)
-            credit_score = utils.calculate_credit_score(loans=loans, customer=customer)
-
-            loan_amount = serializer.validated_data['loan_amount']
-            interest_rate = serializer.validated_data['interest_rate']
-            tenure = serializer.validated_data['tenure']
-            # Determine loan approval and interest rates
-            approval, corrected_interest_rate = utils.check_eligibility(credit_score=credit_score,
-                                                                        interest_rate=interest_rate, customer=customer,
-                                                                        loans=loans)
-
-            # Calculate monthly installment if approved
-            if approval:
-                monthly_installment = npf.pmt(rate=interest_rate / 12, nper=tenure, pv=-loan_amount)
-            else:
-                monthly_installment = 0
+            # Score and active EMI total are cached on the customer row, which is itself served from the
+            # customer summary cache on repeated checks
+            try:
+                customer = Customer(**customer_summaries.get(customer_id)['customer'])
+            except ObjectDoesNotExist:
+                return Response({
+                    'error': 'Customer not found.'
+                }, status=404)
+            return FastJSONResponse(eligibility_response(customer, serializer.validated_data))
+        return Response(serializer.errors, status=400)
 
-            response_data = {
-                'customer_id': customer_id,
-                'approval': approval,
-                'interest_rate': interest_rate,
-                'corrected_interest_rate': corrected_interest_rate,
-                'tenure': tenure,
-                'monthly_installment': monthly_installment
-            }
-            response_serializer = CheckEligibilityResponseSerializer(data=response_data)
-            if response_serializer.is_valid():
-                return Response(response_serializer.data)
-            return Response(response_serializer.errors, status=400)
+
+class CheckEligibilityBatchView(APIView):
+    # Applications are checked, encoded and flushed a block at a time, so neither the results nor the response
+    # are ever held in memory as a whole and the first rows go out before the last ones are checked
+    stream_block_size = 1000
+
+    def post(self, request):
+        serializer = CheckEligibilityBatchRequestSerializer(data=request.data)
+        if serializer.is_valid():
+            return StreamingHttpResponse(self.iter_ndjson(serializer.validated_data['applications']),
+                                         content_type='application/x-ndjson')
+        return Response(serializer.errors, status=400)
+
+    def iter_ndjson(self, applications):
+        columns = ('customer_id', 'approval', 'interest_rate', 'corrected_interest_rate', 'tenure',
+                   'monthly_installment')
+        # The whole batch is checked against the same rules, even if they are reloaded while it streams
+        rules = eligibility_rules.get()
+        for start in range(0, len(applications['customer_id']), self.stream_block_size):
+            block = slice(start, start + self.stream_block_size)
+            results = utils.check_eligibility_bulk(customer_ids=applications['customer_id'][block],
+                                                   loan_amounts=applications['loan_amount'][block],
+                                                   interest_rates=applications['interest_rate'][block],
+                                                   tenures=applications['tenure'][block], rules=rules)
+            rows = zip(*(results[column].tolist() for column in columns))
+            lines = []
+            for row_found, row in zip(results['found'], rows):
+                if row_found:
+                    lines.append(json.dumps(dict(zip(columns, row))))
+                else:
+                    lines.append(json.dumps({'customer_id': row[0], 'error': 'Customer not found.'}))
+            yield '\n'.join(lines) + '\n'
+
+
+class PaymentsBulkView(APIView):
+    def post(self, request):
+        serializer = PaymentsBulkRequestSerializer(data=request.data)
+        if serializer.is_valid():
+            return Response(record_payments(serializer.validated_data['payments']))
         return Response(serializer.errors, status=400)
 
 
@@ -100,58 +193,21 @@ class CreateLoanView(APIView):
         serializer = CreateLoanRequestSerializer(data=request.data)
         if serializer.is_valid():
             customer_id = serializer.validated_data['customer_id']
-            loan_amount = serializer.validated_data['loan_amount']
-            interest_rate = serializer.validated_data['interest_rate']
-            tenure = serializer.validated_data['tenure']
-
-            customer = Customer.objects.get(customer_id=customer_id)
-            loans = Loan.objects.filter(customer_id=customer_id)
-
-            credit_score = utils.calculate_credit_score(loans=loans, customer=customer)
-
-            loan_approved, corrected_interest_rate = utils.check_eligibility(credit_score=credit_score,
-                                                                             interest_rate=interest_rate,
-                                                                             customer=customer,
-                                                                             loans=loans)
-            message = 'Loan approved' if loan_approved else 'Loan not approved'
-            monthly_installment = npf.pmt(rate=interest_rate / 12, nper=tenure, pv=-loan_amount)
-
-            start_date = datetime.datetime.today().date()
-
-            end_date = start_date + relativedelta(months=+tenure)
-
-            if loan_approved:
-                with transaction.atomic():
-                    loan = Loan.objects.create(
-                        customer=customer,
-                        loan_amount=loan_amount,
-                        interest_rate=corrected_interest_rate,
-                        tenure=tenure,
-                        start_date=start_date,
-                        end_date=end_date,
-                        emis_paid_on_time=0,
-                        monthly_repayment=monthly_installment
-                    )
-                    loan_id = loan.loan_id
-                    customer.customer_id += calculate_remaining_loan_balance(loan)
-                    customer.save()
-
-                response_data = {
-                    'loan_id': loan_id,
-                    'customer_id': customer_id,
-                    'loan_approved': loan_approved,
-                    'message': message,
-                    'monthly_installment': monthly_installment,
-                }
-
-            else:
-                response_data = {
-                    'loan_id': None,
-                    'customer_id': customer_id,
-                    'loan_approved': loan_approved,
-                    'message': message,
-                    'monthly_installment': None,
-                }
+            try:
+                result = originate_loan(customer_id=customer_id,
+                                        loan_amount=serializer.validated_data['loan_amount'],
+                                        interest_rate=serializer.validated_data['interest_rate'],
+                                        tenure=serializer.validated_data['tenure'])
+            except Customer.DoesNotExist:
+                return Response({'error': 'Customer not found.'}, status=404)
+
+            response_data = {
+                'loan_id': result['loan'].loan_id if result['loan'] else None,
+                'customer_id': customer_id,
+                'loan_approved': result['approval'],
+                'message': result['message'],
+                'monthly_installment': result['monthly_installment'],
+            }
             response_serializer = CreateLoanResponseSerializer(data=response_data)
             if response_serializer.is_valid():
                 return Response(response_serializer.data)
@@ -161,24 +217,129 @@ class CreateLoanView(APIView):
 
 class ViewLoanView(APIView):
     def get(self, request, loan_id):
-        # Retrieve the loan by ID or return 404 if not found
-        loan = Loan.objects.filter(loan_id=loan_id).first()
-        loan.customer_info = Customer.objects.get(customer_id=loan.customer_id)
-        # Serialize the loan data
-        serializer = SingleLoanDetailSerializer(instance=loan)
+        # Retrieve the loan and its customer in one query or return 404 if not found
+        loan = SINGLE_LOAN_DETAIL.values(Loan.objects.filter(loan_id=loan_id)).first()
+        if loan is None:
+            return Response({
+                'error': 'Loan not found.'
+            }, status=404)
+        return FastJSONResponse(SINGLE_LOAN_DETAIL.row(loan))
+
 
+class LoanScheduleView(APIView):
+    def get(self, request, loan_id):
+        loan = Loan.objects.select_related('schedule').filter(loan_id=loan_id).first()
+        if loan is None:
+            return Response({
+                'error': 'Loan not found.'
+            }, status=404)
+        try:
+            schedule = loan.schedule
+        except LoanSchedule.DoesNotExist:
+            schedule = None
+        if schedule is None or not schedule.matches(loan):
+            # Loans loaded before schedules existed, or edited since, are built on first read. An upsert, so
+            # concurrent first reads of the same loan cannot collide on the schedule's primary key
+            schedule = LoanSchedule.from_loan(loan)
+            LoanSchedule.objects.bulk_create([schedule], update_conflicts=True, unique_fields=['loan'],
+                                             update_fields=[*LoanSchedule.TERM_FIELDS, 'payments'])
+
+        month = request.query_params.get('month')
+        if month is not None:
+            try:
+                month = int(month)
+                schedule.balance_at(month)
+            except (ValueError, IndexError):
+                return Response({
+                    'month': [f'Must be an integer between 0 and {schedule.tenure}.']
+                }, status=400)
+        serializer = LoanScheduleSerializer(schedule, context={'emis_paid_on_time': loan.emis_paid_on_time,
+                                                               'month': month})
         return Response(serializer.data)
 
 
 class ViewLoansView(APIView):
     def get(self, request, customer_id):
+        if 'cursor' in request.query_params or 'limit' in request.query_params:
+            return self.get_page(request, customer_id)
         # Ensure the customer exists
         try:
-            customer = Customer.objects.get(customer_id=customer_id)
-            loans = Loan.objects.filter(customer_id=customer_id, end_date__gte=datetime.date.today())
-            serializer = LoanDetailSerializer(loans, many=True)
-            return Response(serializer.data)
-        except ObjectDoesNotExist as e:
+            loans = customer_summaries.get(customer_id)['loans']
+            return FastJSONResponse(loans)
+        except ObjectDoesNotExist:
             return Response({
                 'error': 'Customer not found.'
             }, status=404)
+
+    def get_page(self, request, customer_id):
+        # Keyset pages are read straight from the loan table, so a page costs the same however deep it is
+        serializer = LoanPageSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+        loans, next_cursor = loan_page(customer_id, serializer.validated_data['cursor'],
+                                       serializer.validated_data.get('limit'))
+        if not loans and not Customer.objects.filter(customer_id=customer_id).exists():
+            return Response({
+                'error': 'Customer not found.'
+            }, status=404)
+        response = FastJSONResponse(loans)
+        if next_cursor is not None:
+            response['X-Next-Cursor'] = str(next_cursor)
+        return response
+
+
+class LoanExportView(APIView):
+    def get(self, request):
+        serializer = LoanExportRequestSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+        output = serializer.validated_data['output']
+        loans = export_queryset(customer_id=serializer.validated_data.get('customer_id'),
+                                active=serializer.validated_data['active'])
+        response = StreamingHttpResponse(iter_export(loans, output), content_type=EXPORT_CONTENT_TYPES[output])
+        response['Content-Disposition'] = f'attachment; filename="loans.{output}"'
+        return response
+
+
+class PortfolioSummaryView(APIView):
+    def get(self, request):
+        if not settings.PORTFOLIO_SNAPSHOT_ENABLED:
+            return Response({**compute_portfolio_summary(), 'snapshot': False})
+        # The beat task keeps the snapshot fresh; ?refresh=1 recomputes it now
+        summary = None if request.query_params.get('refresh') in ('1', 'true') else get_snapshot()
+        if summary is not None:
+            return Response({**summary, 'snapshot': True})
+        return Response({**refresh_snapshot(), 'snapshot': False})
+
+
+class PolicySimulationView(APIView):
+    def post(self, request):
+        serializer = PolicySimulationRequestSerializer(data=request.data)
+        if serializer.is_valid():
+            policies = serializer.validated_data['policies']
+            scenario = {**DEFAULT_SCENARIO, **serializer.validated_data['scenario']}
+            customers = load_customers()
+            return Response({
+                'customers': len(customers['credit_score']),
+                'scenario': scenario,
+                # A single process: forking a worker pool inside a web worker is left to the simulate_policies
+                # command
+                'policies': simulate_policies(policies, scenario=scenario, customers=customers, workers=1),
+            })
+        return Response(serializer.errors, status=400)
+
+
+class CacheStatsView(APIView):
+    def get(self, request):
+        return Response(customer_summaries.stats())
+
+
+class PoolStatsView(APIView):
+    def get(self, request):
+        return Response(pool_stats())
+
+
+class MetricsView(APIView):
+    def get(self, request):
+        return HttpResponse(render_metrics(cache_stats=customer_summaries.stats(), pool_stats=pool_stats()),
+                            content_type=PROMETHEUS_CONTENT_TYPE)